@@ -0,0 +1,717 @@
+#! /usr/bin/env python3.7
+
+# Benchmarks for calculate.py
+
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+from itertools import islice
+from itertools import product
+from math import log
+from random import Random
+from sys import argv
+from sys import executable
+from sys import exit
+from sys import getsizeof
+from time import perf_counter
+
+from binaryoutput import runBinaryBatch
+from calculate import *
+from columns import runColumns
+from formulas import FormulaGraph
+from incremental import Session
+from optimize import evaluateBatch
+from optimize import internBatch
+from vectorize import evaluateGrouped
+
+def generateExpression(length, depth = 0, operators = "+-*/", floatRatio = 0.25, seed = 0):
+    """
+    Generates a random valid math expression.
+    Parameters: length - The number of numbers in the expression.
+                depth - How deeply parentheses are nested. Groups are opened
+                at evenly spaced points and all closed at the end.
+                operators - The binary operators to choose from.
+                floatRatio - The fraction of numbers that have a decimal point.
+                seed - The random seed, so runs are repeatable.
+    Returns: The math expression string.
+    Numbers are never zero and groups never follow "/", so the expression
+    never divides by zero.
+    """
+    random = Random(seed)
+    groupSpacing = max(1, length // (depth + 1))
+    openGroups = 0
+    items = []
+    for i in range(length):
+        if i > 0:
+            op = random.choice(operators)
+            if openGroups < depth and i % groupSpacing == 0:
+                if op == "/":
+                    op = "*"
+                items += [op, "("]
+                openGroups += 1
+            else:
+                items.append(op)
+        if random.random() < floatRatio:
+            items.append("%d.%d" % (random.randint(0, 99), random.randint(1, 9)))
+        else:
+            items.append(str(random.randint(1, 99)))
+    return " ".join(items) + ")" * openGroups
+
+def rate(function, minTime = 0.2):
+    """
+    Measures how many times per second a function can be called.
+    Parameters: function - The function to call, with no arguments.
+                minTime - The minimum number of seconds to measure for.
+    Returns: Calls per second.
+    """
+    calls = 0
+    batch = 1
+    start = perf_counter()
+    elapsed = 0
+    while elapsed < minTime:
+        for i in range(batch):
+            function()
+        calls += batch
+        batch *= 2
+        elapsed = perf_counter() - start
+    return calls / elapsed
+
+def benchCompile(lengths = (10, 100, 1000, 10000)):
+    """
+    Compares evaluatePostfix with functions made by compilePostfix.
+    Parameters: lengths - The expression lengths, in numbers, to measure.
+    """
+    print("%8s %16s %16s %8s" % ("numbers", "interpreted/s", "compiled/s", "speedup"))
+    for length in lengths:
+        postfix = compileExpression(generateExpression(length))
+        function = compilePostfix(postfix)
+        interpreted = rate(lambda: evaluatePostfix(postfix))
+        compiled = rate(function)
+        print("%8d %16.0f %16.0f %7.1fx" % (length, interpreted, compiled, compiled / interpreted))
+
+def postfixSize(postfix):
+    """
+    Measures the memory used by a postfix list and the objects in it. Objects
+    that appear more than once, such as operators, are counted once.
+    Parameters: postfix - The postfix expression.
+    Returns: The size in bytes.
+    """
+    unique = {id(item): item for item in postfix}
+    return getsizeof(postfix) + sum(getsizeof(item) for item in unique.values())
+
+def benchCompact(lengths = (10, 1000, 100000)):
+    """
+    Compares postfix lists of strings (from convertToPostfix), lists of
+    converted numbers (from compileExpression) and CompactPrograms, by memory
+    per postfix item and evaluatePostfix speed.
+    Parameters: lengths - The expression lengths, in numbers, to measure.
+    """
+    print("%8s %-10s %12s %14s" % ("numbers", "form", "bytes/item", "items/s"))
+    for length in lengths:
+        input = generateExpression(length)
+        forms = {
+            "strings": convertToPostfix(validateSyntax(parse(input))),
+            "converted": compileExpression(input),
+        }
+        forms["compact"] = CompactProgram(forms["converted"])
+        for name, postfix in forms.items():
+            size = postfix.size() if name == "compact" else postfixSize(postfix)
+            calls = rate(lambda: evaluatePostfix(postfix))
+            print("%8d %-10s %12.1f %14.0f" % (length, name, size / len(postfix), calls * len(postfix)))
+
+def multiPassPostfix(input):
+    """
+    Converts a math expression to postfix with the separate parse,
+    validateSyntax and convertToPostfix passes, and converts its numbers.
+    Parameters: input - The math expression string.
+    Returns: The postfix expression.
+    """
+    return [item if item in ops else toNumber(item) for item in convertToPostfix(validateSyntax(parse(input)))]
+
+def benchParse(lengths = (10, 100, 1000, 10000)):
+    """
+    Compares the multi-pass pipeline with parseToPostfix.
+    Parameters: lengths - The expression lengths, in numbers, to measure.
+    """
+    print("%8s %16s %16s %8s" % ("numbers", "multi-pass/s", "single-pass/s", "speedup"))
+    for length in lengths:
+        input = generateExpression(length)
+        assert multiPassPostfix(input) == parseToPostfix(input)
+        multiPass = rate(lambda: multiPassPostfix(input))
+        singlePass = rate(lambda: parseToPostfix(input))
+        print("%8d %16.0f %16.0f %7.1fx" % (length, multiPass, singlePass, singlePass / multiPass))
+
+# The stages timed by benchStages. Each entry is (name, function, input),
+# where input names the stage whose output the function takes.
+stages = [
+    ("parse", parse, "input"),
+    ("validateSyntax", validateSyntax, "parse"),
+    ("convertToPostfix", convertToPostfix, "validateSyntax"),
+    ("evaluatePostfix", evaluatePostfix, "convertToPostfix"),
+    ("parseToPostfix", parseToPostfix, "input"),
+]
+
+# Expression sizes, in tokens, for the scaling curves.
+stageSizes = [10, 100, 1000, 10000, 100000, 1000000]
+
+# Sizes below this are too quick to time reliably, so the regression check
+# ignores them.
+minCheckedSize = 1000
+
+baselinePath = "bench_baseline.json"
+
+def stageTime(function, argument, minTime = 0.05):
+    """
+    Measures the time a pipeline stage takes for one expression.
+    Parameters: function - The stage function.
+                argument - The argument to call it with.
+                minTime - Calls are repeated until they take this many seconds.
+    Returns: The best time for one call, in seconds.
+    """
+    best = None
+    total = 0
+    calls = 1
+    while total < minTime or best is None:
+        start = perf_counter()
+        for i in range(calls):
+            function(argument)
+        elapsed = perf_counter() - start
+        total += elapsed
+        best = elapsed / calls if best is None else min(best, elapsed / calls)
+        calls *= 2
+    return best
+
+def measureStages(tokens, workload):
+    """
+    Times each stage of the pipeline on a generated expression.
+    Parameters: tokens - The approximate number of tokens in the expression.
+                workload - Keyword arguments for generateExpression.
+    Returns: A dictionary mapping each stage name to nanoseconds per token.
+    """
+    input = generateExpression((tokens + 1) // 2, **workload)
+    actualTokens = len(parse(input))
+    outputs = {"input": input}
+    results = {}
+    for name, function, inputName in stages:
+        argument = outputs[inputName]
+        seconds = stageTime(function, argument)
+        outputs[name] = function(argument)
+        results[name] = seconds * 1e9 / actualTokens
+    return results
+
+def scalingExponent(curve):
+    """
+    Estimates how a stage's time grows with expression size, as the slope of
+    log(time) against log(tokens) between the smallest checked size and the
+    largest size.
+    Parameters: curve - A dictionary mapping sizes to nanoseconds per token.
+    Returns: The exponent: about 1 for linear stages, 2 for quadratic ones.
+    None if there are not enough sizes to tell.
+    """
+    sizes = sorted(size for size in curve if size >= minCheckedSize)
+    if len(sizes) < 2:
+        return None
+    small = sizes[0]
+    large = sizes[-1]
+    smallTime = curve[small] * small
+    largeTime = curve[large] * large
+    return log(largeTime / smallTime) / log(large / small)
+
+def checkStages(curves, baseline, tolerance, maxExponent):
+    """
+    Compares stage timings with a stored baseline.
+    Parameters: curves - A dictionary mapping stage names to dictionaries of
+                size to nanoseconds per token.
+                baseline - The baseline, in the same form as curves.
+                tolerance - How much slower than the baseline a stage may get,
+                as a fraction, before it counts as a regression.
+                maxExponent - The largest scaling exponent that still counts as
+                linear.
+    Returns: A list of problems found. An empty list means the check passed.
+    """
+    problems = []
+    for name, curve in curves.items():
+        for size, nsPerToken in sorted(curve.items()):
+            if size < minCheckedSize or str(size) not in baseline.get(name, {}):
+                continue
+            expected = baseline[name][str(size)]
+            if nsPerToken > expected * (1 + tolerance):
+                problems.append("%s at %d tokens: %.0f ns/token, baseline %.0f"
+                                % (name, size, nsPerToken, expected))
+        exponent = scalingExponent(curve)
+        if exponent is not None and exponent > maxExponent:
+            problems.append("%s scales as tokens^%.2f" % (name, exponent))
+    return problems
+
+def benchStages(options = None):
+    """
+    Times each pipeline stage at sizes from 10 to 10^6 tokens and prints
+    nanoseconds per token, throughput and the scaling exponent of each stage.
+    Parameters: options - Command line options:
+                --max-tokens=N - The largest size to measure.
+                --depth=N, --operators=OPS, --float-ratio=R - The workload.
+                --save-baseline - Store the results in bench_baseline.json.
+                --check - Compare with bench_baseline.json and exit with
+                status 1 on a regression or superlinear stage.
+                --tolerance=R - Allowed slowdown for --check (default 0.5).
+                --max-exponent=E - Allowed scaling exponent (default 1.2).
+    """
+    options = options or {}
+    maxTokens = int(options.get("max-tokens", stageSizes[-1]))
+    workload = {
+        "depth": int(options.get("depth", 0)),
+        "operators": options.get("operators", "+-*/"),
+        "floatRatio": float(options.get("float-ratio", 0.25)),
+    }
+    sizes = [size for size in stageSizes if size <= maxTokens]
+    curves = {name: {} for name, function, inputName in stages}
+    print("%-18s %9s %12s %14s" % ("stage", "tokens", "ns/token", "tokens/s"))
+    for size in sizes:
+        for name, nsPerToken in measureStages(size, workload).items():
+            curves[name][size] = nsPerToken
+            print("%-18s %9d %12.0f %14.0f" % (name, size, nsPerToken, 1e9 / nsPerToken))
+    for name, curve in curves.items():
+        exponent = scalingExponent(curve)
+        if exponent is not None:
+            print("%-18s scales as tokens^%.2f" % (name, exponent))
+
+    if "save-baseline" in options:
+        with open(baselinePath, "w") as baselineFile:
+            baseline = {name: {str(size): round(nsPerToken, 1) for size, nsPerToken in curve.items()}
+                        for name, curve in curves.items()}
+            json.dump({"workload": workload, "stages": baseline}, baselineFile, indent = 2)
+            baselineFile.write("\n")
+    if "check" in options:
+        with open(baselinePath) as baselineFile:
+            baseline = json.load(baselineFile)
+        if baseline["workload"] != workload:
+            print("Baseline was measured with a different workload: " + str(baseline["workload"]))
+            exit(1)
+        tolerance = float(options.get("tolerance", 0.5))
+        maxExponent = float(options.get("max-exponent", 1.2))
+        problems = checkStages(curves, baseline["stages"], tolerance, maxExponent)
+        for problem in problems:
+            print("Regression: " + problem)
+        if problems:
+            exit(1)
+        print("No regressions")
+
+def benchBackends(length = 100):
+    """
+    Compares the numeric backends on expressions with only ints, and with
+    ints and decimals mixed.
+    Parameters: length - The expression length, in numbers.
+    """
+    workloads = {
+        "ints": generateExpression(length, operators = "+-*", floatRatio = 0),
+        "ints with /": generateExpression(length, floatRatio = 0),
+        "mixed": generateExpression(length),
+    }
+    print("%-12s" % "backend" + "".join("%14s" % name for name in workloads))
+    for name, backend in backends.items():
+        rates = [rate(lambda: calculate(input, backend)) for input in workloads.values()]
+        print("%-12s" % name + "".join("%12.0f/s" % calls for calls in rates))
+
+def benchIncremental(length = 50000, depths = (0, 10, 100), edits = 200):
+    """
+    Compares evaluating an edited expression with a Session against
+    evaluating it again with calculate, for single-digit edits at random
+    places in an expression of about 10^5 tokens.
+    Parameters: length - The expression length, in numbers.
+                depths - The nesting depths to measure.
+                edits - The number of edits to time for each depth.
+    """
+    random = Random(0)
+    print("%6s %12s %14s %14s %8s" % ("depth", "full ms", "edit p50 ms", "edit p90 ms", "speedup"))
+    for depth in depths:
+        input = generateExpression(length, depth, floatRatio = 0)
+        start = perf_counter()
+        calculate(input)
+        full = perf_counter() - start
+        session = Session(input)
+        session.result()
+        digits = [i for i, char in enumerate(input) if char in "123456789"]
+        times = []
+        for i in range(edits):
+            offset = random.choice(digits)
+            start = perf_counter()
+            session.edit(offset, 1, random.choice("123456789"))
+            session.result()
+            times.append(perf_counter() - start)
+        assert session.result() == calculate(session.text)
+        times.sort()
+        median = times[len(times) // 2]
+        print("%6d %12.1f %14.3f %14.3f %7.0fx" % (depth, full * 1e3, median * 1e3,
+                                                  times[len(times) * 9 // 10] * 1e3, full / median))
+
+def benchFormulas(inputs = 100, formulas = 10000):
+    """
+    Compares recomputing the formulas that depend on one changed input with
+    evaluating every formula again.
+    Parameters: inputs - The number of input values.
+                formulas - The number of formulas. Each uses an input and an
+                input or earlier formula, so one input reaches many of them.
+    """
+    random = Random(0)
+    graph = FormulaGraph()
+    for i in range(inputs):
+        graph.setValue("in%d" % i, random.randint(1, 99))
+    names = ["in%d" % i for i in range(inputs)]
+    for i in range(formulas):
+        graph.define("f%d" % i, "in%d * 2 + %s" % (random.randrange(inputs), random.choice(names)))
+        names.append("f%d" % i)
+    start = perf_counter()
+    graph.recompute()
+    full = perf_counter() - start
+    recomputed = 0
+    start = perf_counter()
+    for i in range(inputs):
+        graph.setValue("in%d" % i, random.randint(1, 99))
+        recomputed += graph.recompute()
+    changes = (perf_counter() - start) / inputs
+    print("all %d formulas: %.1f ms" % (formulas + inputs, full * 1e3))
+    print("after changing one input: %.2f ms, %d formulas on average" % (changes * 1e3, recomputed / inputs))
+
+def benchGrouped(count = 100000, shapes = 10, length = 4):
+    """
+    Compares evaluating a batch of expressions that share a few shapes one at
+    a time with calculate and grouped with evaluateGrouped.
+    Parameters: count - The number of expressions.
+                shapes - The number of different shapes.
+                length - The numbers in each expression.
+    """
+    random = Random(0)
+    templates = [numberPattern.sub("{}", generateExpression(length, seed = i)) for i in range(shapes)]
+    expressions = []
+    for i in range(count):
+        template = random.choice(templates)
+        numbers = ["%d.%d" % (random.randint(0, 99), random.randint(1, 9)) if random.random() < 0.25
+                   else str(random.randint(1, 99)) for j in range(template.count("{}"))]
+        expressions.append(template.format(*numbers))
+    start = perf_counter()
+    expected = []
+    for input in expressions:
+        try:
+            expected.append(calculate(input))
+        except CalculationError as error:
+            expected.append(error)
+    single = perf_counter() - start
+    start = perf_counter()
+    results = evaluateGrouped(expressions)
+    grouped = perf_counter() - start
+    assert [repr(result) for result in results] == [repr(result) for result in expected]
+    print("%d expressions, %d shapes: calculate %.0f ms, evaluateGrouped %.0f ms (%.1fx)"
+          % (count, shapes, single * 1e3, grouped * 1e3, single / grouped))
+
+def benchColumns(sizes = (10 ** 5, 10 ** 6), sample = 10000):
+    """
+    Applies an expression to every row of generated CSV files with runColumns,
+    and prints the time per row and the peak memory use of the process after
+    each file, against calculate on each row of a sample.
+    Parameters: sizes - The numbers of rows, in increasing order.
+                sample - The number of rows to evaluate with calculate.
+    """
+    input = "(price - cost) / price"
+    random = Random(0)
+    for size in sizes:
+        path = tempfile.mkstemp(suffix = ".csv")[1]
+        try:
+            with open(path, "w") as file:
+                file.write("price,cost\n")
+                for i in range(size):
+                    file.write("%d.%02d,%d\n" % (random.randint(1, 999), random.randint(0, 99), random.randint(0, 999)))
+            fileSize = os.path.getsize(path)
+            start = perf_counter()
+            runColumns(input, path, os.devnull)
+            elapsed = perf_counter() - start
+            with open(path) as file:
+                rows = [line.rstrip("\n").split(",") for line in islice(file, 1, sample + 1)]
+        finally:
+            os.remove(path)
+        start = perf_counter()
+        for price, cost in rows:
+            calculate("(" + price + " - " + cost + ") / " + price)
+        single = (perf_counter() - start) / len(rows)
+        # ru_maxrss is in kilobytes on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print("%d rows (%.0f MB): runColumns %.0f ms (%.2f us/row), calculate %.2f us/row, peak memory %.0f MB"
+              % (size, fileSize / 1e6, elapsed * 1e3, elapsed * 1e6 / size, single * 1e6, peak))
+
+def benchOperators(length = 10000, counts = (0, 10, 100, 1000)):
+    """
+    Measures parsing and evaluating the same expression while more and more
+    operators and functions are registered, to show that the time per token
+    does not depend on how many there are.
+    Parameters: length - The expression length, in numbers.
+                counts - The numbers of extra operators and extra functions
+                to register, in increasing order.
+    """
+    input = generateExpression(length, 10) + " + 7 % 3 ^ 2 // 2 * max(2, sqrt(4))" * (length // 100)
+    postfix = parseToPostfix(input)
+    tokens = len(parse(input))
+    # Symbols of two and three characters that are not in the expression.
+    symbols = ["".join(chars) for size in (2, 3) for chars in product("<>&|!?@$#:;=", repeat = size)]
+    registered = 0
+    print("%8s %14s %14s" % ("extra", "parse", "evaluate"))
+    try:
+        for count in counts:
+            while registered < count:
+                registerOperator(symbols[registered], registered % 4, add)
+                registerFunction("f%d" % registered, abs)
+                registered += 1
+            parseTime = 1 / rate(lambda: parseToPostfix(input))
+            evaluateTime = 1 / rate(lambda: evaluatePostfix(postfix))
+            print("%8d %8.0f ns/token %8.0f ns/token"
+                  % (count, parseTime * 1e9 / tokens, evaluateTime * 1e9 / tokens))
+    finally:
+        for i in range(registered):
+            unregisterOperator(symbols[i])
+            unregisterOperator("f%d" % i)
+
+def benchCache(runs = 20):
+    """
+    Compares the time to start calculate.py and print a result with a cache
+    hit against evaluating without the cache, for a short expression and for
+    a slow one.
+    Parameters: runs - The number of times each command is run. The fastest
+                run is reported.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        for input in ["1 + 2 * 3", generateExpression(20000)]:
+            times = []
+            for options in [[], ["--cache=" + directory]]:
+                command = [executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculate.py")]
+                command += options + [input]
+                # The first run stores the result, so the others are hits.
+                subprocess.run(command, stdout = subprocess.DEVNULL)
+                fastest = None
+                for i in range(runs):
+                    start = perf_counter()
+                    subprocess.run(command, stdout = subprocess.DEVNULL)
+                    elapsed = perf_counter() - start
+                    fastest = elapsed if fastest is None else min(fastest, elapsed)
+                times.append(fastest)
+            print("%6d characters: %.1f ms without cache, %.1f ms with a hit"
+                  % (len(input), times[0] * 1e3, times[1] * 1e3))
+    finally:
+        shutil.rmtree(directory)
+
+def benchDedup(count = 5000, subterms = 20, length = 20):
+    """
+    Compares evaluating a batch of expressions that share a few subterms one
+    at a time with calculate and as one shared graph, with each backend.
+    Every expression is still parsed, so sharing pays off when the shared
+    subterms are expensive to compute, as large powers are.
+    Parameters: count - The number of expressions.
+                subterms - The number of different shared subterms.
+                length - The numbers in each subterm besides its power.
+    """
+    random = Random(0)
+    shared = ["(%s + %d ^ %d %% 1000003)" % (generateExpression(length, seed = i), random.randint(2, 9),
+                                             random.randint(20000, 40000))
+              for i in range(subterms)]
+    expressions = ["%s %s %d" % (random.choice(shared), random.choice("+-*/"), random.randint(1, 99))
+                   for i in range(count)]
+    for name, backend in backends.items():
+        start = perf_counter()
+        expected = []
+        for input in expressions:
+            try:
+                expected.append(calculate(input, backend))
+            except CalculationError as error:
+                expected.append(error)
+        single = perf_counter() - start
+        start = perf_counter()
+        program = internBatch(expressions, backend)
+        results = evaluateBatch(program, backend)
+        batch = perf_counter() - start
+        assert [repr(result) for result in results] == [repr(result) for result in expected]
+        print("%-10s calculate %6.0f ms, internBatch and evaluateBatch %6.0f ms (%.1fx), dedup ratio %.1f"
+              % (name, single * 1e3, batch * 1e3, single / batch, program.dedupRatio()))
+
+def benchBinary(count = 200000, rows = 10 ** 6, rounds = 3):
+    """
+    Compares writing batch results as text, one line each, against writing
+    them as a float64 column with runBinaryBatch, and the same for
+    runColumns. Each is run rounds times, interleaved, and the fastest run
+    is reported with the size of its output.
+    Parameters: count - The number of batch expressions, of one operator each.
+                rows - The number of CSV rows for runColumns.
+                rounds - The number of times each is run.
+    """
+    random = Random(0)
+    directory = tempfile.mkdtemp()
+    try:
+        expressions = os.path.join(directory, "expressions.txt")
+        with open(expressions, "w") as file:
+            for i in range(count):
+                file.write("%d.%d %s %d\n" % (random.randint(1, 999), random.randint(0, 99), random.choice("+-*/"),
+                                               random.randint(1, 999)))
+        table = os.path.join(directory, "table.csv")
+        with open(table, "w") as file:
+            file.write("price,cost\n")
+            for i in range(rows):
+                file.write("%d.%02d,%d\n" % (random.randint(1, 999), random.randint(0, 99), random.randint(1, 999)))
+        text = os.path.join(directory, "results.txt")
+        binary = os.path.join(directory, "results.bin")
+
+        def batchText():
+            with open(expressions, buffering = batchBufferSize) as lines:
+                with open(text, "w", buffering = batchBufferSize) as output:
+                    evaluateStream(lines, output, ExpressionCache())
+
+        runs = [("batch", "text", batchText, text),
+                ("batch", "binary", lambda: runBinaryBatch(expressions, binary), binary),
+                ("columns", "text", lambda: runColumns("(price - cost) / price", table, text), text),
+                ("columns", "binary", lambda: runColumns("(price - cost) / price", table, binary,
+                                                         columnType = "float64"), binary)]
+        fastest = {}
+        sizes = {}
+        for round in range(rounds):
+            for name, kind, run, path in runs:
+                start = perf_counter()
+                run()
+                elapsed = perf_counter() - start
+                fastest[name, kind] = min(fastest.get((name, kind), elapsed), elapsed)
+                sizes[name, kind] = os.path.getsize(path)
+        for name, size in [("batch", count), ("columns", rows)]:
+            print("%-8s %7d results: text %5.0f ms (%.1f MB), binary %5.0f ms (%.1f MB), %.2fx"
+                  % (name, size, fastest[name, "text"] * 1e3, sizes[name, "text"] / 1e6,
+                     fastest[name, "binary"] * 1e3, sizes[name, "binary"] / 1e6,
+                     fastest[name, "text"] / fastest[name, "binary"]))
+    finally:
+        shutil.rmtree(directory)
+
+def writeLargeExpression(path, tokens, depth):
+    """
+    Writes a large math expression to a file a piece at a time.
+    Parameters: path - The file to write.
+                tokens - The approximate number of tokens.
+                depth - How many parentheses the expression is nested in.
+    """
+    blockNumbers = 1000
+    blocks = max(1, tokens // (2 * blockNumbers))
+    with open(path, "w") as file:
+        file.write("(" * depth)
+        for i in range(blocks):
+            if i > 0:
+                file.write(" + ")
+            file.write(generateExpression(blockNumbers, seed = i))
+        file.write(")" * depth + "\n")
+
+def benchLimits(count = 5000, length = 20, size = 10 ** 6, rounds = 10):
+    """
+    Measures the cost of evaluating within Limits on ordinary expressions,
+    and how quickly expressions over the limits are rejected.
+    Parameters: count - The number of ordinary expressions.
+                length - The numbers in each ordinary expression.
+                size - The size of the adversarial expressions, in tokens.
+                rounds - How many times the ordinary expressions are timed.
+    """
+    from time import monotonic
+    limits = Limits(maxLength = 1 << 20, maxTokens = 1 << 16, maxDepth = 1000, maxIntBits = 1 << 13,
+                    maxSteps = 1 << 16, deadline = monotonic() + 3600)
+    expressions = [generateExpression(length, seed = i) for i in range(count)]
+    # The runs with and without limits take turns, and the fastest of each
+    # is kept, so changes in the machine's load affect both alike.
+    timings = [float("inf")] * 2
+    for run in range(rounds):
+        for index, expressionLimits in enumerate([None, limits]):
+            start = perf_counter()
+            for input in expressions:
+                try:
+                    calculate(input, None, expressionLimits)
+                except CalculationError:
+                    pass
+            timings[index] = min(timings[index], perf_counter() - start)
+    print("%d expressions: %.0f ms without limits, %.0f ms with limits (%+.0f%%)"
+          % (count, timings[0] * 1e3, timings[1] * 1e3, (timings[1] / timings[0] - 1) * 100))
+    adversarial = {
+        "nested parens": "(" * size + "1" + ")" * size,
+        "many tokens": " + ".join(["1"] * (size // 2)),
+        "squaring chain": "3" + " ^ 2" * 40,
+    }
+    for name, input in adversarial.items():
+        start = perf_counter()
+        try:
+            calculate(input, None, limits._replace(maxLength = None))
+        except CalculationError as error:
+            message = error.message
+        print("%-15s rejected in %.2f ms: %s" % (name, (perf_counter() - start) * 1e3, message))
+
+def benchThreads(count = 20000, length = 20, threads = (1, 2, 4, 8)):
+    """
+    Measures how many expressions per second one shared Calculator evaluates
+    from thread pools of different sizes. The Calculator takes no locks, so
+    on free-threaded builds of Python the rate grows with the threads; with
+    the global interpreter lock it stays about the same.
+    Parameters: count - The number of expressions.
+                length - The numbers in each expression.
+                threads - The thread pool sizes.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    calculator = Calculator()
+    expressions = [calculator.compile(generateExpression(length, seed = i)) for i in range(count)]
+    expected = calculator.map(expressions)
+    for size in threads:
+        with ThreadPoolExecutor(size) as executor:
+            start = perf_counter()
+            results = list(executor.map(calculator.run, expressions, chunksize = 256))
+            elapsed = perf_counter() - start
+        assert [repr(result) for result in results] == [repr(result) for result in expected]
+        print("%2d threads: %8.0f expressions/s" % (size, count / elapsed))
+
+def benchStress(tokens = 10 ** 7, depth = 100000):
+    """
+    Evaluates an expression of about 10^7 tokens nested 10^5 deep from a file,
+    and prints the time taken and the peak memory use of the process.
+    Parameters: tokens - The approximate number of tokens.
+                depth - How many parentheses the expression is nested in.
+    """
+    path = tempfile.mkstemp(suffix = ".txt")[1]
+    try:
+        writeLargeExpression(path, tokens, depth)
+        size = os.path.getsize(path)
+        start = perf_counter()
+        result = evaluateFile(path)
+        elapsed = perf_counter() - start
+    finally:
+        os.remove(path)
+    # ru_maxrss is in kilobytes on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("%d tokens, depth %d, %.0f MB file" % (tokens, depth, size / 1e6))
+    print("result %r in %.1f s (%.0f ns/token), peak memory %.0f MB"
+          % (result, elapsed, elapsed * 1e9 / tokens, peak))
+
+benchmarks = {
+    "backends": benchBackends,
+    "binary": benchBinary,
+    "cache": benchCache,
+    "columns": benchColumns,
+    "compact": benchCompact,
+    "compile": benchCompile,
+    "dedup": benchDedup,
+    "formulas": benchFormulas,
+    "grouped": benchGrouped,
+    "incremental": benchIncremental,
+    "limits": benchLimits,
+    "operators": benchOperators,
+    "parse": benchParse,
+    "stages": benchStages,
+    "stress": benchStress,
+    "threads": benchThreads,
+}
+
+if __name__ == "__main__":
+    options, names = parseOptions(argv[1:])
+    # The stress benchmark takes a long time, so it only runs when named.
+    for name in names or [name for name in benchmarks if name != "stress"]:
+        print(name)
+        if name == "stages":
+            benchStages(options)
+        else:
+            benchmarks[name]()
@@ -0,0 +1,218 @@
+#! /usr/bin/env python3.7
+
+# Writes results as a packed binary column instead of a line of text each,
+# for batch jobs whose results are read by other programs. Formatting every
+# result as text can cost more than computing it, and the text then has to
+# be parsed again; a binary column is written in large blocks and can be
+# memory mapped as it is.
+#
+# A column is a file of little-endian float64 or int64 values, one per
+# result, in input order, and a validity bitmap in the file of the same name
+# followed by ".valid": bit i % 8 of byte i // 8 is 1 if result i is valid.
+# Invalid results, such as lines that could not be evaluated, are NaN in a
+# float64 column and 0 in an int64 column. A path ending in ".npy" is written
+# in NumPy's .npy format, so numpy.load(path, mmap_mode = "r") maps it.
+
+from array import array
+from sys import byteorder
+from sys import stderr
+from sys import stdin
+
+from calculate import ExpressionCache
+from calculate import batchBufferSize
+from calculate import evaluateExpression
+from calculate import openLines
+
+# The array typecode and the .npy type of each column type.
+columnTypes = {"float64": ("d", "<f8"), "int64": ("q", "<i8")}
+
+# Values are written this many at a time. A multiple of 8, so each block of
+# values has whole bytes of the bitmap.
+blockRows = 1 << 16
+
+# The size of the .npy header. It is written first with the number of rows
+# left blank and filled in when the column is closed, so it has room for any
+# number of rows.
+npyHeaderSize = 128
+
+# Maps the bytes 0 and 1 to the characters "0" and "1", for packBits.
+bitCharacters = bytes.maketrans(b"\x00\x01", b"01")
+
+minInt64 = -1 << 63
+maxInt64 = (1 << 63) - 1
+
+def packBits(flags):
+    """
+    Packs flags into a bitmap, least significant bit first.
+    Parameters: flags - A bytes-like object of 0 and 1 bytes.
+    Returns: The bitmap bytes, with the last byte padded with 0 bits.
+    """
+    if not flags:
+        return b""
+    # int reads the bits most significant first, so they are reversed.
+    return int(bytes(flags).translate(bitCharacters)[::-1], 2).to_bytes((len(flags) + 7) // 8, "little")
+
+def npyHeader(npyType, rows):
+    """
+    Get the header of a one-dimensional .npy file.
+    Parameters: npyType - The .npy type, e.g. "<f8".
+                rows - The number of rows.
+    Returns: The header bytes, npyHeaderSize long.
+    """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (npyType, rows)
+    length = npyHeaderSize - 10
+    return (b"\x93NUMPY\x01\x00" + length.to_bytes(2, "little")
+            + (header.ljust(length - 1) + "\n").encode("latin1"))
+
+def toFloat64(result):
+    """
+    Converts a result to a float64 column value.
+    Parameters: result - The result of a calculation.
+    Returns: The float, or None if the result is too large for a float.
+    """
+    try:
+        return float(result)
+    except OverflowError:
+        return None
+
+def toInt64(result):
+    """
+    Converts a result to an int64 column value.
+    Parameters: result - The result of a calculation.
+    Returns: The int, or None if the result is not a whole number from
+    -2^63 to 2^63 - 1.
+    """
+    try:
+        value = int(result)
+    except (OverflowError, ValueError):
+        return None
+    if value != result or not minInt64 <= value <= maxInt64:
+        return None
+    return value
+
+class ColumnWriter:
+    """
+    Writes results to a binary column and its validity bitmap.
+    Attributes: rows - The number of results written.
+                errors - The number of invalid results.
+    """
+
+    def __init__(self, path, columnType = "float64"):
+        """
+        Parameters: path - The column file path. The bitmap is written to
+                    path + ".valid".
+                    columnType - "float64" or "int64".
+        Raises ValueError for other column types.
+        """
+        if columnType not in columnTypes:
+            raise ValueError("unknown column type " + columnType)
+        typecode, self.npyType = columnTypes[columnType]
+        self.convert = toFloat64 if columnType == "float64" else toInt64
+        self.invalidValue = float("nan") if columnType == "float64" else 0
+        self.columnType = columnType
+        self.values = array(typecode)
+        self.flags = bytearray()
+        self.rows = 0
+        self.errors = 0
+        self.npy = path.endswith(".npy")
+        self.file = open(path, "wb", buffering = batchBufferSize)
+        try:
+            self.bitmap = open(path + ".valid", "wb", buffering = batchBufferSize)
+        except OSError:
+            self.file.close()
+            raise
+        if self.npy:
+            self.file.write(npyHeader(self.npyType, 0))
+
+    def append(self, result):
+        """
+        Adds a result. Results that do not fit in the column type are
+        invalid, and a message is printed to standard error for them.
+        Parameters: result - The result of a calculation, or False if it
+                    could not be evaluated.
+        """
+        # Compare by identity, since a result of 0 is equal to False.
+        value = None if result is False else self.convert(result)
+        if value is None:
+            if result is not False:
+                print("Output Error: result does not fit in " + self.columnType, file = stderr)
+            self.values.append(self.invalidValue)
+            self.flags.append(0)
+            self.errors += 1
+        else:
+            self.values.append(value)
+            self.flags.append(1)
+        if len(self.values) >= blockRows:
+            self.flush()
+
+    def extend(self, data, flags):
+        """
+        Adds a block of results that are already column values, such as a
+        NumPy array converted with astype(writer.npyType).
+        Parameters: data - The little-endian values, as bytes.
+                    flags - A bytes-like object with a 1 byte for each valid
+                    value and a 0 byte for each invalid one.
+        """
+        self.flush()
+        self.file.write(data)
+        self.flags += flags
+        self.rows += len(flags)
+        self.errors += bytes(flags).count(0)
+        self.flush()
+
+    def flush(self, final = False):
+        """
+        Writes the buffered values, and the whole bytes of their bitmap.
+        Parameters: final - Whether to write the last, partial byte too.
+        """
+        if self.values:
+            if byteorder == "big":
+                self.values.byteswap()
+            self.file.write(self.values.tobytes())
+            self.rows += len(self.values)
+            del self.values[:]
+        count = len(self.flags) if final else len(self.flags) // 8 * 8
+        if count:
+            self.bitmap.write(packBits(self.flags[:count]))
+            del self.flags[:count]
+
+    def close(self):
+        """
+        Writes what is left and closes the files. The .npy header is filled
+        in with the number of rows.
+        """
+        try:
+            self.flush(True)
+            if self.npy:
+                self.file.seek(0)
+                self.file.write(npyHeader(self.npyType, self.rows))
+        finally:
+            self.file.close()
+            self.bitmap.close()
+
+def runBinaryBatch(path, outputPath, columnType = "float64", backend = None):
+    """
+    Evaluates every line of a file, or of standard input, and writes the
+    results to a binary column instead of standard output. Error messages are
+    printed to standard error, as in batch mode.
+    Parameters: path - The input file path, or "-" to read standard input.
+                outputPath - The column file path. A path ending in ".npy"
+                is written in NumPy's .npy format.
+                columnType - "float64" or "int64".
+                backend - The NumericBackend to evaluate with.
+    Returns: The number of invalid results, or 1 if the input file cannot be
+    opened.
+    """
+    lines = openLines(path)
+    if lines is None:
+        return 1
+    writer = ColumnWriter(outputPath, columnType)
+    cache = ExpressionCache(backend = backend)
+    try:
+        for line in lines:
+            writer.append(evaluateExpression(line.rstrip("\r\n"), cache, backend))
+    finally:
+        writer.close()
+        if lines is not stdin:
+            lines.close()
+    return writer.errors
@@ -1,8 +1,48 @@
 #! /usr/bin/env python3.7
 # Author: Nathaniel Rudenberg
 
+# With --cache, a cached result is printed before anything else is loaded, so
+# repeated expressions do not pay for initializing the evaluator.
+if __name__ == "__main__":
+    from resultcache import printCached
+    if printCached():
+        raise SystemExit
+
+import math
+import mmap
+import os
+import re
+from array import array
+from collections import namedtuple
+from collections import OrderedDict
+from contextlib import nullcontext
+from decimal import Context
+from decimal import Decimal
+from decimal import Overflow
+from decimal import localcontext
+from fractions import Fraction
+from itertools import islice
+from numbers import Rational
 from sys import argv
+from sys import getsizeof
+from sys import modules
 from sys import stderr
+from sys import stdin
+from sys import stdout
+from time import monotonic
+
+try:
+    from sys import get_int_max_str_digits
+except ImportError:
+    # Before Python 3.11, ints of any size are converted to strings.
+    get_int_max_str_digits = None
+
+# Batch mode writes one result per input line; lines that fail to evaluate
+# get this marker in place of a result so output stays aligned with input.
+errorMarker = "ERROR"
+
+# Size of the read and write buffers used in batch mode.
+batchBufferSize = 1 << 20
 
 def add(l, r):
     """
@@ -22,6 +62,14 @@ def sub(l, r):
     """
     return l - r
 
+def negate(r):
+    """
+    Negates a number, as unary minus.
+    Parameters: r - The operand.
+    Returns: 0 - r, so that 0.0 stays 0.0 rather than becoming -0.0.
+    """
+    return 0 - r
+
 def mult(l, r):
     """
     Multiplies two numbers together.
@@ -40,16 +88,431 @@ def div(l, r):
     """
     return l / r
 
-ops = {
-    # Unary minus is represented by "~".
-    "-": sub,
-    "+": add,
-    "/": div,
-    "*": mult,
-    "~": sub,
+# Exact powers with more bits than this raise OverflowError instead of
+# taking too long to compute.
+maxPowerBits = 1 << 20
+
+def power(l, r):
+    """
+    Raises the left operand to the power of the right.
+    Parameters: l - The base.
+                r - The exponent.
+    Returns: l ** r
+    Raises OverflowError if an exact result would be too large, and
+    ArithmeticError if the result is not a real number, e.g. for (-8) ^ 0.5.
+    """
+    if type(r) is int and abs(r) > 1 and isinstance(l, Rational) and abs(l) != 1 and l != 0:
+        bits = max(l.numerator.bit_length(), l.denominator.bit_length())
+        if bits * abs(r) > maxPowerBits:
+            raise OverflowError("result too large")
+    result = l ** r
+    if type(result) is complex:
+        raise ArithmeticError("result is not a real number")
+    return result
+
+def mod(l, r):
+    """
+    Get the remainder of dividing the left operand by the right.
+    Parameters: l - The left operand.
+                r - The right operand.
+    Returns: l % r, which has the sign of r.
+    """
+    return l % r
+
+def floorDiv(l, r):
+    """
+    Divides the left operand by the right, rounding down.
+    Parameters: l - The left operand.
+                r - The right operand.
+    Returns: l // r
+    """
+    return l // r
+
+def squareRoot(r):
+    """
+    Get the square root of a number.
+    Parameters: r - The number.
+    Returns: The square root, as a float.
+    Raises ArithmeticError if the number is negative.
+    """
+    if r < 0:
+        raise ArithmeticError("square root of a negative number")
+    return math.sqrt(r)
+
+# An operator or function of the language, as stored in the registry.
+# symbol - How it is written: a symbol such as "+" or "//", or for a function
+# a name such as "sqrt", which is called with its arguments in parentheses
+# and separated by commas.
+# arity - The number of operands: 2 for binary operators, 1 for unary minus,
+# and 1 or 2 for functions.
+# precedence - How tightly the operator binds; higher binds tighter. None for
+# functions, which are always called with parentheses.
+# rightAssociative - Whether a chain such as "2 ^ 3 ^ 2" groups from the right.
+# function - Computes the result from the operands, in order.
+Operator = namedtuple("Operator", ["symbol", "arity", "precedence", "rightAssociative", "function"])
+
+# Every operator and function, by symbol, in the order they were registered.
+# buildTables compiles the registry into the lookup tables below, which the
+# tokenizer, the parsers and the evaluators use, so the work per token does
+# not depend on how many operators there are.
+operators = {}
+
+# The function of each operator and function, by symbol, as evaluators call
+# it. Unary minus is represented by "~".
+ops = {}
+# The number of operands of each operator and function.
+arities = {}
+# The precedence of each operator, including unary minus, which binds tighter
+# than every built-in binary operator except "^".
+precedenceTable = {}
+# The precedence an operator on the stack needs to be popped by each
+# operator: its own precedence for left associative operators, and just
+# above it for right associative ones. Unary minus pops nothing.
+popPrecedence = {}
+# The symbols of the binary operators.
+binaryOps = set()
+# The names of the functions.
+functionNames = set()
+# The operators and functions whose int results can have many more bits than
+# their operands: every one except the built-in ones below, whose results have
+# at most a bit more than their largest operand. Limits.maxIntBits is checked
+# after these.
+growingOps = set()
+boundedFunctions = (add, sub, negate, div, mod, floorDiv, squareRoot, abs, min, max)
+
+def addOperator(operator):
+    """
+    Adds an operator to the registry without rebuilding the tables.
+    Parameters: operator - The Operator.
+    Raises ValueError if the symbol is already registered or cannot be
+    written in an expression.
+    """
+    symbol = operator.symbol
+    if symbol in operators:
+        raise ValueError("operator already registered: " + symbol)
+    if operator.precedence is None:
+        if not re.fullmatch(r"[^\W\d]\w*", symbol) or operator.arity not in (1, 2):
+            raise ValueError("invalid function: " + symbol)
+    elif not re.fullmatch(r"[^\w\s().,]+", symbol) or operator.arity != (1 if symbol == "~" else 2):
+        raise ValueError("invalid operator: " + symbol)
+    operators[symbol] = operator
+
+def registerOperator(symbol, precedence, function, rightAssociative = False):
+    """
+    Adds a binary operator to the language.
+    Parameters: symbol - How the operator is written, e.g. "<<". Symbols are
+                made of characters that are not letters, digits, spaces,
+                parentheses, commas or decimal points.
+                precedence - How tightly it binds: 0 for "+" and "-", 1 for
+                "*", "/", "%" and "//", 3 for "^".
+                function - Computes the result from the two operands.
+                rightAssociative - Whether chains of it group from the right.
+    Raises ValueError if the symbol is already registered or is invalid.
+    """
+    addOperator(Operator(symbol, 2, precedence, rightAssociative, function))
+    buildTables()
+
+def registerFunction(name, function, arity = 1):
+    """
+    Adds a function to the language. Its name can then no longer be used as
+    a variable name.
+    Parameters: name - The function's name, e.g. "sqrt".
+                function - Computes the result from the arguments.
+                arity - The number of arguments it takes, 1 or 2.
+    Raises ValueError if the name is already registered or is invalid.
+    """
+    addOperator(Operator(name, arity, None, False, function))
+    buildTables()
+
+def unregisterOperator(symbol):
+    """
+    Removes an operator or function from the language.
+    Parameters: symbol - Its symbol or name.
+    Raises KeyError if it is not registered.
+    """
+    del operators[symbol]
+    buildTables()
+
+addOperator(Operator("+", 2, 0, False, add))
+addOperator(Operator("-", 2, 0, False, sub))
+addOperator(Operator("*", 2, 1, False, mult))
+addOperator(Operator("/", 2, 1, False, div))
+addOperator(Operator("~", 1, 2, False, negate))
+addOperator(Operator("^", 2, 3, True, power))
+addOperator(Operator("%", 2, 1, False, mod))
+addOperator(Operator("//", 2, 1, False, floorDiv))
+addOperator(Operator("sqrt", 1, None, False, squareRoot))
+addOperator(Operator("abs", 1, None, False, abs))
+addOperator(Operator("min", 2, None, False, min))
+addOperator(Operator("max", 2, None, False, max))
+
+def exactDiv(l, r):
+    """
+    Divides the left operand by the right without rounding.
+    Parameters: l - The left operand.
+                r - The right operand.
+    Returns: l / r as an int if both operands are ints and r divides l
+    evenly, otherwise as a Fraction (or a Fraction operand's type).
+    """
+    if type(l) is int and type(r) is int:
+        if r == 0:
+            raise ZeroDivisionError("division by zero")
+        if l % r == 0:
+            return l // r
+        return Fraction(l, r)
+    return l / r
+
+def exactPower(l, r):
+    """
+    Raises the left operand to the power of the right without rounding.
+    Parameters: l - The base.
+                r - The exponent.
+    Returns: l ** r, as a Fraction if both operands are ints and r is
+    negative, otherwise as power returns it.
+    """
+    if type(l) is int and type(r) is int and r < 0:
+        return power(Fraction(l), r)
+    return power(l, r)
+
+# The functions of the adaptive backend that differ from ops: division and
+# powers are exact.
+adaptiveOverrides = {"/": exactDiv, "^": exactPower}
+
+def decimalDiv(l, r):
+    """
+    Divides the left operand by the right, raising ZeroDivisionError for any
+    division by zero. Decimal raises InvalidOperation for 0 / 0 instead.
+    Parameters: l - The left operand.
+                r - The right operand.
+    Returns: l / r
+    """
+    if r == 0:
+        raise ZeroDivisionError("division by zero")
+    return l / r
+
+def decimalFloorDiv(l, r):
+    """
+    Divides the left operand by the right, rounding down as // does for
+    ints. Decimal's // rounds toward zero instead.
+    Parameters: l - The left operand.
+                r - The right operand.
+    Returns: l // r
+    """
+    if r == 0:
+        raise ZeroDivisionError("division by zero")
+    quotient, remainder = divmod(l, r)
+    if remainder and (remainder < 0) != (r < 0):
+        quotient -= 1
+    return quotient
+
+def decimalMod(l, r):
+    """
+    Get the remainder of dividing the left operand by the right, with the
+    sign of r as % gives for ints. Decimal's % has the sign of l instead.
+    Parameters: l - The left operand.
+                r - The right operand.
+    Returns: l % r
+    """
+    if r == 0:
+        raise ZeroDivisionError("division by zero")
+    remainder = l % r
+    if remainder and (remainder < 0) != (r < 0):
+        remainder += r
+    return remainder
+
+def decimalSqrt(r):
+    """
+    Get the square root of a Decimal, rounded to the context's precision.
+    Parameters: r - The number.
+    Returns: The square root.
+    """
+    if r < 0:
+        raise ArithmeticError("square root of a negative number")
+    return r.sqrt()
+
+# The functions of the decimal backend that differ from ops.
+decimalOverrides = {"/": decimalDiv, "//": decimalFloorDiv, "%": decimalMod, "sqrt": decimalSqrt}
+
+# The operator tables of the adaptive and decimal backends, built from ops
+# and their overrides.
+adaptiveOps = {}
+decimalOps = {}
+
+# How numbers are represented and operated on while evaluating.
+# makeInt, makeFloat - Convert the text of a number without or with a decimal
+# point.
+# ops - The operator table to use instead of ops.
+# context - The decimal Context to evaluate in, or None.
+NumericBackend = namedtuple("NumericBackend", ["makeInt", "makeFloat", "ops", "context"])
+
+def decimalBackend(precision = 28):
+    """
+    Get a backend that evaluates with Decimals.
+    Parameters: precision - The number of significant digits results are
+                rounded to. Numbers in the expression are never rounded.
+    Returns: A NumericBackend.
+    """
+    return NumericBackend(Decimal, Decimal, decimalOps, Context(prec = precision))
+
+backends = {
+    # ints and floats, as evaluatePostfix uses. Division always gives a float.
+    "native": NumericBackend(int, float, ops, None),
+    # Exact Fractions for every number.
+    "fraction": NumericBackend(Fraction, Fraction, ops, None),
+    # Decimals with 28 significant digits.
+    "decimal": decimalBackend(),
+    # ints until a number with a decimal point, or a division that does not
+    # come out even, needs a Fraction. Exact, and as fast as native for
+    # expressions that only use ints.
+    "adaptive": NumericBackend(int, Fraction, adaptiveOps, None),
 }
 
-parens = "()"
+# A tuple rather than a string, so that testing whether an already converted
+# number is a paren does not raise a TypeError.
+parens = ("(", ")")
+
+class CalculationError(ValueError):
+    """
+    An error in a math expression.
+    Attributes: message - The error message, as printed by the pipeline.
+                position - The position in the input string where the error
+                was found, or None if it is not known.
+    """
+
+    def __init__(self, message, position = None):
+        ValueError.__init__(self, message)
+        self.message = message
+        self.position = position
+
+    def __reduce__(self):
+        # Keep the position when errors are pickled, e.g. to send them
+        # between processes.
+        return (CalculationError, (self.message, self.position))
+
+def mathError(error):
+    """
+    Get the error to report for an ArithmeticError raised by an operator.
+    Parameters: error - The ArithmeticError, e.g. a ZeroDivisionError.
+    Returns: A CalculationError.
+    """
+    if isinstance(error, ZeroDivisionError):
+        return CalculationError("Math Error: division by zero")
+    if isinstance(error, (OverflowError, Overflow)):
+        return CalculationError("Math Error: result too large")
+    return CalculationError("Math Error: undefined result")
+
+def formatResult(result):
+    """
+    Converts a result to the string that is printed for it.
+    Parameters: result - The result of a calculation.
+    Returns: The string.
+    Raises CalculationError if the result is an int, or a fraction, with more
+    digits than Python converts to a string (see
+    sys.set_int_max_str_digits).
+    """
+    try:
+        return str(result)
+    except ValueError:
+        raise CalculationError("Math Error: result too large to print")
+
+def maxPrintableBits():
+    """
+    Get the most bits an int can have and still be converted to a string.
+    Returns: The number of bits, or None if ints of any size can be.
+    """
+    digits = 0 if get_int_max_str_digits is None else get_int_max_str_digits()
+    if digits == 0:
+        return None
+    # An int of b bits has at most floor(b * log10(2)) + 1 digits.
+    return int(digits / math.log10(2))
+
+# Limits on the resources one expression may use, so that a service can
+# reject inputs that would take too long or use too much memory. Each limit is
+# None for no limit, which is the default; checking limits costs nothing then.
+# maxLength - The most characters in the input.
+# maxTokens - The most tokens: numbers, names, operators, parens and commas.
+# maxDepth - The deepest nesting of parens, counting function calls.
+# maxIntBits - The most bits in an int, or in the numerator or denominator of a
+# fraction, in the result and in the result of each operator in growingOps
+# (for Fractions, of every operator). Sums and differences of ints are only
+# checked in the result, since each grows by at most a bit. It may not be more
+# than maxPrintableBits, so every result within the limits can be printed.
+# maxSteps - The most operators evaluated.
+# deadline - The time.monotonic() value by which parsing and evaluating must
+# be done, e.g. monotonic() + 0.1.
+class Limits(namedtuple("Limits", ["maxLength", "maxTokens", "maxDepth", "maxIntBits", "maxSteps", "deadline"],
+                        defaults = (None,) * 6)):
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        limits = super().__new__(cls, *args, **kwargs)
+        checkIntBits(limits.maxIntBits)
+        return limits
+
+    def _replace(self, **changes):
+        if "maxIntBits" in changes:
+            checkIntBits(changes["maxIntBits"])
+        return super()._replace(**changes)
+
+def checkIntBits(maxIntBits):
+    """
+    Checks a value of Limits.maxIntBits.
+    Parameters: maxIntBits - The most bits in an int, or None.
+    Raises ValueError if ints of that many bits cannot be printed.
+    """
+    printable = maxPrintableBits()
+    if maxIntBits is not None and printable is not None and maxIntBits > printable:
+        raise ValueError("maxIntBits is over %d, the most bits of an int that can be printed" % printable)
+
+# How many postfix items (operators, for StackEvaluator, which cannot tell
+# how many items are left) are evaluated between checks of the deadline. Results
+# with more bits than largeBits took long enough to compute that the deadline
+# is checked after each of them.
+deadlineInterval = 1024
+largeBits = 1 << 12
+
+def numberBits(value):
+    """
+    Get the size of a number, as checked against Limits.maxIntBits.
+    Parameters: value - The number.
+    Returns: The bit length of an int, the larger bit length of the numerator
+    and denominator of a fraction, or 0 for other numbers.
+    """
+    if type(value) is int:
+        return value.bit_length()
+    if isinstance(value, Rational):
+        return max(value.numerator.bit_length(), value.denominator.bit_length())
+    return 0
+
+def checkTokens(matches, maxTokens, offset = 0):
+    """
+    Checks that no tokens are left after a parser has read as many as
+    Limits.maxTokens allows.
+    Parameters: matches - The iterator of tokenPattern matches the parser
+                read from.
+                maxTokens - The limit.
+                offset - The position in the input of the matched string, if
+                it is only part of the input.
+    Raises CalculationError if another token is left.
+    """
+    extra = next(matches, None)
+    if extra is not None:
+        raise CalculationError("Limit Error: too many tokens", offset + extra.start())
+
+def checkLength(input, limits, offset = 0):
+    """
+    Checks the length of a math expression, or of a piece of it, and the
+    deadline.
+    Parameters: input - The math expression string, or a piece of it.
+                limits - The Limits.
+                offset - The position of the piece in the expression.
+    Raises CalculationError if the expression is too long or the deadline has
+    passed.
+    """
+    if limits.maxLength is not None and offset + len(input) > limits.maxLength:
+        raise CalculationError("Limit Error: input too long", limits.maxLength)
+    if limits.deadline is not None and monotonic() > limits.deadline:
+        raise CalculationError("Limit Error: time limit exceeded", offset)
 
 def checkBalancedParens(expression):
     """
@@ -80,28 +543,34 @@ def validateSyntax(expression):
     """
     Validates the syntax of the math expression.
     Parameters: expression - The math expression to validate.
-    Returns: The validated math expression if all validations checks pass,
-    otherwise returns False.
+    Returns: A copy of the math expression, with each unary minus replaced by
+    "~", if all validations checks pass, otherwise returns False.
     """
-    opsList = list(ops)
-
     # Empty expressions are invalid.
     if len(expression) == 0:
         return expression
-    
-    # Expressions with an operator as the final item are invalid.
-    if expression[-1] in opsList:
+
+    # Unary minus is marked in a copy, so the caller's list is not changed.
+    expression = list(expression)
+
+    # Commas between function arguments are checked like binary operators.
+    infix = binaryOps.union((",", "~"))
+
+    # Expressions with an operator as the final item are invalid. This also
+    # means every operator is followed by another item, so the lookahead at
+    # expression[i + 1] below never runs off the end.
+    if expression[-1] in infix:
         print("Syntax Error", file = stderr)
         return False
 
     # Check edge cases that apply for first item only
-    if expression[0] in opsList:
+    if expression[0] in infix:
         # Expressions with a non minus operator at the beginning are invalid.
         if expression[0] != "-":
             print("Syntax Error", file = stderr)
             return False
         # Expressions with two operators at the beginning are invalid.
-        elif expression[1] in opsList:
+        elif expression[1] in infix:
             print("Syntax Error", file = stderr)
             return False
         # Expressions with a minus as the only operator at the beginning are accepted.
@@ -109,18 +578,22 @@ def validateSyntax(expression):
             expression[0] = "~"
 
     for i in range(1, len(expression)):
-        if expression[i] in opsList:
+        if expression[i] in infix:
             if expression[i - 1] == "(":
+                if expression[i] == ",":
+                    # An argument cannot be empty.
+                    print("Syntax Error", file = stderr)
+                    return False
                 if expression[i] == "-":
                     # Minus operators after left parens should be unary.
                     expression[i] = "~"
-                if expression[i + 1] in opsList:
+                if expression[i + 1] in infix:
                     # There should not be two or more operators after an open
                     # parentheses.
                     print("Syntax Error", file = stderr)
                     return False
-            elif expression[i - 1] in opsList:
-                if expression[i + 1] in opsList:
+            elif expression[i - 1] in infix:
+                if expression[i + 1] in infix:
                     # Return False if there are 3 or more expressions in series
                     print("Syntax Error", file = stderr)
                     return False
@@ -133,47 +606,160 @@ def validateSyntax(expression):
                     # and the second is not minus.
                     print("Syntax Error", file = stderr)
                     return False
-        elif expression[i] not in opsList and expression[i] not in parens:
+        elif expression[i] not in infix and expression[i] not in parens:
             # If a number is not preceded by an operator or an open parentheses,
             # the syntax is invalid.
-            if expression[i - 1] != "(" and expression[i - 1] not in opsList:
+            if expression[i - 1] != "(" and expression[i - 1] not in infix:
                 print("Syntax Error", file = stderr)
                 return False
         elif expression[i] == "(":
             # If the open parentheses is not the first item in the expression,
-            # it must be preceded by an operator or another open parentheses.
-            if expression[i - 1] not in opsList and expression[i - 1] != "(":
+            # it must be preceded by an operator, another open parentheses or
+            # a function name.
+            if expression[i - 1] not in infix and expression[i - 1] != "(" and expression[i - 1] not in functionNames:
                 print("Syntax Error", file = stderr)
                 return False
         elif expression[i] == ")":
             # If the close parentheses is preceded by an operator or an
             # open parentheses, the syntax is invalid.
-            if expression[i - 1] in opsList or expression[i - 1] == "(":
+            if expression[i - 1] in infix or expression[i - 1] == "(":
                 print("Syntax Error", file = stderr)
                 return False
 
-    if checkBalancedParens(expression):
+    if checkBalancedParens(expression) and checkCalls(expression):
         return expression
     else:
         return False
 
+def checkCalls(expression):
+    """
+    Test whether every function in the expression is called with
+    parentheses and the right number of arguments, and every comma is
+    between the arguments of a function. Parentheses must be balanced.
+    Parameters: expression - The math expression to test.
+    Returns: True if the calls are valid, otherwise returns False.
+    """
+    # The function and the number of arguments so far of each open paren,
+    # or None for parens that are not a call.
+    calls = []
+    for i in range(len(expression)):
+        item = expression[i]
+        if item in functionNames:
+            if i + 1 == len(expression) or expression[i + 1] != "(":
+                print("Syntax Error", file = stderr)
+                return False
+        elif item == "(":
+            function = expression[i - 1] if i > 0 else None
+            calls.append([function, 1] if function in functionNames else None)
+        elif item == ",":
+            call = calls[-1] if calls else None
+            if call is None or call[1] == arities[call[0]]:
+                print("Syntax Error", file = stderr)
+                return False
+            call[1] += 1
+        elif item == ")":
+            call = calls.pop()
+            if call is not None and call[1] != arities[call[0]]:
+                print("Syntax Error", file = stderr)
+                return False
+    return True
+
 def precedence(op):
     """
     Get the precedence of a given operator.
-    Parameters: op - an arithmetic operator.
-    Available operators are +, -, *, /, and ~ (unary minus).
+    Parameters: op - an arithmetic operator, or "~" for unary minus.
     Returns: The precedence of the given operator.
     """
-    if op in "+-":
-        return 0
-    elif op in "*/":
-        return 1
-    elif op is "~":
-        return 2
+    return precedenceTable[op]
+
+# A run of digits and decimal points. Runs that are not valid numbers are
+# reported by numberError.
+numberPattern = re.compile(r"[0-9.]+")
+
+# Matches one token. Spaces match nothing, so scanning with finditer skips
+# them, and any other character that is not part of a token matches the last
+# group, which makes it illegal. Well formed numbers match the float or int
+# group, so they need no further checks; any other run of digits and decimal
+# points is malformed. A name followed by an open paren is a function call.
+# The operators come from the registry, so buildTables builds the pattern.
+tokenPatternFormat = r"""
+    (?P<float>[0-9]*\.[0-9]+)(?![0-9.])
+  | (?P<int>[0-9]+)(?![0-9.])
+  | (?P<malformed>[0-9.]+)
+  | (?P<call>[^\W\d]\w*)\ *\(
+  | (?P<name>[^\W\d]\w*)
+  | (?P<operator>%s)
+  | (?P<paren>[()])
+  | (?P<comma>,)
+  | (?P<illegal>[^ ])
+    """
+
+def makeTokenPattern(symbols):
+    """
+    Builds the pattern that matches one token.
+    Parameters: symbols - The operator symbols.
+    Returns: The compiled pattern.
+    """
+    trie = {}
+    for symbol in symbols:
+        node = trie
+        for char in symbol:
+            node = node.setdefault(char, {})
+        node[""] = None
+    return re.compile(tokenPatternFormat % triePattern(trie), re.VERBOSE | re.DOTALL)
+
+def triePattern(node):
+    """
+    Builds a pattern that matches the longest symbol in a trie, so "//" is
+    not read as two "/". Each branch starts with a different character,
+    which the regex engine checks before trying the branch, so matching a
+    symbol takes a step per character whatever the number of symbols.
+    Parameters: node - A dictionary mapping each next character to the node
+                after it, and "" to None where a symbol ends.
+    Returns: The pattern string.
+    """
+    # Characters that only end symbols are matched by one character set.
+    ends = "".join(re.escape(char) for char, child in sorted(node.items()) if child == {"": None})
+    branches = [re.escape(char) + triePattern(child) for char, child in sorted(node.items())
+                if char and child != {"": None}]
+    if ends:
+        branches.append("[" + ends + "]")
+    pattern = "(?:" + "|".join(branches) + ")"
+    return pattern + "?" if "" in node else pattern
+
+# Token kinds: the names of the tokenPattern groups, which are the lastgroup
+# of each match. A match is the parsers' token: its kind, its span in the
+# input, and its text, which the parsers convert to a number only once.
+INT = "int"
+FLOAT = "float"
+MALFORMED = "malformed"
+CALL = "call"
+NAME = "name"
+OPERATOR = "operator"
+PAREN = "paren"
+COMMA = "comma"
+ILLEGAL = "illegal"
+# The kind of a number of either group, in the parse trees of incremental.py
+# and the graphs of optimize.py.
+NUMBER = "number"
+
+def numberError(number):
+    """
+    Check a run of digits and decimal points for a malformed number.
+    Parameters: number - The run of digits and decimal points.
+    Returns: The error message if the number is malformed, otherwise None.
+    """
+    dots = number.count(".")
+    if dots > 1:
+        return "Syntax Error: number has more than one decimal point."
+    if dots == 1 and number[-1] == ".":
+        return "Syntax Error: number has a trailing decimal point"
+    return None
 
 def getNumber(input, pos):
     """
-    Get a number from the math expression input.
+    Get a number from the math expression input. The parsers read numbers
+    with tokenPattern instead; this is kept for compatibility.
     Parameters: input - The math expression input.
                 pos - The position of the first character of the number in the input.
     Returns:    (number, pos, invalidSyntax)
@@ -181,92 +767,131 @@ def getNumber(input, pos):
                 pos - The current position in the input string.
                 invalidSyntax - Syntax validation flag.
     """
-    number = ""
-    invalidSyntax = False
-    # Loop through the string until a non-digit, non-decimal character is reached.
-    while pos < len(input) and (input[pos].isdigit() or input[pos] is "."):
-        currentChar = input[pos]
-        if currentChar is "." and currentChar in number:
-            print("Syntax Error: number has more than one decimal point.", file = stderr)
-            invalidSyntax = True
-            return ('0', -1, invalidSyntax)
-        number += currentChar
-        pos += 1
-    
-    if number[-1] == ".":
-        print("Syntax Error: number has a trailing decimal point", file = stderr)
-        invalidSyntax = True
-        return ('0', -1, invalidSyntax)
+    match = numberPattern.match(input, pos)
+    number = match.group()
+    error = numberError(number)
+    if error:
+        print(error, file = stderr)
+        return ('0', -1, True)
 
-    return (number, pos, invalidSyntax)
+    return (number, match.end(), False)
 
-def parse(input):
+def isNameStart(char):
+    """
+    Test whether a character can start a variable name.
+    Parameters: char - The character to test.
+    Returns: True for letters and underscores, otherwise returns False.
+    """
+    return char.isalpha() or char == "_"
+
+def tokenError(token, offset = 0):
+    """
+    Get the error for a match of tokenPattern that is not a valid token.
+    Parameters: token - The regular expression match.
+                offset - The position in the input of the matched string, if
+                it is only part of the input.
+    Returns: A CalculationError.
+    """
+    if token.lastgroup == MALFORMED:
+        return CalculationError(numberError(token.group()), offset + token.start())
+    return CalculationError("Invalid Input: illegal character found.", offset + token.start())
+
+def parse(input, allowNames = False, limits = None):
     """
     Separates the components of the math expression input into separate parts.
     Parameters: input - The math expression string.
+                allowNames - Whether variable names such as "x" are accepted.
+                They are passed through the rest of the pipeline unchanged and
+                must be bound by an evaluator that supports them. Function
+                names are always accepted.
+                limits - Optional Limits on the length of the input and the
+                number of tokens.
     Returns: A list containing the separate parts of the math expression.
     """
-    currentPos = 0
-    expression = []
     if not input:
         print("Invalid Input: empty.", file = stderr)
         return False
 
-    while currentPos < len(input):
-        currentChar = input[currentPos]
-        if currentChar is not " ":
-            # Operators and parentheses are single characters, so add them to
-            # the list here.
-            if currentChar in ops.keys() or currentChar in parens:
-                expression.append(currentChar)
-                currentPos += 1
-            # A number might be more than one digit long. Pass starting
-            # position of the number to a helper function to get the entire
-            # number.
-            elif currentChar.isdigit() or currentChar == ".":
-                number, currentPos, error = getNumber(input, currentPos)
-                if error:
-                    return False
-                expression.append(number)
-            else:
-                # Character is illegal and the input string is invalid
-                print("Invalid Input: illegal character found.", file = stderr)
+    expression = []
+    matches = tokenPattern.finditer(input)
+    tokens = matches
+    maxTokens = None if limits is None else limits.maxTokens
+    try:
+        if limits is not None:
+            checkLength(input, limits)
+            if maxTokens is not None:
+                tokens = islice(matches, maxTokens)
+        for token in tokens:
+            kind = token.lastgroup
+            if (kind == MALFORMED or kind == ILLEGAL
+                    or ((kind == NAME or kind == CALL) and not allowNames and token.group(kind) not in functionNames)):
+                print(tokenError(token).message, file = stderr)
                 return False
-        else:
-            # Skip empty spaces
-            currentPos += 1
+            if kind == CALL:
+                expression.append(token.group(CALL))
+                expression.append("(")
+            else:
+                expression.append(token.group())
+        if maxTokens is not None:
+            checkTokens(matches, maxTokens)
+    except CalculationError as error:
+        print(error.message, file = stderr)
+        return False
 
     return expression
 
-def convertToPostfix(expression):
+def convertToPostfix(expression, limits = None):
     """
     Converts an infix expression to postfix.
     Parameters: expression - The infix expression.
-    Returns: The converted postfix expression.
+                limits - Optional Limits on the number of tokens and the
+                nesting depth.
+    Returns: The converted postfix expression, or False if it is over the
+    limits.
     """
     opStack = []
     postfix = []
     opStack.append("#")
+    maxDepth = None
+    if limits is not None:
+        if limits.maxTokens is not None and len(expression) > limits.maxTokens:
+            print("Limit Error: too many tokens", file = stderr)
+            return False
+        maxDepth = limits.maxDepth
+    depth = 0
     for i in range(len(expression)):
         # Add number to the output list
-        if expression[i] not in ops.keys() and expression[i] not in parens:
+        if expression[i] not in ops and expression[i] not in parens and expression[i] != ",":
             postfix.append(expression[i])
         # Add top of operator stack to output list while the top of the stack
-        # is an operator with precedence equal to or greater than that of the
-        # current operator, then add the current operator to the stack.
-        elif expression[i] in list(ops):
-            while opStack[-1] in list(ops) and precedence(opStack[-1]) >= precedence(expression[i]):
+        # is an operator that binds at least as tightly as the current
+        # operator (more tightly, if the current operator is right
+        # associative), then add the current operator to the stack. Unary
+        # minus pops nothing.
+        elif expression[i] in precedenceTable:
+            while opStack[-1] in precedenceTable and precedenceTable[opStack[-1]] >= popPrecedence[expression[i]]:
                 postfix.append(opStack.pop())
             opStack.append(expression[i])
-        # Add left parentheses to the operator stack.
-        elif expression[i] is "(":
+        # Add left parentheses, and the function names before them, to the
+        # operator stack.
+        elif expression[i] == "(" or expression[i] in functionNames:
+            if expression[i] == "(":
+                depth += 1
+                if maxDepth is not None and depth > maxDepth:
+                    print("Limit Error: nesting too deep", file = stderr)
+                    return False
             opStack.append(expression[i])
         # Add top of operator stack to output list while the top of the stack
-        # is not a left parentheses.
-        elif expression[i] is ")":
+        # is not a left parentheses. After the last argument of a function,
+        # add the function too.
+        elif expression[i] == ")" or expression[i] == ",":
             while opStack[-1] != "#" and opStack[-1] != "(":
                 postfix.append(opStack.pop())
-            opStack.pop()
+            if expression[i] == ")":
+                depth -= 1
+                opStack.pop()
+                if opStack[-1] in functionNames:
+                    postfix.append(opStack.pop())
     
     # Add remaining items in the operator stack to the output list.
     while opStack[-1] != "#":
@@ -274,66 +899,1218 @@ def convertToPostfix(expression):
     
     return postfix
 
-def evaluatePostfix(expression):
+def parseToPostfix(input, allowNames = False, backend = None, limits = None):
     """
-    Evaluates the result of a postfix expression.
-    Parameters: expression - The postfix expression.
+    Parses a math expression straight to postfix in a single pass.
+    Validating the syntax, finding unary minus, checking that parentheses are
+    balanced and converting to postfix all happen while the input is scanned
+    once, so this replaces parse, validateSyntax, checkBalancedParens and
+    convertToPostfix. It accepts and rejects the same expressions as those
+    steps followed by evaluatePostfix, and does not recurse, so deeply nested
+    expressions are fine.
+    Parameters: input - The math expression string.
+                allowNames - Whether variable names such as "x" are accepted.
+                backend - The NumericBackend that converts the numbers.
+                Defaults to ints and floats.
+                limits - Optional Limits on the length of the input, the
+                number of tokens and the nesting depth.
+    Returns: The postfix expression, with numbers converted to int or float.
+    Raises CalculationError if the expression is invalid or over the limits.
+    """
+    if not input:
+        raise CalculationError("Invalid Input: empty.", 0)
+    return scanInfix((input,), [], allowNames, backend, limits)
+
+def scanInfix(chunks, output, allowNames = False, backend = None, limits = None):
+    """
+    The single-pass parser behind parseToPostfix and evaluateFile.
+    Parameters: chunks - An iterable of pieces of the math expression string.
+                Pieces must be split between tokens, e.g. by readChunks.
+                output - Where the postfix items are appended as they are
+                found: a list, or any object with an append method, such as
+                a StackEvaluator.
+                allowNames - Whether variable names such as "x" are accepted.
+                backend - The NumericBackend that converts the numbers.
+                Defaults to ints and floats.
+                limits - Optional Limits on the length of the input, the
+                number of tokens and the nesting depth. The deadline is
+                checked before each piece.
+    Returns: output.
+    Raises CalculationError if the expression is invalid or over the limits.
+    """
+    append = output.append
+    makeInt = int if backend is None else backend.makeInt
+    makeFloat = float if backend is None else backend.makeFloat
+    opStack = []
+    # The function name and the number of arguments so far of each unclosed
+    # paren, or None for parens that are not a call.
+    calls = []
+    offset = 0
+    # The scanner alternates between expecting an operand (a number, a name,
+    # an open paren, a function call or a unary minus) and expecting an
+    # operator, a comma or a close paren.
+    expectOperand = True
+    unary = False
+    # Nesting is checked when a paren is opened, so it costs nothing per token.
+    maxDepth = -1 if limits is None or limits.maxDepth is None else limits.maxDepth
+    # Tokens are counted by the loop, and islice stops it at the limit.
+    maxTokens = None if limits is None else limits.maxTokens
+    tokenCount = 0
+    for chunk in chunks:
+        matches = tokenPattern.finditer(chunk)
+        tokens = matches
+        if limits is not None:
+            checkLength(chunk, limits, offset)
+            if maxTokens is not None:
+                tokens = islice(matches, maxTokens - tokenCount)
+        for tokenCount, token in enumerate(tokens, tokenCount + 1):
+            kind = token.lastgroup
+            if expectOperand:
+                if kind == INT:
+                    try:
+                        number = makeInt(token.group())
+                    except ValueError:
+                        # More digits than Python converts to an int.
+                        raise CalculationError("Invalid Input: number too long.", offset + token.start())
+                    append(number)
+                elif kind == FLOAT:
+                    append(makeFloat(token.group()))
+                elif kind == NAME and allowNames and token.group() not in functionNames:
+                    append(token.group())
+                elif kind == PAREN and token.group() == "(":
+                    if len(calls) == maxDepth:
+                        raise CalculationError("Limit Error: nesting too deep", offset + token.start())
+                    opStack.append("(")
+                    calls.append(None)
+                    unary = False
+                    continue
+                elif kind == CALL and token.group(CALL) in functionNames:
+                    if len(calls) == maxDepth:
+                        raise CalculationError("Limit Error: nesting too deep", offset + token.start())
+                    opStack.append("(")
+                    calls.append([token.group(CALL), 1])
+                    unary = False
+                    continue
+                elif kind == OPERATOR and token.group() == "-" and not unary:
+                    # Only one unary minus is allowed in a row. Nothing is
+                    # popped for it, and it binds tighter than the binary
+                    # operators of lower precedence, so "-2 * 3" is (-2) * 3
+                    # but "-2 ^ 2" is -(2 ^ 2).
+                    opStack.append("~")
+                    unary = True
+                    continue
+                elif kind == CALL and allowNames:
+                    # A variable followed by a paren.
+                    raise CalculationError("Syntax Error", offset + token.end() - 1)
+                elif kind == NAME and token.group() in functionNames:
+                    # A function without its arguments.
+                    raise CalculationError("Syntax Error", offset + token.end())
+                elif kind == OPERATOR or kind == PAREN or kind == COMMA:
+                    raise CalculationError("Syntax Error", offset + token.start())
+                else:
+                    raise tokenError(token, offset)
+                expectOperand = False
+                unary = False
+            elif kind == OPERATOR and token.group() != "~":
+                op = token.group()
+                threshold = popPrecedence[op]
+                while opStack and opStack[-1] != "(" and precedenceTable[opStack[-1]] >= threshold:
+                    append(opStack.pop())
+                opStack.append(op)
+                expectOperand = True
+            elif kind == PAREN and token.group() == ")" and calls:
+                top = opStack.pop()
+                while top != "(":
+                    append(top)
+                    top = opStack.pop()
+                call = calls.pop()
+                if call is not None:
+                    if call[1] != arities[call[0]]:
+                        raise CalculationError("Syntax Error", offset + token.start())
+                    append(call[0])
+            elif kind == COMMA and calls and calls[-1] is not None and calls[-1][1] < arities[calls[-1][0]]:
+                while opStack[-1] != "(":
+                    append(opStack.pop())
+                calls[-1][1] += 1
+                expectOperand = True
+            elif (kind == MALFORMED or kind == ILLEGAL
+                  or ((kind == NAME or kind == CALL) and not allowNames and token.group(kind) not in functionNames)):
+                raise tokenError(token, offset)
+            else:
+                raise CalculationError("Syntax Error", offset + token.start())
+        if tokenCount == maxTokens:
+            checkTokens(matches, maxTokens, offset)
+        offset += len(chunk)
+
+    if expectOperand or calls:
+        raise CalculationError("Syntax Error", offset)
+    while opStack:
+        append(opStack.pop())
+    return output
+
+class StackEvaluator:
+    """
+    Evaluates postfix items as they are appended, so a postfix expression can
+    be evaluated without being stored. Pass one to scanInfix as its output.
+    The stack only holds values waiting for an operator, so for expressions
+    from scanInfix its size depends on the nesting depth, not the length.
+    """
+
+    def __init__(self, table = ops, limits = None, checked = growingOps):
+        """
+        Parameters: table - The operator table, e.g. a NumericBackend's ops.
+                    limits - Optional Limits on the size of numbers, the
+                    number of operators and the time. Without limits, nothing
+                    is checked.
+                    checked - The operators around which the size of numbers
+                    is checked, as for evaluateLimited.
+        """
+        self.stack = []
+        self.table = table
+        self.limits = limits
+        if limits is not None:
+            self.checked = checked
+            self.steps = 0
+            self.append = self.appendLimited
+
+    def append(self, item):
+        """
+        Pushes a number, or applies an operator to the top of the stack.
+        Parameters: item - A number or an operator from ops.
+        Raises ArithmeticError if the operator cannot be computed, e.g.
+        ZeroDivisionError if it divides by zero.
+        """
+        if item in ops:
+            r = self.stack.pop()
+            if arities[item] == 2:
+                self.stack.append(self.table[item](self.stack.pop(), r))
+            else:
+                self.stack.append(self.table[item](r))
+        else:
+            self.stack.append(item)
+
+    def appendLimited(self, item):
+        """
+        Does what append does, within the evaluator's limits, which are
+        checked as evaluateLimited checks them. The steps are counted as they
+        are evaluated, since the length of the expression is not known.
+        Parameters: item - A number or an operator from ops.
+        Raises CalculationError if the limits are exceeded, and
+        ArithmeticError if the operator cannot be computed.
+        """
+        if item not in ops:
+            self.stack.append(item)
+            return
+        self.steps += 1
+        limits = self.limits
+        if limits.maxSteps is not None and self.steps > limits.maxSteps:
+            raise CalculationError("Limit Error: too many steps")
+        if item not in self.checked:
+            bits = 0
+            r = self.stack.pop()
+            if arities[item] == 2:
+                self.stack.append(self.table[item](self.stack.pop(), r))
+            else:
+                self.stack.append(self.table[item](r))
+        else:
+            maxIntBits = limits.maxIntBits
+            r = self.stack.pop()
+            if arities[item] == 2:
+                l = self.stack.pop()
+                if maxIntBits is not None and type(l) is not float and type(r) is not float:
+                    if item == "*" and numberBits(l) + numberBits(r) - 1 > maxIntBits:
+                        raise CalculationError("Limit Error: number too large")
+                    if item == "^" and type(r) is int and (numberBits(l) - 1) * abs(r) + 1 > maxIntBits:
+                        raise CalculationError("Limit Error: number too large")
+                result = self.table[item](l, r)
+            else:
+                result = self.table[item](r)
+            bits = numberBits(result)
+            if maxIntBits is not None and bits > maxIntBits:
+                raise CalculationError("Limit Error: number too large")
+            self.stack.append(result)
+        if (limits.deadline is not None and (self.steps % deadlineInterval == 0 or bits > largeBits)
+                and monotonic() > limits.deadline):
+            raise CalculationError("Limit Error: time limit exceeded")
+
+    def result(self):
+        """
+        Get the result of the calculation.
+        Returns: The value left on the stack.
+        Raises CalculationError if it has more bits than the limits allow.
+        """
+        result = self.stack[0]
+        if (self.limits is not None and self.limits.maxIntBits is not None
+                and numberBits(result) > self.limits.maxIntBits):
+            raise CalculationError("Limit Error: number too large")
+        return result
+
+def evaluateLimited(postfix, table, limits, checked = growingOps):
+    """
+    Evaluates a postfix expression within limits. The checks stay out of the
+    loop over the items where they can: the number of steps is checked
+    before evaluating, the deadline after every deadlineInterval items, and
+    the size of numbers only after the operators in checked and in the
+    result.
+    Parameters: postfix - The postfix expression, with numbers converted.
+                table - The operator table, e.g. a NumericBackend's ops.
+                limits - The Limits.
+                checked - The operators after which the size of numbers is
+                checked. The results of the others are assumed to grow by at
+                most a bit, as they do for ints.
+    Returns: The evaluation stack, which only holds the result if the postfix
+    expression is valid.
+    Raises CalculationError if the limits are exceeded, ArithmeticError if an
+    operator cannot be computed and IndexError if an operator does not have
+    enough operands.
+    """
+    if limits.maxSteps is not None and len(postfix) > limits.maxSteps:
+        checkSteps(postfix, limits)
+    maxIntBits = limits.maxIntBits
+    checkNumbers = maxIntBits is not None
+    if not checkNumbers:
+        maxIntBits = math.inf
+    deadline = limits.deadline
+    if deadline is None or len(postfix) <= deadlineInterval:
+        pieces = (postfix,)
+    else:
+        items = iter(postfix)
+        pieces = (islice(items, deadlineInterval) for start in range(0, len(postfix), deadlineInterval))
+    stack = []
+    append = stack.append
+    pop = stack.pop
+    for piece in pieces:
+        for item in piece:
+            if item not in ops:
+                append(item)
+            elif item in checked:
+                r = pop()
+                if arities[item] == 2:
+                    l = pop()
+                    # A power of a number of a bits has at least
+                    # (a - 1) * r + 1 bits, so it is not computed if it is
+                    # sure to be too large. Products are checked once they
+                    # are computed: their operands are within the limits, or
+                    # a little over for sums, so they take little time.
+                    if checkNumbers and item == "^" and type(r) is int and type(l) is not float:
+                        if (numberBits(l) - 1) * abs(r) + 1 > maxIntBits:
+                            raise CalculationError("Limit Error: number too large")
+                    result = table[item](l, r)
+                else:
+                    result = table[item](r)
+                kind = type(result)
+                bits = 0 if kind is float else result.bit_length() if kind is int else numberBits(result)
+                if bits > maxIntBits:
+                    raise CalculationError("Limit Error: number too large")
+                # Large results took long enough that the deadline is checked
+                # after each of them.
+                if deadline is not None and bits > largeBits and monotonic() > deadline:
+                    raise CalculationError("Limit Error: time limit exceeded")
+                append(result)
+            elif arities[item] == 2:
+                r = pop()
+                append(table[item](pop(), r))
+            else:
+                append(table[item](pop()))
+        if deadline is not None and monotonic() > deadline:
+            raise CalculationError("Limit Error: time limit exceeded")
+    # Numbers that were only added or subtracted have not been checked yet.
+    if checkNumbers and len(stack) == 1 and type(stack[0]) is not float and numberBits(stack[0]) > maxIntBits:
+        raise CalculationError("Limit Error: number too large")
+    return stack
+
+def checkSteps(postfix, limits):
+    """
+    Checks the number of operators in a postfix expression before it is
+    evaluated, so expressions with too many are rejected without evaluating
+    any of them.
+    Parameters: postfix - The postfix expression.
+                limits - The Limits.
+    Raises CalculationError if there are more operators than limits.maxSteps.
+    """
+    if limits.maxSteps is not None and len(postfix) > limits.maxSteps:
+        if sum(map(ops.__contains__, postfix)) > limits.maxSteps:
+            raise CalculationError("Limit Error: too many steps")
+
+# readChunks splits the input after runs of characters that can be part of a
+# token, so that no token is split between chunks: a number or a name, with
+# the open paren of a function call, or an operator symbol.
+tokenCharacters = re.compile(rb"[\w.\x80-\xff]*(?: *\()?[^\w\s().,\x80-\xff]*")
+
+def readChunks(path, chunkSize = batchBufferSize):
+    """
+    Reads a math expression from a file in pieces, through a memory map, so
+    the whole file is never in memory at once. A newline at the end of the
+    file is ignored.
+    Parameters: path - The file containing the math expression.
+                chunkSize - The approximate size of each piece, in bytes.
+    Returns: A generator of pieces of the math expression, as strings, split
+    between tokens.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            size = len(data)
+            while size > 0 and data[size - 1] in b"\r\n":
+                size -= 1
+            start = 0
+            while start < size:
+                end = min(start + chunkSize, size)
+                end = min(tokenCharacters.match(data, end).end(), size)
+                yield data[start:end].decode("utf-8", "replace")
+                start = end
+
+def backendContext(backend):
+    """
+    Get the context to evaluate in for a backend.
+    Parameters: backend - A NumericBackend, or None.
+    Returns: A context manager that sets the backend's decimal Context, if it
+    has one.
+    """
+    if backend is None or backend.context is None:
+        return nullcontext()
+    return localcontext(backend.context)
+
+def checkedOps(backend):
+    """
+    Get the operators after which a backend's results are checked against
+    Limits.maxIntBits.
+    Parameters: backend - The NumericBackend.
+    Returns: growingOps, or every operator for backends whose numbers can be
+    fractions, since a sum of fractions can be as large as their product.
+    """
+    if isinstance(backend.makeFloat, type) and issubclass(backend.makeFloat, Rational):
+        return ops
+    return growingOps
+
+def evaluateWithBackend(postfix, backend = None, limits = None):
+    """
+    Evaluates a valid postfix expression with a numeric backend.
+    Parameters: postfix - The postfix expression, with numbers converted by
+                the same backend, e.g. by parseToPostfix.
+                backend - The NumericBackend. None evaluates as
+                evaluatePostfix does.
+                limits - Optional Limits on the size of numbers, the number
+                of operators and the time.
     Returns: The result of the calculation.
+    Raises ArithmeticError if an operator cannot be computed, e.g.
+    ZeroDivisionError if the expression divides by zero, and CalculationError
+    if the limits are exceeded.
     """
+    if limits is not None:
+        if backend is None:
+            return evaluateLimited(postfix, ops, limits)[0]
+        with backendContext(backend):
+            return evaluateLimited(postfix, backend.ops, limits, checkedOps(backend))[0]
+    if backend is None:
+        return evaluatePostfix(postfix)
+    evaluator = StackEvaluator(backend.ops)
+    with backendContext(backend):
+        for item in postfix:
+            evaluator.append(item)
+    return evaluator.result()
+
+def evaluateFile(path, backend = None, limits = None):
+    """
+    Evaluates a math expression stored in a file. The expression is parsed
+    and evaluated in one pass without storing its postfix form, so time is
+    linear in the size of the file and memory does not depend on it.
+    Parameters: path - The file containing the math expression.
+                backend - The NumericBackend to evaluate with. Defaults to
+                ints and floats.
+                limits - Optional Limits. The deadline is checked as the file
+                is read, and the number of operators as they are evaluated.
+    Returns: The result of the calculation.
+    Raises CalculationError if the expression is invalid, is over the limits
+    or cannot be computed, e.g. because it divides by zero.
+    """
+    try:
+        with backendContext(backend):
+            if backend is None:
+                evaluator = StackEvaluator(ops, limits)
+            else:
+                evaluator = StackEvaluator(backend.ops, limits, checkedOps(backend))
+            return scanInfix(readChunks(path), evaluator, False, backend, limits).result()
+    except ArithmeticError as error:
+        raise mathError(error)
+
+def toNumber(item):
+    """
+    Converts a number from a postfix expression to an int or a float.
+    Parameters: item - The number string, or an already converted number.
+    Returns: A float if the number has a decimal point, otherwise an int.
+    Numbers that are already converted are returned unchanged.
+    """
+    if type(item) is not str:
+        return item
+    if "." in item:
+        return float(item)
+    return int(item)
+
+def evaluatePostfix(expression, limits = None):
+    """
+    Evaluates the result of a postfix expression.
+    Parameters: expression - The postfix expression, as a list or a
+                CompactProgram.
+                limits - Optional Limits on the size of numbers, the number
+                of operators and the time. Not checked for CompactPrograms.
+    Returns: The result of the calculation, or False if the expression is
+    invalid or over the limits.
+    """
+    if type(expression) is CompactProgram:
+        return expression.evaluate()
+    if limits is not None and len(expression) > 0:
+        try:
+            stack = evaluateLimited([item if item in ops else toNumber(item) for item in expression], ops, limits)
+        except CalculationError as error:
+            print(error.message, file = stderr)
+            return False
+        except IndexError:
+            # An operator without enough operands.
+            print("Syntax Error", file = stderr)
+            return False
+        if len(stack) != 1:
+            print("Syntax Error", file = stderr)
+            return False
+        return stack[0]
     if len(expression) > 0:
         evalStack = []
         for item in expression:
-            if item not in list(ops):
-                num = 0
-                if "." in item:
-                    num = float(item)
-                else:
-                    num = int(item)
-                evalStack.append(num)
+            if item not in ops:
+                # Numbers from parseToPostfix are already converted.
+                if type(item) is str:
+                    item = toNumber(item)
+                evalStack.append(item)
             else:
                 if len(evalStack) > 0:
                     r = evalStack.pop()
                 else:
                     print("Syntax Error", file = stderr)
                     return False
-                if len(evalStack) > 0:
-                    l = evalStack.pop() if item != "~" else 0
+                # Unary minus and some functions only have one operand.
+                if arities[item] == 1:
+                    evalStack.append(ops[item](r))
+                elif len(evalStack) > 0:
+                    evalStack.append(ops[item](evalStack.pop(), r))
                 else:
                     print("Syntax Error", file = stderr)
                     return False
-                evalStack.append(ops[item](l, r))
         
         if len(evalStack) == 1:
             return evalStack[0]
         else:
-            print("Syntax Error")
+            print("Syntax Error", file = stderr)
             return False
     else:
         print("Syntax Error", file = stderr)
         return False
 
+def compilePostfix(expression):
+    """
+    Compiles a postfix expression into a Python function, so it can be
+    evaluated many times without interpreting the postfix list again.
+    Numbers are converted once, when compiling. Each operator becomes one line
+    of straight-line code that stores its result in a variable named after
+    its position on the evaluation stack, so long expressions neither nest
+    nor need more variables than the stack is deep. Operators that Python
+    writes the same way are compiled inline; the others call their function.
+    Parameters: expression - The postfix expression.
+    Returns: A function with no parameters that returns the result of the
+    calculation, or False if the postfix expression is invalid.
+    """
+    if len(expression) == 0:
+        print("Syntax Error", file = stderr)
+        return False
+
+    lines = []
+    operands = []
+    # Numbers too large for a float are written by repr() as "inf".
+    namespace = {"inf": float("inf")}
+    for item in expression:
+        if item not in ops:
+            operands.append(repr(toNumber(item)))
+        elif len(operands) >= arities[item]:
+            r = operands.pop()
+            if item == "~":
+                # Unary minus is 0 - r, while "-r" would turn 0.0 into -0.0.
+                code = "0 - %s" % r
+            elif item in inlineOps:
+                code = "%s %s %s" % (operands.pop(), item, r)
+            else:
+                function = "f%d" % opcodes[item]
+                namespace[function] = ops[item]
+                args = r if arities[item] == 1 else operands.pop() + ", " + r
+                code = "%s(%s)" % (function, args)
+            result = "s" + str(len(operands))
+            lines.append("    %s = %s" % (result, code))
+            operands.append(result)
+        else:
+            print("Syntax Error", file = stderr)
+            return False
+
+    if len(operands) != 1:
+        print("Syntax Error", file = stderr)
+        return False
+
+    lines.append("    return " + operands[0])
+    source = "def compiledExpression():\n" + "\n".join(lines) + "\n"
+    exec(compile(source, "<postfix>", "exec"), namespace)
+    return namespace["compiledExpression"]
+
+# Opcodes of a CompactProgram.
+OP_INT = 0
+OP_FLOAT = 1
+OP_BIGINT = 2
+OP_ADD = 3
+OP_SUB = 4
+OP_MULT = 5
+OP_DIV = 6
+OP_NEG = 7
+
+# The opcode of each operator and function. Those after unary minus get the
+# next opcodes, in the order they were registered, so files written by
+# program.py with them can only be read while the same operators are
+# registered. Opcodes are bytes, so programs can only hold operators with
+# opcodes below 256.
+opcodes = {}
+
+# The function and the number of operands of each operator opcode, indexed
+# by opcode.
+opFunctions = []
+opArities = []
+
+# Operators that compilePostfix writes as Python operators.
+inlineOps = {"+", "-", "*", "/", "%", "//"}
+
+def buildTables():
+    """
+    Compiles the operator registry into the lookup tables used by the
+    tokenizer, the parsers, the evaluators and the backends. The tables are
+    updated in place, so modules that imported them see the changes, except
+    tokenPattern, which is replaced.
+    """
+    global tokenPattern
+    for table in (ops, arities, precedenceTable, popPrecedence, opcodes, adaptiveOps, decimalOps):
+        table.clear()
+    binaryOps.clear()
+    functionNames.clear()
+    growingOps.clear()
+    fixedOpcodes = {"+": OP_ADD, "-": OP_SUB, "*": OP_MULT, "/": OP_DIV, "~": OP_NEG}
+    opFunctions[:] = [None] * (OP_NEG + 1)
+    opArities[:] = [0] * (OP_NEG + 1)
+    for symbol, operator in operators.items():
+        ops[symbol] = operator.function
+        arities[symbol] = operator.arity
+        if operator.function not in boundedFunctions:
+            growingOps.add(symbol)
+        if operator.precedence is None:
+            functionNames.add(symbol)
+        elif operator.arity == 1:
+            precedenceTable[symbol] = operator.precedence
+            popPrecedence[symbol] = float("inf")
+        else:
+            binaryOps.add(symbol)
+            precedenceTable[symbol] = operator.precedence
+            popPrecedence[symbol] = operator.precedence + (0.5 if operator.rightAssociative else 0)
+        code = fixedOpcodes.get(symbol)
+        if code is None:
+            code = len(opFunctions)
+            opFunctions.append(None)
+            opArities.append(0)
+        opcodes[symbol] = code
+        opFunctions[code] = operator.function
+        opArities[code] = operator.arity
+    for table, overrides in ((adaptiveOps, adaptiveOverrides), (decimalOps, decimalOverrides)):
+        table.update(ops)
+        table.update((symbol, function) for symbol, function in overrides.items() if symbol in ops)
+    tokenPattern = makeTokenPattern([symbol for symbol in operators if symbol not in functionNames])
+
+buildTables()
+
+class CompactProgram:
+    """
+    A postfix expression stored in typed arrays instead of a list of objects:
+    one opcode byte per item, and 8 bytes per number in an int or a float
+    pool. Number opcodes take the next value from their pool, in order.
+    Ints too large for 64 bits are kept in a list of their own.
+    evaluatePostfix accepts a CompactProgram in place of a list.
+    """
+
+    __slots__ = ("code", "ints", "floats", "bigInts")
+
+    def __init__(self, postfix):
+        """
+        Parameters: postfix - The postfix expression, from compileExpression
+                    or convertToPostfix. Numbers may be strings or already
+                    converted.
+        Raises ValueError if the postfix expression is not valid.
+        """
+        code = array("B")
+        ints = array("q")
+        floats = array("d")
+        bigInts = []
+        depth = 0
+        for item in postfix:
+            if item in ops:
+                needed = arities[item]
+                if depth < needed:
+                    raise ValueError("invalid postfix expression")
+                if opcodes[item] > 255:
+                    raise ValueError("operator has no opcode: " + item)
+                depth -= needed - 1
+                code.append(opcodes[item])
+                continue
+            if type(item) is str:
+                item = toNumber(item)
+            if type(item) is float:
+                code.append(OP_FLOAT)
+                floats.append(item)
+            elif -(1 << 63) <= item < 1 << 63:
+                code.append(OP_INT)
+                ints.append(item)
+            else:
+                code.append(OP_BIGINT)
+                bigInts.append(item)
+            depth += 1
+        if depth != 1:
+            raise ValueError("invalid postfix expression")
+        self.code = code
+        self.ints = ints
+        self.floats = floats
+        self.bigInts = bigInts
+
+    def __len__(self):
+        return len(self.code)
+
+    def evaluate(self):
+        """
+        Evaluates the program.
+        Returns: The result of the calculation.
+        Raises ArithmeticError, e.g. ZeroDivisionError if the program divides
+        by zero.
+        """
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        nextInt = iter(self.ints).__next__
+        nextFloat = iter(self.floats).__next__
+        nextBigInt = iter(self.bigInts).__next__
+        functions = opFunctions
+        arity = opArities
+        for op in self.code:
+            if op == OP_INT:
+                push(nextInt())
+            elif op == OP_FLOAT:
+                push(nextFloat())
+            elif op == OP_NEG:
+                push(sub(0, pop()))
+            elif op == OP_BIGINT:
+                push(nextBigInt())
+            elif arity[op] == 1:
+                push(functions[op](pop()))
+            else:
+                r = pop()
+                push(functions[op](pop(), r))
+        return stack[0]
+
+    def postfix(self):
+        """
+        Converts the program back to a postfix list.
+        Returns: The postfix expression, with numbers converted.
+        """
+        names = {code: op for op, code in opcodes.items()}
+        pools = {OP_INT: iter(self.ints), OP_FLOAT: iter(self.floats), OP_BIGINT: iter(self.bigInts)}
+        return [next(pools[op]) if op in pools else names[op] for op in self.code]
+
+    def size(self):
+        """
+        Get the memory used by the program.
+        Returns: The size in bytes of the program and its arrays.
+        """
+        size = getsizeof(self) + getsizeof(self.code) + getsizeof(self.ints) + getsizeof(self.floats)
+        size += getsizeof(self.bigInts) + sum(getsizeof(item) for item in self.bigInts)
+        return size
+
+def compileExpression(input, backend = None):
+    """
+    Parses and validates a math expression and converts it to postfix.
+    Parameters: input - The math expression string.
+                backend - The NumericBackend that converts the numbers.
+                Defaults to ints and floats.
+    Returns: The postfix expression, or False if the expression is invalid.
+    """
+    try:
+        return parseToPostfix(input, False, backend)
+    except CalculationError as error:
+        print(error.message, file = stderr)
+        return False
+
+class ExpressionCache:
+    """
+    A bounded cache of compiled (postfix) expressions, keyed by the input
+    string with surrounding whitespace removed.
+    Invalid inputs are cached as False with their error messages, so they are
+    not validated again, and the message is printed again for each of them.
+    When there are more than maxEntries entries, or the entries take up more
+    than about maxBytes bytes, the least recently used entries are evicted.
+    Either limit can be None to disable it.
+    Numbers are converted by backend, a NumericBackend, so the cache must only
+    be used to evaluate with that backend. Defaults to ints and floats.
+    """
+
+    def __init__(self, maxEntries = 4096, maxBytes = None, backend = None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.backend = backend
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def compile(self, input):
+        """
+        Gets the compiled form of a math expression, compiling and caching it
+        if it is not already cached.
+        Parameters: input - The math expression string.
+        Returns: The postfix expression as a tuple, or False if the expression
+        is invalid.
+        """
+        if not input:
+            return compileExpression(input, self.backend)
+        key = input.strip()
+        entries = self.entries
+        if key in entries:
+            self.hits += 1
+            entries.move_to_end(key)
+            postfix, size, message = entries[key]
+            if postfix is False:
+                print(message, file = stderr)
+            return postfix
+
+        self.misses += 1
+        message = None
+        try:
+            postfix = tuple(parseToPostfix(key, False, self.backend))
+        except CalculationError as error:
+            print(error.message, file = stderr)
+            postfix = False
+            message = error.message
+        size = entrySize(key, postfix)
+        entries[key] = (postfix, size, message)
+        self.bytes += size
+        while len(entries) > 1 and self.isOverLimit():
+            evictedKey, (evicted, evictedSize, evictedMessage) = entries.popitem(last = False)
+            self.bytes -= evictedSize
+            self.evictions += 1
+        return postfix
+
+    def isOverLimit(self):
+        """
+        Test whether the cache holds more than its limits allow.
+        Returns: True if an entry should be evicted, otherwise returns False.
+        """
+        if self.maxEntries is not None and len(self.entries) > self.maxEntries:
+            return True
+        return self.maxBytes is not None and self.bytes > self.maxBytes
+
+    def stats(self):
+        """
+        Get the cache counters.
+        Returns: A dictionary with the hits, misses, evictions, entries and
+        bytes counts.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+        }
+
+    def clear(self):
+        """
+        Removes every entry from the cache. The counters are kept.
+        """
+        self.entries.clear()
+        self.bytes = 0
+
+def entrySize(key, postfix):
+    """
+    Estimate the memory used by a cache entry.
+    Parameters: key - The cache key.
+                postfix - The cached postfix tuple, or False.
+    Returns: The approximate size of the entry in bytes.
+    """
+    size = getsizeof(key) + getsizeof(postfix)
+    if postfix is not False:
+        for item in postfix:
+            size += getsizeof(item)
+    return size
+
+def evaluateExpression(input, cache = None, backend = None):
+    """
+    Runs a math expression through the whole pipeline: parse, validate,
+    convert to postfix and evaluate.
+    Parameters: input - The math expression string.
+                cache - An optional ExpressionCache. With a cache, repeated
+                expressions are only evaluated, not parsed again. It must
+                have been created with the same backend.
+                backend - The NumericBackend to evaluate with. Defaults to
+                ints and floats.
+    Returns: The result of the calculation, or False if the expression is
+    invalid or cannot be evaluated.
+    """
+    if cache is not None:
+        postfix = cache.compile(input)
+    else:
+        postfix = compileExpression(input, backend)
+    if postfix is False:
+        return False
+    try:
+        return evaluateWithBackend(postfix, backend)
+    except ArithmeticError as error:
+        print(mathError(error).message, file = stderr)
+        return False
+
+def calculate(input, backend = None, limits = None):
+    """
+    Runs a math expression through the whole pipeline without printing
+    anything.
+    Parameters: input - The math expression string.
+                backend - The NumericBackend to evaluate with. Defaults to
+                ints and floats.
+                limits - Optional Limits on the resources the expression may
+                use.
+    Returns: The result of the calculation.
+    Raises CalculationError if the expression is invalid, is over the limits
+    or cannot be computed, e.g. because it divides by zero.
+    """
+    postfix = parseToPostfix(input, False, backend, limits)
+    try:
+        return evaluateWithBackend(postfix, backend, limits)
+    except ArithmeticError as error:
+        raise mathError(error)
+
+# An expression compiled by a Calculator. Its fields are never changed after
+# it is made, so one compiled expression can be evaluated by many threads.
+# input - The math expression string.
+# postfix - The postfix expression, as a tuple, with numbers converted.
+# names - The variable names the expression uses, as a frozenset.
+CompiledExpression = namedtuple("CompiledExpression", ["input", "postfix", "names"])
+
+# The outcome of evaluating one math expression with Calculator.run.
+# input - The math expression string, or the CompiledExpression.
+# value - The result of the calculation, or None if there is an error.
+# error - The CalculationError, or None if there is a result.
+CalculationResult = namedtuple("CalculationResult", ["input", "value", "error"])
+
+class Calculator:
+    """
+    Compiles and evaluates math expressions without printing anything,
+    keeping a cache or changing its arguments, so one Calculator and the
+    expressions it compiles can be used by many threads at once without
+    locks. Errors are raised as CalculationErrors, or returned in
+    CalculationResults, and each call gets errors of its own.
+    The Calculator is not changed after it is made. Registering operators
+    changes the tables every Calculator uses, so it must not be done while
+    expressions are being compiled or evaluated.
+    """
+
+    def __init__(self, mode = "native", precision = None, allowNames = False, limits = None, timeout = None):
+        """
+        Parameters: mode - How numbers are represented, one of the keys of
+                    backends.
+                    precision - For the decimal mode, the number of
+                    significant digits, or None for the default.
+                    allowNames - Whether expressions may use variable names
+                    such as "x", which are bound when they are evaluated.
+                    limits - Optional Limits on the resources each
+                    expression may use.
+                    timeout - The most seconds each call may take, or None.
+        Raises ValueError if the mode or precision is invalid.
+        """
+        backend = getBackend(mode, None if precision is None else str(precision))
+        if backend is False:
+            raise ValueError("invalid mode or precision")
+        self.mode = mode
+        self.backend = backend
+        self.allowNames = allowNames
+        self.limits = limits
+        self.timeout = timeout
+
+    def callLimits(self):
+        """
+        Get the limits of one call, with its deadline.
+        Returns: The Limits, or None if there are none.
+        """
+        if self.timeout is None:
+            return self.limits
+        return (self.limits or Limits())._replace(deadline = monotonic() + self.timeout)
+
+    def compile(self, input, limits = None):
+        """
+        Parses a math expression once, so it can be evaluated many times.
+        Parameters: input - The math expression string.
+                    limits - The Limits to parse within. Defaults to the
+                    Calculator's.
+        Returns: A CompiledExpression.
+        Raises CalculationError if the expression is invalid or over the
+        limits.
+        """
+        if limits is None:
+            limits = self.callLimits()
+        postfix = tuple(parseToPostfix(input, self.allowNames, self.backend, limits))
+        names = frozenset(item for item in postfix if type(item) is str and item not in ops)
+        return CompiledExpression(input, postfix, names)
+
+    def evaluate(self, expression, variables = None):
+        """
+        Evaluates a math expression.
+        Parameters: expression - A CompiledExpression from this Calculator, or
+                    a math expression string.
+                    variables - A dictionary mapping the names the expression
+                    uses to their values, converted as the Calculator's mode
+                    converts numbers.
+        Returns: The result of the calculation.
+        Raises CalculationError if the expression is invalid, uses a name
+        that has no value, is over the limits or cannot be computed, e.g.
+        because it divides by zero.
+        """
+        limits = self.callLimits()
+        if type(expression) is not CompiledExpression:
+            expression = self.compile(expression, limits)
+        postfix = expression.postfix
+        if expression.names:
+            for name in expression.names:
+                if variables is None or name not in variables:
+                    raise CalculationError("Invalid Input: unknown variable " + name + ".")
+            postfix = [variables[item] if item in expression.names else item for item in postfix]
+        try:
+            return evaluateWithBackend(postfix, self.backend, limits)
+        except ArithmeticError as error:
+            raise mathError(error)
+
+    def run(self, expression, variables = None):
+        """
+        Evaluates a math expression without raising errors.
+        Parameters: expression - A CompiledExpression from this Calculator, or
+                    a math expression string.
+                    variables - A dictionary mapping names to values.
+        Returns: A CalculationResult with either the value or the error.
+        """
+        try:
+            return CalculationResult(expression, self.evaluate(expression, variables), None)
+        except CalculationError as error:
+            return CalculationResult(expression, None, error)
+
+    def map(self, expressions, variables = None):
+        """
+        Evaluates many math expressions without raising errors.
+        Parameters: expressions - An iterable of CompiledExpressions or math
+                    expression strings.
+                    variables - A dictionary mapping names to values, used
+                    for every expression.
+        Returns: A list with the CalculationResult of each expression, in
+        order.
+        """
+        return [self.run(expression, variables) for expression in expressions]
+
+def evaluateStream(lines, output, cache = None, backend = None):
+    """
+    Evaluates newline-delimited math expressions one line at a time, so memory
+    use does not depend on the amount of input.
+    Parameters: lines - An iterable of lines, such as an open file.
+                output - A writable text stream for the results.
+                cache - An optional ExpressionCache for repeated expressions.
+                backend - The NumericBackend to evaluate with.
+    Returns: The number of lines that could not be evaluated.
+    Results are written in input order, one per line. Lines that fail are
+    written as errorMarker.
+    """
+    errors = 0
+    for line in lines:
+        result = evaluateExpression(line.rstrip("\r\n"), cache, backend)
+        # Compare by identity, since a result of 0 is equal to False.
+        if result is not False:
+            try:
+                output.write(formatResult(result) + "\n")
+                continue
+            except CalculationError as error:
+                print(error.message, file = stderr)
+        output.write(errorMarker + "\n")
+        errors += 1
+    return errors
+
+def openLines(path):
+    """
+    Opens the input of a batch.
+    Parameters: path - The input file path, or "-" to read standard input.
+    Returns: The file, or standard input, or None if the file cannot be
+    opened, in which case the error is printed to standard error.
+    """
+    if path == "-":
+        return stdin
+    try:
+        return open(path, buffering = batchBufferSize)
+    except OSError as error:
+        print("File Error: %s: %s" % (error.strerror, path), file = stderr)
+        return None
+
+def runBatch(path, backend = None):
+    """
+    Evaluates every line of a file, or of standard input, and writes the
+    results to standard output through a large buffer.
+    Parameters: path - The input file path, or "-" to read standard input.
+                backend - The NumericBackend to evaluate with.
+    Returns: The number of lines that could not be evaluated, or 1 if the
+    file cannot be opened.
+    """
+    lines = openLines(path)
+    if lines is None:
+        return 1
+    output = open(stdout.fileno(), "w", buffering = batchBufferSize, closefd = False)
+    cache = ExpressionCache(backend = backend)
+    try:
+        return evaluateStream(lines, output, cache, backend)
+    finally:
+        output.flush()
+        if lines is not stdin:
+            lines.close()
+
+def parseOptions(args):
+    """
+    Separates "--name" and "--name=value" options from the other arguments.
+    Option names start with a letter, so expressions such as "--3" are
+    arguments. Every argument after "--" is an argument too.
+    Parameters: args - The command line arguments, without the program name.
+    Returns: (options, arguments)
+             options - A dictionary mapping option names to their values, or
+             to True for options given without a value.
+             arguments - The remaining arguments, in order.
+    """
+    options = {}
+    arguments = []
+    args = iter(args)
+    for arg in args:
+        if arg == "--":
+            arguments += args
+        elif arg.startswith("--") and arg[2:3].isalpha():
+            name, separator, value = arg[2:].partition("=")
+            options[name] = value if separator else True
+        else:
+            arguments.append(arg)
+    return (options, arguments)
+
+def getBackend(mode, precision = None):
+    """
+    Get the numeric backend for the --mode and --precision options.
+    Parameters: mode - The backend name, one of the keys of backends.
+                precision - For the decimal backend, the number of significant
+                digits, as a string, or None for the default.
+    Returns: The NumericBackend, None for native, or False if the options are
+    invalid.
+    """
+    if mode not in backends or (precision is not None and mode != "decimal"):
+        return False
+    if mode == "native":
+        return None
+    if precision is not None:
+        if precision is True or not precision.isdigit() or int(precision) == 0:
+            return False
+        return decimalBackend(int(precision))
+    return backends[mode]
+
 def main():
     """
     Parses the program input, validates the input, converts it to postfix,
     evaluates the result, then prints the result.
+    With --batch, evaluates one expression per line of the file named by the
+    argument, or of standard input if there is no argument or it is "-".
+    With --batch and --jobs=N, the lines are evaluated by N worker processes.
+    With --batch and --dedup, subexpressions that the lines have in common are
+    only computed once, and the dedup ratio is printed to standard error.
+    With --batch, --binary=float64|int64 and --output=PATH, the results are
+    written to PATH as a binary column, with a validity bitmap in PATH.valid.
+    With --file, evaluates the single expression stored in the file named by
+    the argument, which may be too large to pass as an argument.
+    --mode=native|fraction|decimal|adaptive chooses how numbers are
+    represented (except with --jobs), and --precision=N sets the number of
+    significant digits for --mode=decimal.
+    --stats times each stage of the pipeline and writes a report to standard
+    error afterwards; --stats=json writes the statistics as JSON instead.
+    --cache, or --cache=DIRECTORY, looks a single expression's result up in
+    a ResultCache, and stores it there if it is not cached yet.
     """
 
-    if len(argv) == 2:
-        input = str(argv[1])
-        expression = parse(input)
-        validatedExpression = None
-        postfix = None
-        result = None
-        if expression:
-            validatedExpression = validateSyntax(expression)
-        if validatedExpression:
-            postfix = (convertToPostfix(validatedExpression))
-        if postfix:
-            result = evaluatePostfix(postfix)
-        if result:
-            print(result)
+    options, arguments = parseOptions(argv[1:])
+    mode = options.pop("mode", "native")
+    precision = options.pop("precision", None)
+    backend = getBackend(mode, precision)
+    stats = options.pop("stats", None)
+    instrumentation = None
+    if stats is not None:
+        import instrument
+        instrumentation = instrument.enable(None, modules[__name__])
+    if backend is False:
+        print("Invalid Input")
+    elif "batch" in options and options["batch"] is True and len(arguments) <= 1:
+        path = arguments[0] if arguments else "-"
+        if list(options) == ["batch"]:
+            runBatch(path, backend)
+        elif sorted(options) == ["batch", "jobs"] and options["jobs"] is not True and backend is None:
+            if options["jobs"].isdigit() and int(options["jobs"]) > 0:
+                from parallel import runParallelBatch
+                runParallelBatch(path, int(options["jobs"]), instrumentation)
+            else:
+                print("Invalid Input", file = stderr)
+        elif sorted(options) == ["batch", "dedup"] and options["dedup"] is True:
+            from optimize import runDedupBatch
+            runDedupBatch(path, backend)
+        elif (sorted(options) == ["batch", "binary", "output"] and options["binary"] in ("float64", "int64")
+                and options["output"] is not True):
+            from binaryoutput import runBinaryBatch
+            runBinaryBatch(path, options["output"], options["binary"], backend)
+        else:
+            print("Invalid Input")
+    elif list(options) == ["file"] and options["file"] is True and len(arguments) == 1:
+        try:
+            print(formatResult(evaluateFile(arguments[0], backend)))
+        except CalculationError as error:
+            print(error.message, file = stderr)
+    elif list(options) == ["cache"] and len(arguments) == 1:
+        from resultcache import ResultCache
+        from resultcache import cacheDirectory
+        from resultcache import cacheKey
+        cache = ResultCache(cacheDirectory(options["cache"]))
+        key = cacheKey(arguments[0], mode, precision)
+        entry = cache.get(key)
+        if entry is None:
+            try:
+                entry = (formatResult(calculate(arguments[0], backend)), False)
+            except CalculationError as error:
+                entry = (error.message, True)
+            cache.put(key, *entry)
+        if entry[1]:
+            print(entry[0], file = stderr)
+        else:
+            print(entry[0])
+    elif not options and len(arguments) == 1:
+        result = evaluateExpression(str(arguments[0]), None, backend)
+        if result is not False:
+            try:
+                print(formatResult(result))
+            except CalculationError as error:
+                print(error.message, file = stderr)
     else:
         print("Invalid Input")
+    if stats is not None:
+        instrument.disable()
+        instrument.dump(instrumentation, stats, stderr)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Run as a script, this module is __main__. The modules main imports get
+    # it as calculate too, so they share its tables and its timed stages.
+    modules.setdefault("calculate", modules[__name__])
+    main()
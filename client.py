@@ -0,0 +1,149 @@
+#! /usr/bin/env python3.7
+
+# A thin client for server.py.
+
+import selectors
+import socket
+from sys import argv
+from sys import stdin
+
+from calculate import CalculationError
+from calculate import errorMarker
+from calculate import parseOptions
+from server import defaultPort
+
+# How many requests are sent at a time. Replies are read while a window is
+# being sent, so neither side blocks on a full socket buffer.
+pipelineWindow = 1024
+
+# The most bytes sent or received by one call.
+ioSize = 1 << 16
+
+class Client:
+    """
+    A connection to a calculator server.
+    """
+
+    def __init__(self, port = defaultPort, host = "127.0.0.1", path = None):
+        """
+        Connects to a server.
+        Parameters: port, host - The server's TCP address, if path is not given.
+                    path - The path of the server's Unix domain socket.
+        """
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port))
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        # Received bytes after the last complete reply line.
+        self.buffer = bytearray()
+
+    def evaluate(self, input):
+        """
+        Evaluates one math expression.
+        Parameters: input - The math expression string.
+        Returns: The result of the calculation, or a CalculationError.
+        """
+        return self.evaluateMany([input])[0]
+
+    def evaluateMany(self, expressions):
+        """
+        Evaluates many math expressions, sending them in pipelined windows
+        instead of waiting for each reply.
+        Parameters: expressions - An iterable of math expression strings.
+        Returns: A list with the result of each expression, in input order, or
+        a CalculationError for expressions that could not be evaluated.
+        """
+        results = []
+        window = []
+        for input in expressions:
+            window.append(input.replace("\n", " ").encode() + b"\n")
+            if len(window) == pipelineWindow:
+                results += self.send(window)
+                window = []
+        if window:
+            results += self.send(window)
+        return results
+
+    def send(self, requests):
+        """
+        Sends a window of requests and reads their replies. Replies are read
+        as soon as they arrive, while the requests are still being sent, so a
+        server that stops reading until its replies are read does not block
+        the client.
+        Parameters: requests - A list of request lines, as bytes.
+        Returns: A list of results, see evaluateMany.
+        """
+        data = memoryview(b"".join(requests))
+        results = []
+        while len(results) < len(requests):
+            self.selector.modify(self.socket, selectors.EVENT_READ | (selectors.EVENT_WRITE if data else 0))
+            for key, events in self.selector.select():
+                if events & selectors.EVENT_WRITE:
+                    try:
+                        data = data[self.socket.send(data[:ioSize]):]
+                    except BlockingIOError:
+                        pass
+                if events & selectors.EVENT_READ:
+                    try:
+                        received = self.socket.recv(ioSize)
+                    except BlockingIOError:
+                        continue
+                    if not received:
+                        raise ConnectionError("Server closed the connection")
+                    self.buffer += received
+                    end = self.buffer.rfind(b"\n") + 1
+                    if end:
+                        results += [parseReply(line) for line in bytes(self.buffer[:end]).splitlines(True)]
+                        del self.buffer[:end]
+        return results
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.selector.close()
+        self.socket.close()
+
+def parseReply(line):
+    """
+    Parses a reply line from the server.
+    Parameters: line - The reply line, as bytes.
+    Returns: The result of the calculation, or a CalculationError.
+    """
+    status, separator, value = line.decode().rstrip("\n").partition(" ")
+    if status == "OK":
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    if status == "ERROR":
+        position, separator, message = value.partition(" ")
+        return CalculationError(message, None if position == "-" else int(position))
+    raise ConnectionError("Unexpected reply from server: " + repr(line))
+
+def main():
+    """
+    Sends the expression given as an argument, or each line of standard input,
+    to a server and prints the results. Use --socket=PATH, or --port=N and
+    --host=ADDRESS, to choose the server.
+    """
+    options, arguments = parseOptions(argv[1:])
+    if len(arguments) > 1 or not set(options) <= {"socket", "port", "host"} or True in options.values():
+        print("Invalid Input")
+        return
+    client = Client(int(options.get("port", defaultPort)), options.get("host", "127.0.0.1"),
+                    options.get("socket"))
+    expressions = arguments or (line.rstrip("\r\n") for line in stdin)
+    for result in client.evaluateMany(expressions):
+        if isinstance(result, CalculationError):
+            print(errorMarker + " " + result.message)
+        else:
+            print(result)
+    client.close()
+
+if __name__ == "__main__":
+    main()
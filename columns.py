@@ -0,0 +1,373 @@
+#! /usr/bin/env python3.7
+
+# Applies one math expression to every row of a CSV file, or of a directory
+# of NumPy .npy column files, e.g. "(price - cost) / price". The expression is
+# parsed once, and the file is read and evaluated in chunks of rows, one array
+# operation per operator, so memory use does not grow with the file. Results
+# are written as text, one per line, or as a binary column with
+# binaryoutput.ColumnWriter, which writes each chunk's array as it is.
+
+import csv
+import os
+import re
+from itertools import islice
+from itertools import repeat
+from operator import contains
+from operator import itemgetter
+from sys import argv
+from sys import stderr
+from sys import stdin
+from sys import stdout
+
+from binaryoutput import ColumnWriter
+from binaryoutput import columnTypes
+from calculate import CalculationError
+from calculate import batchBufferSize
+from calculate import errorMarker
+from calculate import formatResult
+from calculate import evaluateWithBackend
+from calculate import mathError
+from calculate import ops
+from calculate import parseOptions
+from calculate import toNumber
+from vectorize import compileFormula
+from vectorize import formulaNames
+from vectorize import groupOps
+from vectorize import maxExactInt
+from vectorize import numpy
+
+# How many rows are read and evaluated at a time.
+chunkRows = 1 << 16
+
+# The numbers a CSV field may hold: an int or a float, as written in math
+# expressions, optionally negative and surrounded by spaces.
+fieldPattern = re.compile(r" *-?(?:[0-9]+|[0-9]*\.[0-9]+) *")
+intFieldPattern = re.compile(r" *-?[0-9]+ *")
+
+# Of the fields float accepts, those with other characters or with a decimal
+# point not followed by a digit are not numbers in math expressions.
+invalidFieldPattern = re.compile(r"[^-0-9. \n]|\.(?![0-9])")
+
+def fieldValue(field):
+    """
+    Converts a CSV field to a number.
+    Parameters: field - The field string.
+    Returns: The int or float, or None if the field is not a number.
+    """
+    if intFieldPattern.fullmatch(field):
+        try:
+            return int(field)
+        except ValueError:
+            # More digits than Python converts to an int.
+            return None
+    if fieldPattern.fullmatch(field):
+        return float(field)
+    return None
+
+def columnValues(column):
+    """
+    Converts a chunk of a column to arrays.
+    Parameters: column - A list of CSV field strings, or a NumPy array.
+    Returns: A tuple of three arrays with an element per row: the values as
+    float64, whether each value is an int, and whether each value is valid.
+    """
+    count = len(column)
+    if isinstance(column, numpy.ndarray):
+        isInt = numpy.full(count, column.dtype.kind in "iub")
+        return column.astype(numpy.float64), isInt, numpy.ones(count, dtype = bool)
+    isInt = ~numpy.fromiter(map(contains, column, repeat(".")), bool, count)
+    if not invalidFieldPattern.search("\n".join(column)):
+        try:
+            values = numpy.fromiter(map(float, column), numpy.float64, count)
+            return values, isInt, numpy.ones(count, dtype = bool)
+        except ValueError:
+            pass
+    # Only check each field when some field is not a number.
+    valid = numpy.fromiter(map(bool, map(fieldPattern.fullmatch, column)), bool, count)
+    fields = [field if isValid else "0" for field, isValid in zip(column, valid.tolist())]
+    return numpy.fromiter(map(float, fields), numpy.float64, count), isInt, valid
+
+def exactValue(column, index):
+    """
+    Get a value of a chunk of a column as a Python number.
+    Parameters: column - A list of CSV field strings, or a NumPy array.
+                index - The row within the chunk.
+    Returns: The int or float, or None if the field is not a number.
+    """
+    if isinstance(column, numpy.ndarray):
+        return column[index].item()
+    return fieldValue(column[index])
+
+def evaluateColumns(postfix, columns, count):
+    """
+    Evaluates a postfix expression over chunks of columns, in float64. Each
+    row is an int where calculate's result would be an int, and rows whose
+    ints would not be exact in float64 are flagged, so the results are the
+    same as evaluating each row on its own.
+    Parameters: postfix - The postfix expression, from compileFormula.
+                columns - A dictionary mapping each name in the expression to
+                a chunk of its column, as from columnValues.
+                count - The number of rows in the chunk.
+    Returns: A tuple of three arrays with an element per row: the results,
+    whether each result is an int, and whether the row must instead be
+    evaluated on its own, because a value is invalid, it divides by zero or
+    its ints are too large, or because the expression has operators other than
+    those in groupOps.
+    """
+    if not groupOps.issuperset(item for item in postfix if item in ops):
+        return numpy.zeros(count), numpy.zeros(count, dtype = bool), numpy.ones(count, dtype = bool)
+    bad = numpy.zeros(count, dtype = bool)
+    for values, isInt, valid in columns.values():
+        bad |= ~valid | (isInt & (numpy.abs(values) >= maxExactInt))
+    stack = []
+    with numpy.errstate(all = "ignore"):
+        for item in postfix:
+            if item in columns:
+                values, isInt = columns[item][:2]
+                # Python ints have no negative zero; adding 0.0 turns -0.0
+                # into 0.0.
+                stack.append((numpy.where(isInt, values + 0.0, values), isInt))
+            elif item not in ops:
+                value = toNumber(item)
+                if type(value) is int and abs(value) >= maxExactInt:
+                    bad[:] = True
+                stack.append((numpy.float64(value), type(value) is int))
+            elif item == "~":
+                r, isInt = stack.pop()
+                stack.append((ops[item](r), isInt))
+            else:
+                r, rInt = stack.pop()
+                l, lInt = stack.pop()
+                if item == "/":
+                    bad |= r == 0
+                    isInt = False
+                else:
+                    isInt = lInt & rInt
+                result = ops[item](l, r)
+                if item == "*":
+                    result = numpy.where(isInt, result + 0.0, result)
+                bad |= isInt & (numpy.abs(result) >= maxExactInt)
+                stack.append((result, isInt))
+    values, isInt = stack[0]
+    return (numpy.broadcast_to(values, count), numpy.broadcast_to(isInt, count), bad)
+
+def evaluateRow(postfix, columns, index):
+    """
+    Evaluates a postfix expression for one row, with Python numbers.
+    Parameters: postfix - The postfix expression, from compileFormula.
+                columns - A dictionary mapping each name in the expression to
+                a chunk of its column, as given to columnValues.
+                index - The row within the chunk.
+    Returns: The result, or a CalculationError.
+    """
+    bound = []
+    for item in postfix:
+        if item in columns:
+            value = exactValue(columns[item], index)
+            if value is None:
+                return CalculationError("Invalid Input: " + item + " is not a number.")
+            bound.append(value)
+        elif item in ops:
+            bound.append(item)
+        else:
+            bound.append(toNumber(item))
+    try:
+        return evaluateWithBackend(bound, None)
+    except ArithmeticError as error:
+        return mathError(error)
+
+def csvChunks(lines, names, chunkSize = chunkRows):
+    """
+    Reads a CSV file with a header row in chunks of rows.
+    Parameters: lines - The open file.
+                names - The names of the columns to read.
+                chunkSize - The number of rows per chunk.
+    Returns: A generator of tuples of the number of rows in the chunk and a
+    dictionary mapping each name to a list of the fields in its column. Rows
+    without the column get an empty field.
+    Raises CalculationError if a name is not a column of the file.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, [])
+    for name in names:
+        if name not in header:
+            raise CalculationError("Invalid Input: unknown variable " + name + ".")
+    indexes = {name: header.index(name) for name in names}
+    width = max(indexes.values(), default = -1) + 1
+    while True:
+        rows = list(islice(reader, chunkSize))
+        if not rows:
+            return
+        if min(map(len, rows)) < width:
+            rows = [row + [""] * (width - len(row)) for row in rows]
+        yield len(rows), {name: list(map(itemgetter(index), rows)) for name, index in indexes.items()}
+
+def npyChunks(directory, names, chunkSize = chunkRows):
+    """
+    Reads columns stored as name.npy files in a directory, in chunks of rows.
+    The files are memory mapped, so only the chunk being evaluated is read.
+    Parameters: directory - The directory path.
+                names - The names of the columns to read.
+                chunkSize - The number of rows per chunk.
+    Returns: A generator of tuples of the number of rows in the chunk and a
+    dictionary mapping each name to an array of the values in its column.
+    Raises CalculationError if a column is missing or the columns do not all
+    have the same length.
+    """
+    columns = {}
+    for name in names:
+        path = os.path.join(directory, name + ".npy")
+        if not os.path.exists(path):
+            raise CalculationError("Invalid Input: unknown variable " + name + ".")
+        columns[name] = numpy.load(path, mmap_mode = "r")
+    lengths = {len(column) for column in columns.values()}
+    if len(lengths) > 1:
+        raise CalculationError("Invalid Input: columns have different lengths.")
+    length = lengths.pop() if lengths else 0
+    for start in range(0, length, chunkSize):
+        yield (min(chunkSize, length - start),
+               {name: numpy.asarray(column[start:start + chunkSize]) for name, column in columns.items()})
+
+def evaluateChunks(postfix, chunks, output):
+    """
+    Evaluates a postfix expression over chunks of columns, and writes the
+    result of each row to output, one per line, in the same format as batch
+    mode. Error messages are printed to standard error.
+    Parameters: postfix - The postfix expression, from compileFormula.
+                chunks - An iterable of chunks, from csvChunks or npyChunks.
+                output - A writable text stream for the results.
+    Returns: The number of rows that could not be evaluated.
+    """
+    errors = 0
+    for count, chunk in chunks:
+        values, isInt, bad = evaluateColumns(postfix, {name: columnValues(column) for name, column in chunk.items()},
+                                             count)
+        if isInt.all():
+            with numpy.errstate(all = "ignore"):
+                lines = list(map(str, values.astype(numpy.int64).tolist()))
+        else:
+            lines = list(map(str, values.tolist()))
+            if isInt.any():
+                for index in numpy.flatnonzero(isInt & ~bad).tolist():
+                    lines[index] = str(int(values[index]))
+        for index in numpy.flatnonzero(bad).tolist():
+            result = evaluateRow(postfix, chunk, index)
+            if not isinstance(result, CalculationError):
+                try:
+                    lines[index] = formatResult(result)
+                    continue
+                except CalculationError as error:
+                    result = error
+            print(result.message, file = stderr)
+            lines[index] = errorMarker
+            errors += 1
+        output.write("\n".join(lines) + "\n")
+    return errors
+
+def evaluateChunksBinary(postfix, chunks, writer):
+    """
+    Evaluates a postfix expression over chunks of columns, and writes the
+    results to a binary column. Rows that cannot be evaluated, or whose
+    results do not fit in the column type, are invalid, and their error
+    messages are printed to standard error.
+    Parameters: postfix - The postfix expression, from compileFormula.
+                chunks - An iterable of chunks, from csvChunks or npyChunks.
+                writer - The binaryoutput.ColumnWriter.
+    Returns: The number of invalid rows.
+    """
+    errors = writer.errors
+    for count, chunk in chunks:
+        values, isInt, bad = evaluateColumns(postfix, {name: columnValues(column) for name, column in chunk.items()},
+                                             count)
+        valid = ~bad
+        if writer.columnType == "int64":
+            with numpy.errstate(all = "ignore"):
+                fits = valid & (numpy.floor(values) == values) & (numpy.abs(values) < 2.0 ** 63)
+                data = numpy.where(fits, values, 0).astype(writer.npyType)
+            for _ in range(int(numpy.count_nonzero(valid & ~fits))):
+                print("Output Error: result does not fit in int64", file = stderr)
+            valid = fits
+        else:
+            data = numpy.where(valid, values, numpy.nan).astype(writer.npyType)
+        for index in numpy.flatnonzero(bad).tolist():
+            result = evaluateRow(postfix, chunk, index)
+            if isinstance(result, CalculationError):
+                print(result.message, file = stderr)
+                continue
+            value = writer.convert(result)
+            if value is None:
+                print("Output Error: result does not fit in " + writer.columnType, file = stderr)
+            else:
+                data[index] = value
+                valid[index] = True
+        writer.extend(data.tobytes(), valid.astype(numpy.uint8).tobytes())
+    return writer.errors - errors
+
+def runColumns(input, path, outputPath = None, chunkSize = chunkRows, columnType = None):
+    """
+    Applies a math expression to every row of a CSV file with a header row,
+    or of a directory of .npy column files, and writes the results through a
+    large buffer. The names in the expression are the column names.
+    Parameters: input - The math expression string, e.g. "(price - cost) / price".
+                path - The CSV file path, "-" to read CSV from standard input,
+                or a directory of name.npy files.
+                outputPath - The file to write the results to. Defaults to
+                standard output.
+                chunkSize - The number of rows evaluated at a time.
+                columnType - "float64" or "int64" to write the results as a
+                binary column, as binaryoutput.ColumnWriter does, instead of
+                text. outputPath is then required.
+    Returns: The number of rows that could not be evaluated, or False if the
+    expression or the file is invalid.
+    """
+    if numpy is None:
+        raise ImportError("runColumns requires NumPy")
+
+    postfix = compileFormula(input)
+    if not postfix:
+        return False
+    names = formulaNames(postfix)
+    if columnType is not None:
+        output = ColumnWriter(outputPath, columnType)
+    elif outputPath is None:
+        output = open(stdout.fileno(), "w", buffering = batchBufferSize, closefd = False)
+    else:
+        output = open(outputPath, "w", buffering = batchBufferSize)
+    lines = None
+    try:
+        if os.path.isdir(path):
+            chunks = npyChunks(path, names, chunkSize)
+        else:
+            lines = stdin if path == "-" else open(path, newline = "", buffering = batchBufferSize)
+            chunks = csvChunks(lines, names, chunkSize)
+        if columnType is not None:
+            return evaluateChunksBinary(postfix, chunks, output)
+        return evaluateChunks(postfix, chunks, output)
+    except CalculationError as error:
+        print(error.message, file = stderr)
+        return False
+    finally:
+        output.close()
+        if lines is not None and lines is not stdin:
+            lines.close()
+
+def main():
+    """
+    Applies the expression given as the first argument to every row of the
+    file given as the second, and prints one result per row. --output=PATH
+    writes the results to a file instead, and --chunk-rows=N sets how many
+    rows are evaluated at a time. --binary=float64|int64 with --output=PATH
+    writes the results as a binary column, with a validity bitmap in
+    PATH.valid.
+    """
+    options, arguments = parseOptions(argv[1:])
+    if (len(arguments) != 2 or not set(options) <= {"output", "chunk-rows", "binary"} or True in options.values()
+            or not options.get("chunk-rows", "1").isdigit() or options.get("chunk-rows") == "0"
+            or options.get("binary", "float64") not in columnTypes or ("binary" in options and "output" not in options)):
+        print("Invalid Input")
+        return
+    runColumns(arguments[0], arguments[1], options.get("output"), int(options.get("chunk-rows", chunkRows)),
+               options.get("binary"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#! /usr/bin/env python3.7
+
+# Named formulas that refer to each other's results, spreadsheet style.
+#
+# A FormulaGraph keeps the dependencies between formulas as a DAG. Values
+# are memoized; changing a formula only marks the formulas downstream of it
+# as dirty, and recompute evaluates just those, in topological order. Dirty
+# formulas whose dependencies are all up to date do not depend on each
+# other, so each such wave can be evaluated on a pool of workers.
+
+import re
+
+from calculate import CalculationError
+from calculate import evaluateWithBackend
+from calculate import functionNames
+from calculate import mathError
+from calculate import ops
+from calculate import parseToPostfix
+
+namePattern = re.compile(r"[^\W\d]\w*")
+
+# Formulas are sent to workers in chunks of this many.
+chunkFormulas = 256
+
+def evaluateBound(chunk, backend = None):
+    """
+    Evaluates postfix expressions whose names have been replaced by values.
+    Runs in the worker processes when recompute is given an executor.
+    Parameters: chunk - A list of postfix expressions.
+                backend - The NumericBackend to evaluate with.
+    Returns: A list with the result of each expression, or a CalculationError
+    for expressions that cannot be computed, e.g. that divide by zero.
+    """
+    results = []
+    for postfix in chunk:
+        try:
+            results.append(evaluateWithBackend(postfix, backend))
+        except ArithmeticError as error:
+            results.append(mathError(error))
+    return results
+
+class FormulaGraph:
+    """
+    A set of named formulas, e.g. "total" = "price * quantity", where
+    formulas may use the results of other formulas by name.
+    Formulas may refer to names that are not defined yet. Their value is
+    then an error until the name is defined.
+    """
+
+    def __init__(self, backend = None):
+        """
+        Parameters: backend - The NumericBackend to evaluate with. Defaults
+                    to ints and floats.
+        """
+        self.backend = backend
+        # The postfix expression of each formula.
+        self.formulas = {}
+        # The names each formula uses, and the formulas that use each name.
+        self.dependencies = {}
+        self.dependents = {}
+        # The memoized value of each up to date formula, or the
+        # CalculationError it raised.
+        self.values = {}
+        self.dirty = set()
+
+    def define(self, name, input):
+        """
+        Defines a formula, or changes an existing one.
+        Parameters: name - The formula's name, e.g. "total".
+                    input - The math expression, e.g. "price * quantity".
+        Raises CalculationError if the name or the expression is invalid, or
+        if the formula would depend on itself. The graph is then unchanged.
+        """
+        if not namePattern.fullmatch(name) or name in functionNames:
+            raise CalculationError("Invalid Input: invalid name " + name + ".")
+        postfix = parseToPostfix(input, True, self.backend)
+        names = {item for item in postfix if type(item) is str and item not in ops}
+        cycle = self.findPath(names, name)
+        if cycle is not None:
+            raise CalculationError("Invalid Input: circular reference " + " -> ".join([name] + cycle) + ".")
+        self.setFormula(name, postfix, names)
+
+    def setValue(self, name, value):
+        """
+        Defines a formula that is just a number, without parsing it.
+        Parameters: name - The formula's name.
+                    value - The number.
+        """
+        if not namePattern.fullmatch(name) or name in functionNames:
+            raise CalculationError("Invalid Input: invalid name " + name + ".")
+        self.setFormula(name, [value], set())
+
+    def remove(self, name):
+        """
+        Removes a formula. Formulas that use it become errors.
+        Parameters: name - The formula's name.
+        Raises KeyError if there is no such formula.
+        """
+        del self.formulas[name]
+        for dependency in self.dependencies.pop(name):
+            self.dependents[dependency].discard(name)
+        self.values.pop(name, None)
+        self.dirty.discard(name)
+        self.markDirty(self.dependents.get(name, ()))
+
+    def setFormula(self, name, postfix, names):
+        """
+        Stores a formula and its dependencies, and marks it and the formulas
+        downstream of it as dirty.
+        Parameters: name - The formula's name.
+                    postfix - Its postfix expression.
+                    names - The names it uses.
+        """
+        for dependency in self.dependencies.get(name, ()):
+            self.dependents[dependency].discard(name)
+        for dependency in names:
+            self.dependents.setdefault(dependency, set()).add(name)
+        self.formulas[name] = postfix
+        self.dependencies[name] = names
+        self.markDirty([name])
+
+    def markDirty(self, names):
+        """
+        Marks formulas and everything downstream of them as dirty.
+        Parameters: names - The names of the formulas that changed.
+        """
+        pending = [name for name in names if name not in self.dirty]
+        self.dirty.update(pending)
+        while pending:
+            for dependent in self.dependents.get(pending.pop(), ()):
+                if dependent not in self.dirty:
+                    self.dirty.add(dependent)
+                    pending.append(dependent)
+
+    def findPath(self, names, target):
+        """
+        Finds a chain of dependencies from some names to a formula.
+        Parameters: names - The names to start from.
+                    target - The name to look for.
+        Returns: The names along the chain, ending with target, or None if
+        target cannot be reached.
+        """
+        parents = {name: None for name in names}
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name == target:
+                path = []
+                while name is not None:
+                    path.append(name)
+                    name = parents[name]
+                return path[::-1]
+            for dependency in self.dependencies.get(name, ()):
+                if dependency not in parents:
+                    parents[dependency] = name
+                    pending.append(dependency)
+        return None
+
+    def waves(self):
+        """
+        Orders the dirty formulas topologically.
+        Returns: A list of waves, each a list of dirty formulas whose dirty
+        dependencies are all in earlier waves.
+        """
+        waiting = {}
+        wave = []
+        for name in self.dirty:
+            count = sum(1 for dependency in self.dependencies[name] if dependency in self.dirty)
+            if count:
+                waiting[name] = count
+            else:
+                wave.append(name)
+        waves = []
+        while wave:
+            waves.append(wave)
+            nextWave = []
+            for name in wave:
+                for dependent in self.dependents.get(name, ()):
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        nextWave.append(dependent)
+            wave = nextWave
+        return waves
+
+    def bind(self, name):
+        """
+        Replaces the names in a formula with the values of those formulas.
+        Parameters: name - The formula's name.
+        Returns: The postfix expression with only numbers and operators, or
+        the CalculationError of the first name whose value is an error.
+        """
+        values = self.values
+        postfix = []
+        for item in self.formulas[name]:
+            if type(item) is str and item not in ops:
+                if item not in values:
+                    return CalculationError("Invalid Input: unknown variable " + item + ".")
+                item = values[item]
+                if type(item) is CalculationError:
+                    return item
+            postfix.append(item)
+        return postfix
+
+    def recompute(self, executor = None):
+        """
+        Evaluates the dirty formulas, in topological order.
+        Parameters: executor - An optional concurrent.futures Executor, e.g.
+                    a ProcessPoolExecutor. Each wave of formulas is then split
+                    into chunks that are evaluated by the executor's workers.
+        Returns: The number of formulas evaluated.
+        """
+        count = 0
+        for wave in self.waves():
+            bound = []
+            for name in wave:
+                postfix = self.bind(name)
+                if type(postfix) is CalculationError:
+                    self.values[name] = postfix
+                else:
+                    bound.append((name, postfix))
+            if executor is not None and len(bound) > chunkFormulas:
+                chunks = [[postfix for name, postfix in bound[i:i + chunkFormulas]]
+                          for i in range(0, len(bound), chunkFormulas)]
+                results = []
+                for chunkResults in executor.map(evaluateBound, chunks, [self.backend] * len(chunks)):
+                    results += chunkResults
+            else:
+                results = evaluateBound([postfix for name, postfix in bound], self.backend)
+            for (name, postfix), result in zip(bound, results):
+                self.values[name] = result
+            count += len(wave)
+        self.dirty.clear()
+        return count
+
+    def value(self, name):
+        """
+        Get the value of a formula, recomputing dirty formulas first.
+        Parameters: name - The formula's name.
+        Returns: The value.
+        Raises KeyError if there is no such formula, and CalculationError if
+        it, or a formula it uses, cannot be evaluated.
+        """
+        if name not in self.formulas:
+            raise KeyError(name)
+        if self.dirty:
+            self.recompute()
+        value = self.values[name]
+        if type(value) is CalculationError:
+            raise value
+        return value
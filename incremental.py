@@ -0,0 +1,664 @@
+#! /usr/bin/env python3.7
+
+# Incremental evaluation of a math expression that is edited a little at a
+# time, e.g. by an interactive front end that sends every keystroke.
+#
+# A Session keeps the expression as a tree. Every node knows the width of
+# its text and caches its value, and chains of operators of the same
+# precedence ("1 + 2 - 3", "4 * 5 / 6") cache the result after each operand.
+# An edit only parses the smallest piece of the tree whose text contains it,
+# such as the number being typed, and only recomputes the nodes above that
+# piece, each from the changed operand onwards. Results are the same as
+# calculate's, including the order in which float operations are rounded,
+# so a long flat chain still has to be folded again from the edit to its end.
+# Trees only hold the operators of precedence 0 and 1 and unary minus.
+# Expressions with other operators or with function calls are evaluated in
+# full after every edit instead.
+
+from bisect import bisect_left
+import re
+
+import calculate as core
+from calculate import CALL
+from calculate import COMMA
+from calculate import CalculationError
+from calculate import FLOAT
+from calculate import ILLEGAL
+from calculate import INT
+from calculate import MALFORMED
+from calculate import NAME
+from calculate import NUMBER
+from calculate import OPERATOR
+from calculate import PAREN
+from calculate import backendContext
+from calculate import evaluateWithBackend
+from calculate import functionNames
+from calculate import mathError
+from calculate import ops
+from calculate import parseToPostfix
+from calculate import precedenceTable
+from calculate import tokenError
+
+# Node kinds, besides the NUMBER, OPERATOR and PAREN leaves.
+SUM = "sum"
+PRODUCT = "product"
+NEGATE = "negate"
+GROUP = "group"
+# The node above the whole expression.
+TOP = "top"
+
+# Grammar levels, from loosest to tightest. A node can stand where its own
+# level or a looser one is needed.
+EXPRESSION = 0
+TERM = 1
+FACTOR = 2
+PRIMARY = 3
+
+# The level of each kind of node.
+levels = {
+    SUM: EXPRESSION,
+    PRODUCT: TERM,
+    NEGATE: FACTOR,
+    GROUP: PRIMARY,
+    NUMBER: PRIMARY,
+}
+
+# The level needed by the operands of each kind of node.
+operandLevels = {
+    TOP: EXPRESSION,
+    GROUP: EXPRESSION,
+    SUM: TERM,
+    PRODUCT: FACTOR,
+    NEGATE: PRIMARY,
+}
+
+# The level a run of a chain's operands is parsed at, so that it can be
+# spliced back into the chain.
+chainLevels = {
+    SUM: EXPRESSION,
+    PRODUCT: TERM,
+}
+
+parenPattern = re.compile(r"[()]")
+
+class Unsupported(Exception):
+    """
+    Raised by parseTree for expressions that trees cannot hold, which Session
+    evaluates in full instead.
+    """
+
+class Leaf:
+    """
+    A token in the tree.
+    Attributes: kind - NUMBER, OPERATOR or PAREN.
+                text - The token.
+                space - The number of spaces before the token.
+                value - The converted number, for NUMBER leaves.
+    """
+
+    __slots__ = ("kind", "text", "space", "value")
+
+    def __init__(self, kind, text, space, value = None):
+        self.kind = kind
+        self.text = text
+        self.space = space
+        self.value = value
+
+    def width(self):
+        """
+        Get the length of the leaf's text, including the spaces before it.
+        Returns: The width.
+        """
+        return self.space + len(self.text)
+
+class Node:
+    """
+    An operation in the tree.
+    Attributes: kind - SUM, PRODUCT, NEGATE, GROUP or TOP.
+                children - The operands and tokens, in the order of the text.
+                Chains alternate operands and operator leaves.
+                ends - Where each child's text ends, relative to the start
+                of the node.
+                value - The cached value, or None if it must be recomputed.
+                values - For chains, the result after each operand, as far
+                as they are known.
+    """
+
+    __slots__ = ("kind", "children", "ends", "value", "values")
+
+    def __init__(self, kind, children):
+        self.kind = kind
+        self.children = children
+        self.ends = []
+        total = 0
+        for child in children:
+            total += child.width()
+            self.ends.append(total)
+        self.value = None
+        self.values = []
+
+    def width(self):
+        """
+        Get the length of the node's text, including the spaces before it.
+        Returns: The width.
+        """
+        return self.ends[-1]
+
+def chain(kind, items):
+    """
+    Makes a chain node, unless there is only one operand.
+    Parameters: kind - SUM or PRODUCT.
+                items - The operands and operator leaves.
+    Returns: The node, or the only operand.
+    """
+    if len(items) == 1:
+        return items[0]
+    return Node(kind, items)
+
+def parseTree(input, makeInt = int, makeFloat = float):
+    """
+    Parses a math expression, or a piece of one, into a tree. Accepts and
+    rejects the same expressions as parseToPostfix, without recursing.
+    Parameters: input - The math expression string.
+                makeInt, makeFloat - Convert numbers without and with a
+                decimal point.
+    Returns: A tuple of the tree and the number of spaces after it.
+    Raises CalculationError if the expression is invalid. Errors at the end
+    of the input have the length of the input as their position.
+    Raises Unsupported if the expression has an operator that trees cannot
+    hold, or a function call.
+    """
+    # The sums and products being built in each unclosed group, with the
+    # group's paren and the unary minus before it.
+    groups = []
+    sumItems = []
+    productItems = []
+    unary = None
+    expectOperand = True
+    end = 0
+    # The pattern is rebuilt when operators are registered.
+    for token in core.tokenPattern.finditer(input):
+        kind = token.lastgroup
+        text = token.group()
+        space = token.start() - end
+        end = token.end()
+        if kind == CALL or kind == COMMA or text in functionNames:
+            raise Unsupported("function calls")
+        if expectOperand:
+            if kind == INT:
+                operand = Leaf(NUMBER, text, space, makeInt(text))
+            elif kind == FLOAT:
+                operand = Leaf(NUMBER, text, space, makeFloat(text))
+            elif kind == PAREN and text == "(":
+                groups.append((sumItems, productItems, unary, Leaf(PAREN, text, space)))
+                sumItems = []
+                productItems = []
+                unary = None
+                continue
+            elif kind == OPERATOR and text == "-" and unary is None:
+                unary = Leaf(OPERATOR, text, space)
+                continue
+            elif kind == OPERATOR or kind == PAREN:
+                raise CalculationError("Syntax Error", token.start())
+            else:
+                raise tokenError(token)
+            if unary is not None:
+                operand = Node(NEGATE, [unary, operand])
+                unary = None
+            productItems.append(operand)
+            expectOperand = False
+        elif kind == OPERATOR and text != "~":
+            if precedenceTable[text] not in (0, 1) or text == "^":
+                raise Unsupported("operator " + text)
+            if precedenceTable[text] == 1:
+                productItems.append(Leaf(OPERATOR, text, space))
+            else:
+                sumItems.append(chain(PRODUCT, productItems))
+                sumItems.append(Leaf(OPERATOR, text, space))
+                productItems = []
+            expectOperand = True
+        elif kind == PAREN and text == ")" and groups:
+            sumItems.append(chain(PRODUCT, productItems))
+            inner = chain(SUM, sumItems)
+            sumItems, productItems, unary, paren = groups.pop()
+            operand = Node(GROUP, [paren, inner, Leaf(PAREN, text, space)])
+            if unary is not None:
+                operand = Node(NEGATE, [unary, operand])
+                unary = None
+            productItems.append(operand)
+        elif kind == MALFORMED or kind == ILLEGAL or kind == NAME:
+            raise tokenError(token)
+        else:
+            raise CalculationError("Syntax Error", token.start())
+
+    if expectOperand or groups:
+        raise CalculationError("Syntax Error", len(input))
+    sumItems.append(chain(PRODUCT, productItems))
+    return chain(SUM, sumItems), len(input) - end
+
+def evaluateTree(root, table = ops):
+    """
+    Computes the values in a tree that are not cached, without recursing.
+    Parameters: root - The tree.
+                table - The operator table.
+    Returns: A tuple of the value of the tree and the number of operations
+    that were computed.
+    Raises ArithmeticError, e.g. ZeroDivisionError if the expression divides
+    by zero. The values computed before it are kept.
+    """
+    operations = 0
+    stack = [root]
+    while stack:
+        node = stack[-1]
+        if node.value is not None:
+            stack.pop()
+            continue
+        children = node.children
+        if node.kind is SUM or node.kind is PRODUCT:
+            values = node.values
+            index = len(values)
+            count = len(children) // 2 + 1
+            while index < count:
+                operand = children[2 * index]
+                if operand.value is None:
+                    break
+                if index == 0:
+                    values.append(operand.value)
+                else:
+                    values.append(table[children[2 * index - 1].text](values[-1], operand.value))
+                    operations += 1
+                index += 1
+            if index < count:
+                stack.append(operand)
+                continue
+            node.value = values[-1]
+        else:
+            operand = children[1]
+            if operand.value is None:
+                stack.append(operand)
+                continue
+            if node.kind is NEGATE:
+                node.value = table["~"](operand.value)
+                operations += 1
+            else:
+                node.value = operand.value
+    return root.value, operations
+
+def invalidate(node, index):
+    """
+    Forgets the cached values of a node that depend on one of its children.
+    Parameters: node - The node.
+                index - The index of the child that changed.
+    """
+    node.value = None
+    if node.kind is SUM or node.kind is PRODUCT:
+        del node.values[index // 2:]
+
+def firstLeaf(node):
+    """
+    Get the first token of a tree.
+    Parameters: node - The tree, or a leaf.
+    Returns: The first leaf.
+    """
+    while type(node) is Node:
+        node = node.children[0]
+    return node
+
+def isBalanced(input):
+    """
+    Checks that parentheses in a piece of an expression match each other.
+    Parameters: input - The piece of the expression.
+    Returns: True if no paren closes a group opened before the piece and
+    every group opened in the piece is closed in it.
+    """
+    depth = 0
+    for paren in parenPattern.finditer(input):
+        depth += 1 if paren.group() == "(" else -1
+        if depth < 0:
+            return False
+    return depth == 0
+
+def changedSpan(old, new):
+    """
+    Finds the part of a string that changed.
+    Parameters: old - The string before the change.
+                new - The string after the change.
+    Returns: A tuple of the offset and length of the changed part of old, and
+    the string that replaced it.
+    """
+    # Binary searches over slices, so that the characters are compared in C.
+    limit = min(len(old), len(new))
+    low = 0
+    high = limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[:middle] == new[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    prefix = low
+    low = 0
+    high = limit - prefix
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[len(old) - middle:] == new[len(new) - middle:]:
+            low = middle
+        else:
+            high = middle - 1
+    suffix = low
+    return prefix, len(old) - prefix - suffix, new[prefix:len(new) - suffix]
+
+class Session:
+    """
+    An expression that is edited and evaluated repeatedly.
+    Attributes: text - The current expression.
+                reparsed - The number of characters the last edit parsed.
+                operations - The number of operations the last call to
+                result computed.
+    """
+
+    def __init__(self, text = "", backend = None):
+        """
+        Parameters: text - The initial expression.
+                    backend - The NumericBackend to evaluate with. Defaults
+                    to ints and floats.
+        """
+        self.text = text
+        self.backend = backend
+        self.makeInt = int if backend is None else backend.makeInt
+        self.makeFloat = float if backend is None else backend.makeFloat
+        self.table = ops if backend is None else backend.ops
+        # The tree of the last valid text, under a TOP node. None while the
+        # text is invalid or cannot be held in a tree.
+        self.top = None
+        # The spaces after the expression, which are not part of the tree.
+        self.trailing = 0
+        # While the tree is out of date, the part of its text that has
+        # changed: (start, end, end of the replacement in the current text).
+        self.pending = None
+        self.error = None
+        self.reparsed = 0
+        self.operations = 0
+        self.parseAll()
+
+    def edit(self, offset, length, replacement):
+        """
+        Replaces part of the expression.
+        Parameters: offset - Where the replaced part starts.
+                    length - The length of the replaced part, or 0 to insert.
+                    replacement - The new text.
+        Raises ValueError if the replaced part is not inside the text.
+        Invalid expressions do not raise here; result raises their error.
+        """
+        if offset < 0 or length < 0 or offset + length > len(self.text):
+            raise ValueError("edit outside the text")
+        self.text = self.text[:offset] + replacement + self.text[offset + length:]
+        self.reparsed = 0
+        if self.pending is None:
+            self.pending = (offset, offset + length, offset + len(replacement))
+        else:
+            # Merge the edit with the changes the tree has not seen yet.
+            start, end, newEnd = self.pending
+            editEnd = max(newEnd, offset + length)
+            self.pending = (min(start, offset), end + editEnd - newEnd,
+                            editEnd + len(replacement) - length)
+        if self.top is None or not self.text:
+            self.parseAll()
+        else:
+            self.update()
+
+    def replace(self, text):
+        """
+        Replaces the whole expression, e.g. with the text a front end sent.
+        Only the part that differs from the current expression is parsed.
+        Parameters: text - The new expression.
+        """
+        offset, length, replacement = changedSpan(self.text, text)
+        if length or replacement:
+            self.edit(offset, length, replacement)
+        else:
+            self.reparsed = 0
+
+    def result(self):
+        """
+        Evaluates the expression, computing only what the edits changed.
+        Returns: The result of the calculation.
+        Raises CalculationError if the expression is invalid or divides by
+        zero, the same error calculate raises.
+        """
+        if self.error is not None:
+            raise self.error
+        if self.top is None:
+            postfix = parseToPostfix(self.text, False, self.backend)
+            self.operations = sum(1 for item in postfix if type(item) is str)
+            try:
+                return evaluateWithBackend(postfix, self.backend)
+            except ArithmeticError as error:
+                raise mathError(error)
+        with backendContext(self.backend):
+            try:
+                value, self.operations = evaluateTree(self.top.children[0], self.table)
+            except ArithmeticError as error:
+                raise mathError(error)
+        return value
+
+    def parseAll(self):
+        """
+        Parses the whole expression again.
+        """
+        self.reparsed += len(self.text)
+        if not self.text:
+            self.error = CalculationError("Invalid Input: empty.", 0)
+            return
+        self.top = None
+        self.pending = None
+        try:
+            root, self.trailing = parseTree(self.text, self.makeInt, self.makeFloat)
+        except CalculationError as error:
+            self.error = error
+            return
+        except Unsupported:
+            # result parses and evaluates the whole text instead.
+            self.error = None
+            return
+        self.top = Node(TOP, [root])
+        self.pending = None
+        self.error = None
+
+    def update(self):
+        """
+        Brings the tree up to date with the pending change, parsing as little
+        of the text as possible.
+        """
+        start, end = self.pending[:2]
+        # Find the deepest operand whose text contains the change. Changes
+        # that touch an operand's first or last character may extend it, so
+        # they count as inside it, and the spaces at the end of the text
+        # count as part of the last operand.
+        path = []
+        node = self.top
+        nodeStart = 0
+        extra = self.trailing
+        leaf = None
+        while True:
+            index = self.childAt(node, start - nodeStart, end - nodeStart, extra)
+            if index is None:
+                break
+            path.append((node, index, nodeStart))
+            child = node.children[index]
+            if index < len(node.children) - 1:
+                extra = 0
+            if type(child) is Leaf:
+                leaf = child
+                break
+            nodeStart += node.ends[index - 1] if index else 0
+            node = child
+
+        # Parse the smallest piece that may contain the change, then larger
+        # ones if it does not fit where the piece was.
+        depth = len(path)
+        if leaf is not None:
+            depth -= 1
+            parent, index, parentStart = path[depth]
+            if self.reparse(parent, index, index, operandLevels[parent.kind], parentStart, path, depth):
+                return
+        while depth > 0:
+            parent, index, parentStart = path[depth - 1]
+            if node.kind is SUM or node.kind is PRODUCT:
+                nodeStart = parentStart + (parent.ends[index - 1] if index else 0)
+                first, last = self.operandSpan(node, start - nodeStart, end - nodeStart)
+                if last - first < len(node.children) // 2:
+                    if self.reparse(node, 2 * first, 2 * last, chainLevels[node.kind], nodeStart, path, depth):
+                        return
+            depth -= 1
+            # Chains try a run of operands containing the node instead.
+            if parent.kind is GROUP or parent.kind is NEGATE:
+                if self.reparse(parent, index, index, operandLevels[parent.kind], parentStart, path, depth):
+                    return
+            node = parent
+        self.parseAll()
+
+    def childAt(self, node, start, end, extra):
+        """
+        Finds the operand of a node whose text contains a change.
+        Parameters: node - The node.
+                    start, end - The changed part, relative to the node.
+                    extra - Spaces after the node that belong to its last
+                    child.
+        Returns: The index of the operand, or None if no single operand
+        contains the change.
+        """
+        ends = node.ends
+        last = len(ends) - 1
+        index = min(bisect_left(ends, start), last)
+        for index in (index, index + 1):
+            if index > last:
+                break
+            childStart = ends[index - 1] if index else 0
+            childEnd = ends[index] + (extra if index == last else 0)
+            if childStart <= start and end <= childEnd and node.children[index].kind not in (OPERATOR, PAREN):
+                return index
+        return None
+
+    def operandSpan(self, node, start, end):
+        """
+        Finds the run of a chain's operands whose text contains a change.
+        Parameters: node - The chain.
+                    start, end - The changed part, relative to the node.
+        Returns: A tuple of the indexes of the first and last operand.
+        """
+        ends = node.ends
+        last = len(ends) - 1
+        index = min(bisect_left(ends, start), last)
+        # A change inside an operator needs the operands on both sides.
+        if index % 2 == 0:
+            first = index // 2
+        elif ends[index] == start:
+            first = (index + 1) // 2
+        else:
+            first = index // 2
+        index = min(bisect_left(ends, end), last)
+        return first, (index + 1) // 2
+
+    def nextLeaf(self, node, index, path, depth):
+        """
+        Get the token after a child of a node.
+        Parameters: node - The node.
+                    index - The index of the child.
+                    path - The nodes above node, as (node, index, start).
+                    depth - How many entries of path are above node.
+        Returns: The next leaf, or None if the child ends the expression.
+        """
+        if index + 1 < len(node.children):
+            return firstLeaf(node.children[index + 1])
+        for ancestor, ancestorIndex, _ in reversed(path[:depth]):
+            if ancestorIndex + 1 < len(ancestor.children):
+                return firstLeaf(ancestor.children[ancestorIndex + 1])
+        return None
+
+    def reparse(self, node, first, last, level, nodeStart, path, depth):
+        """
+        Parses the current text of some of a node's children again, and puts
+        the result in their place.
+        Parameters: node - The node.
+                    first, last - The indexes of the first and last child.
+                    level - The grammar level the text must have. Chains
+                    take in the operands of a run of the same kind.
+                    nodeStart - Where the node starts in the tree's text.
+                    path - The nodes above node, as (node, index, start).
+                    depth - How many entries of path are above node.
+        Returns: True if the tree is up to date, or if the text is invalid
+        whatever surrounds the piece, in which case the error is recorded.
+        False if a larger piece must be parsed instead.
+        """
+        start, end, newEnd = self.pending
+        shift = newEnd - end
+        following = self.nextLeaf(node, last, path, depth)
+        pieceStart = nodeStart + (node.ends[first - 1] if first else 0)
+        pieceEnd = nodeStart + node.ends[last]
+        if following is None:
+            pieceEnd += self.trailing
+        piece = self.text[pieceStart:pieceEnd + shift]
+        self.reparsed += len(piece)
+        try:
+            tree, trailing = parseTree(piece, self.makeInt, self.makeFloat)
+        except Unsupported:
+            return False
+        except CalculationError as error:
+            # A piece that is a whole expression, or a run of a sum's
+            # operands, makes the whole text invalid if it is invalid, unless
+            # it contains unmatched parens or ends before a "-" that could
+            # become a unary minus.
+            if level != EXPRESSION or not isBalanced(piece):
+                return False
+            if error.position < len(piece):
+                position = pieceStart + error.position
+            elif following is None:
+                position = len(self.text)
+            elif following.text == "-":
+                return False
+            else:
+                position = pieceEnd + shift + following.space
+            self.error = CalculationError(error.message, position)
+            return True
+        if levels[tree.kind] < level:
+            return False
+
+        spaces = 0
+        if following is None:
+            self.trailing = trailing
+        elif trailing:
+            # Spaces after the piece belong to the next token.
+            if last + 1 == len(node.children):
+                return False
+            spaces = trailing
+            node.children[last + 1].space += spaces
+        oldWidth = node.width()
+        if tree.kind is node.kind and (node.kind is SUM or node.kind is PRODUCT):
+            children = tree.children
+        else:
+            children = [tree]
+        ends = node.ends
+        total = ends[first - 1] if first else 0
+        newEnds = []
+        for child in children:
+            total += child.width()
+            newEnds.append(total)
+        delta = total - ends[last] + spaces
+        node.children[first:last + 1] = children
+        ends[first:last + 1] = newEnds
+        if delta:
+            for index in range(first + len(children), len(ends)):
+                ends[index] += delta
+        invalidate(node, first)
+
+        delta = node.width() - oldWidth
+        for ancestor, childIndex, _ in reversed(path[:depth]):
+            if delta:
+                ends = ancestor.ends
+                for index in range(childIndex, len(ends)):
+                    ends[index] += delta
+            invalidate(ancestor, childIndex)
+        self.pending = None
+        self.error = None
+        return True
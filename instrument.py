@@ -0,0 +1,312 @@
+#! /usr/bin/env python3.7
+
+# Opt-in timing and tracing for the stages of the calculate.py pipeline.
+#
+# enable() replaces the stage functions in the calculate module with timed
+# wrappers, and disable() puts the originals back. Calls inside the module
+# look the functions up by name, so they are timed too. Modules that import a
+# stage with "from calculate import ...", such as optimize, have their own
+# name for it, which is replaced as well. While instrumentation is disabled
+# nothing is wrapped and nothing is slower.
+# Stages can run inside each other: evaluateWithBackend calls evaluatePostfix
+# for ints and floats, so both are timed.
+
+import json
+from math import frexp
+from sys import modules
+from time import perf_counter
+
+import calculate
+
+# The pipeline functions that are timed: those calculate.py runs, and the
+# separate passes that can be called from Python.
+stages = [
+    "parseToPostfix",
+    "evaluateWithBackend",
+    "evaluateFile",
+    "parse",
+    "validateSyntax",
+    "checkBalancedParens",
+    "convertToPostfix",
+    "evaluatePostfix",
+    "compilePostfix",
+]
+
+# The stages whose first argument is a postfix expression to evaluate.
+evaluateStages = ("evaluatePostfix", "evaluateWithBackend")
+
+# Histogram buckets are powers of two of microseconds: bucket 0 holds times
+# under 1 microsecond, bucket i holds times from 2^(i-1) up to 2^i
+# microseconds, and the last bucket holds everything slower.
+bucketCount = 32
+
+class Histogram:
+    """
+    A latency histogram with power-of-two buckets.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * bucketCount
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """
+        Records one latency.
+        Parameters: seconds - The latency in seconds.
+        """
+        microseconds = seconds * 1e6
+        bucket = 0 if microseconds < 1 else min(frexp(microseconds)[1], bucketCount - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        Estimates a percentile from the buckets.
+        Parameters: fraction - The percentile as a fraction, e.g. 0.99.
+        Returns: The upper bound of the bucket holding the percentile, in
+        seconds, or 0 if nothing was recorded.
+        """
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min((1 << bucket) / 1e6, self.max)
+        return 0.0
+
+    def merge(self, exported):
+        """
+        Adds the counts from another histogram, e.g. from another process.
+        Parameters: exported - The other histogram, as returned by export.
+        """
+        for bucket, count in enumerate(exported["buckets"]):
+            self.buckets[bucket] += count
+        self.count += exported["count"]
+        self.total += exported["total"]
+        self.max = max(self.max, exported["max"])
+
+    def export(self):
+        """
+        Get the histogram as plain data, e.g. to serialize as JSON.
+        Returns: A dictionary.
+        """
+        return {"buckets": list(self.buckets), "count": self.count, "total": self.total, "max": self.max}
+
+class Instrumentation:
+    """
+    Collects per-stage latency histograms and counters, and calls hooks after
+    every stage. Only the stages that have run have histograms.
+    Counters: tokens - Items produced by parse and parseToPostfix.
+              operators - Operators in the postfix expressions produced.
+              maxStackDepth - The deepest evaluation stack needed by an
+              expression passed to evaluatePostfix or evaluateWithBackend.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {"tokens": 0, "operators": 0, "maxStackDepth": 0}
+        self.hooks = []
+
+    def addHook(self, hook):
+        """
+        Adds a function to call after every stage.
+        Parameters: hook - Called as hook(stage, seconds, args, result), where
+                    args are the stage's arguments and result its return
+                    value, or None if it raised.
+        """
+        self.hooks.append(hook)
+
+    def record(self, stage, seconds, args, result):
+        """
+        Records one call of a stage.
+        Parameters: stage - The stage name.
+                    seconds - How long the call took.
+                    args - The arguments it was called with.
+                    result - What it returned, or None if it raised.
+        """
+        self.histogram(stage).add(seconds)
+        if result is not None and result is not False:
+            if stage in ("parse", "parseToPostfix"):
+                self.counters["tokens"] += len(result)
+            if stage in ("convertToPostfix", "parseToPostfix"):
+                self.counters["operators"] += sum(1 for item in result if item in calculate.ops)
+            if stage in evaluateStages:
+                depth = stackDepth(args[0])
+                if depth > self.counters["maxStackDepth"]:
+                    self.counters["maxStackDepth"] = depth
+        for hook in self.hooks:
+            hook(stage, seconds, args, result)
+
+    def histogram(self, stage):
+        """
+        Get the histogram of a stage, adding it if the stage has not run yet.
+        Parameters: stage - The stage name.
+        Returns: The Histogram.
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        return histogram
+
+    def stageHistograms(self):
+        """
+        Get the histograms of the stages that have run, in pipeline order.
+        Returns: A list of (stage, Histogram) tuples.
+        """
+        return [(stage, self.histograms[stage]) for stage in stages if stage in self.histograms]
+
+    def export(self):
+        """
+        Get the statistics as plain data, e.g. to serialize as JSON and
+        aggregate with merge in another process.
+        Returns: A dictionary.
+        """
+        return {
+            "stages": {stage: histogram.export() for stage, histogram in self.stageHistograms()},
+            "counters": dict(self.counters),
+        }
+
+    def merge(self, exported):
+        """
+        Adds statistics exported by another Instrumentation.
+        Parameters: exported - The other statistics, as returned by export.
+        """
+        for stage, histogram in exported["stages"].items():
+            self.histogram(stage).merge(histogram)
+        self.counters["tokens"] += exported["counters"]["tokens"]
+        self.counters["operators"] += exported["counters"]["operators"]
+        self.counters["maxStackDepth"] = max(self.counters["maxStackDepth"],
+                                             exported["counters"]["maxStackDepth"])
+
+    def report(self):
+        """
+        Formats the statistics as a table.
+        Returns: The report, as a string.
+        """
+        lines = ["%-20s %8s %10s %10s %10s %10s" % ("stage", "calls", "mean us", "p50 us", "p99 us", "max us")]
+        for stage, histogram in self.stageHistograms():
+            lines.append("%-20s %8d %10.1f %10.1f %10.1f %10.1f" % (
+                stage, histogram.count, histogram.total / histogram.count * 1e6,
+                histogram.percentile(0.5) * 1e6, histogram.percentile(0.99) * 1e6,
+                histogram.max * 1e6))
+        for name, value in self.counters.items():
+            lines.append("%s: %d" % (name, value))
+        return "\n".join(lines)
+
+def stackDepth(postfix):
+    """
+    Get the deepest evaluation stack a postfix expression needs.
+    Parameters: postfix - The postfix expression, as a list or a
+                CompactProgram.
+    Returns: The maximum number of values on the stack at once.
+    """
+    depth = 0
+    deepest = 0
+    if type(postfix) is calculate.CompactProgram:
+        for op in postfix.code:
+            if op <= calculate.OP_BIGINT:
+                depth += 1
+                if depth > deepest:
+                    deepest = depth
+            else:
+                depth -= calculate.opArities[op] - 1
+        return deepest
+    for item in postfix:
+        if item not in calculate.ops:
+            depth += 1
+            if depth > deepest:
+                deepest = depth
+        else:
+            depth -= calculate.arities[item] - 1
+    return deepest
+
+def timed(stage, function, instrumentation):
+    """
+    Wraps a stage function so its calls are recorded.
+    Parameters: stage - The stage name.
+                function - The stage function.
+                instrumentation - The Instrumentation to record calls in.
+    Returns: The wrapper function.
+    """
+    def wrapper(*args, **kwargs):
+        result = None
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+            return result
+        finally:
+            instrumentation.record(stage, perf_counter() - start, args, result)
+    wrapper.__wrapped__ = function
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+# The Instrumentation in use, and the original and the timed stage functions.
+active = None
+originals = {}
+wrappers = {}
+
+def replaceStages(replacements):
+    """
+    Replaces stage functions in every loaded module that has them, whether
+    the module defines them or imported them by name.
+    Parameters: replacements - A dictionary mapping each stage name to a
+                tuple of the function to replace and its replacement.
+    """
+    for module in list(modules.values()):
+        names = getattr(module, "__dict__", None)
+        if type(names) is not dict:
+            continue
+        for stage, (function, replacement) in replacements.items():
+            if names.get(stage) is function:
+                names[stage] = replacement
+
+def enable(instrumentation = None, module = calculate):
+    """
+    Starts timing the pipeline stages.
+    Parameters: instrumentation - The Instrumentation to record in. Defaults
+                to a new one.
+                module - The module whose stages to time. Defaults to
+                calculate.
+    Returns: The Instrumentation in use.
+    """
+    global active
+    disable()
+    active = instrumentation or Instrumentation()
+    for stage in stages:
+        originals[stage] = getattr(module, stage)
+        wrappers[stage] = timed(stage, originals[stage], active)
+    replaceStages({stage: (originals[stage], wrappers[stage]) for stage in stages})
+    return active
+
+def disable():
+    """
+    Stops timing the pipeline stages and restores the original functions,
+    also in modules that imported the timed ones while timing was on.
+    Returns: The Instrumentation that was in use, or None.
+    """
+    global active
+    replaceStages({stage: (wrappers[stage], originals[stage]) for stage in wrappers})
+    originals.clear()
+    wrappers.clear()
+    instrumentation = active
+    active = None
+    return instrumentation
+
+def dump(instrumentation, format, file):
+    """
+    Writes statistics for --stats.
+    Parameters: instrumentation - The Instrumentation.
+                format - "json" for the exported data, anything else for the
+                report table.
+                file - The stream to write to.
+    """
+    if format == "json":
+        json.dump(instrumentation.export(), file)
+        file.write("\n")
+    else:
+        file.write(instrumentation.report() + "\n")
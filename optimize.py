@@ -0,0 +1,371 @@
+#! /usr/bin/env python3.7
+
+# An optional optimization stage between convertToPostfix and evaluation.
+# It turns a postfix expression into a graph of operations in which
+# constant subexpressions are folded, chains of unary minus are collapsed and
+# identical subexpressions are only computed once.
+#
+# Batches of expressions can also share one graph, so a subexpression that
+# appears in many expressions of the batch is only computed once for all of
+# them.
+
+from itertools import islice
+from sys import stderr
+from sys import stdin
+from sys import stdout
+
+from calculate import CalculationError
+from calculate import arities
+from calculate import backendContext
+from calculate import batchBufferSize
+from calculate import errorMarker
+from calculate import formatResult
+from calculate import isNameStart
+from calculate import mathError
+from calculate import openLines
+from calculate import ops
+from calculate import parseToPostfix
+
+# Node kinds other than the operators in ops.
+NUMBER = "number"
+NAME = "name"
+
+class OptimizedProgram:
+    """
+    An optimized expression, as a list of nodes in evaluation order. Each node
+    is a tuple: (NUMBER, value), (NAME, name), or an operator or function
+    followed by the indexes of the earlier nodes that are its operands, e.g.
+    ("~", operand) or ("+", left, right). The last node is the result.
+    Attributes: nodes - The nodes.
+                originalOperations - The number of operators in the postfix
+                expression the program was made from.
+                foldedOperations - How many operators were replaced by their
+                constant result.
+    """
+
+    def __init__(self, nodes, originalOperations, foldedOperations):
+        self.nodes = nodes
+        self.originalOperations = originalOperations
+        self.foldedOperations = foldedOperations
+
+    def operations(self):
+        """
+        Get the number of operations the program performs.
+        Returns: The number of operator nodes.
+        """
+        return sum(1 for node in self.nodes if node[0] in ops)
+
+    def removedOperations(self):
+        """
+        Get the number of operations removed by optimizing.
+        Returns: The number of operators in the original postfix expression
+        minus the number of operations the program performs.
+        """
+        return self.originalOperations - self.operations()
+
+def nodeKey(node):
+    """
+    Get the key used to find identical nodes.
+    Parameters: node - The node.
+    Returns: A hashable key. Numbers of different types, such as 1 and 1.0, or
+    0.0 and -0.0, have different keys.
+    """
+    if node[0] == NUMBER:
+        return (NUMBER, type(node[1]), repr(node[1]))
+    return node
+
+def optimizePostfix(postfix):
+    """
+    Optimizes a postfix expression.
+    Constant subexpressions are computed once, here, with the same ops as
+    evaluatePostfix, so results keep the same int or float types. Operations
+    that raise ArithmeticError, such as division by zero, are not folded, so
+    they still raise when the program is evaluated.
+    "-(-(-x))" becomes "-x", but "-(-x)" stays as it is, since it is 0.0
+    where x is -0.0. Identical subexpressions become one shared node.
+    Parameters: postfix - The postfix expression. Numbers may be strings or
+                already converted, and names are allowed.
+    Returns: An OptimizedProgram, or False if the postfix expression is
+    invalid.
+    """
+    nodes = []
+    index = {}
+    stack = []
+    originalOperations = 0
+    foldedOperations = 0
+
+    def addNode(node):
+        key = nodeKey(node)
+        if key not in index:
+            index[key] = len(nodes)
+            nodes.append(node)
+        return index[key]
+
+    for item in postfix:
+        if item not in ops:
+            if type(item) is not str:
+                stack.append(addNode((NUMBER, item)))
+            elif isNameStart(item[0]):
+                stack.append(addNode((NAME, item)))
+            else:
+                stack.append(addNode((NUMBER, float(item) if "." in item else int(item))))
+            continue
+
+        originalOperations += 1
+        if len(stack) < arities[item]:
+            print("Syntax Error", file = stderr)
+            return False
+        operands = tuple(stack[-arities[item]:])
+        del stack[-arities[item]:]
+
+        if item == "~" and nodes[operands[0]][0] == "~" and nodes[nodes[operands[0]][1]][0] == "~":
+            # 0 - (0 - x) is x, except that it is 0.0 where x is -0.0. A
+            # result of unary minus is never -0.0, so x can be a negation.
+            stack.append(nodes[operands[0]][1])
+        elif all(nodes[operand][0] == NUMBER for operand in operands):
+            try:
+                value = ops[item](*(nodes[operand][1] for operand in operands))
+            except ArithmeticError:
+                stack.append(addNode((item,) + operands))
+            else:
+                foldedOperations += 1
+                stack.append(addNode((NUMBER, value)))
+        else:
+            stack.append(addNode((item,) + operands))
+
+    if len(stack) != 1:
+        print("Syntax Error", file = stderr)
+        return False
+    return OptimizedProgram(reachableNodes(nodes, stack[0]), originalOperations, foldedOperations)
+
+def reachableNodes(nodes, root):
+    """
+    Removes the nodes that the result does not depend on, such as the
+    operands of folded operations.
+    Parameters: nodes - The nodes, in evaluation order.
+                root - The index of the result node.
+    Returns: The nodes the result depends on, in evaluation order, with the
+    result last and child indexes renumbered.
+    """
+    used = [False] * len(nodes)
+    used[root] = True
+    for i in range(root, -1, -1):
+        if used[i] and nodes[i][0] in ops:
+            for child in nodes[i][1:]:
+                used[child] = True
+
+    newIndex = {}
+    result = []
+    for i in range(root + 1):
+        if used[i]:
+            node = nodes[i]
+            if node[0] in ops:
+                node = (node[0],) + tuple(newIndex[child] for child in node[1:])
+            newIndex[i] = len(result)
+            result.append(node)
+    return result
+
+def evaluateOptimized(program, variables = None):
+    """
+    Evaluates an optimized program.
+    Parameters: program - An OptimizedProgram.
+                variables - A dictionary mapping names to values, if the
+                program uses names.
+    Returns: The result of the calculation, or False if a name is not bound.
+    Raises ArithmeticError, e.g. ZeroDivisionError if the program divides by
+    zero.
+    """
+    values = []
+    for node in program.nodes:
+        kind = node[0]
+        if kind == NUMBER:
+            values.append(node[1])
+        elif kind == NAME:
+            if variables is None or node[1] not in variables:
+                print("Invalid Input: unknown variable " + node[1] + ".", file = stderr)
+                return False
+            values.append(variables[node[1]])
+        elif len(node) == 2:
+            values.append(ops[kind](values[node[1]]))
+        else:
+            values.append(ops[kind](values[node[1]], values[node[2]]))
+    return values[-1]
+
+# Batch mode reads and interns this many lines at a time, so memory use does
+# not depend on the size of the input.
+chunkLines = 1 << 16
+
+class BatchProgram:
+    """
+    The expressions of a batch as one graph of operations, in which every
+    distinct subexpression of every expression is a single node. Nodes are
+    as in an OptimizedProgram, but nothing is folded, so computing each node
+    once gives exactly the results of evaluating each expression on its own.
+    Attributes: nodes - The nodes, in evaluation order.
+                roots - For each expression, the index of its result node, or
+                the CalculationError raised when parsing it.
+                originalOperations - The number of operators in all of the
+                expressions.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.index = {}
+        self.roots = []
+        self.originalOperations = 0
+
+    def add(self, postfix):
+        """
+        Adds an expression, sharing the nodes of subexpressions that are
+        already in the graph.
+        Parameters: postfix - The valid postfix expression, with numbers
+                    converted, e.g. from parseToPostfix.
+        """
+        nodes = self.nodes
+        index = self.index
+        stack = []
+        for item in postfix:
+            if item in ops:
+                count = arities[item]
+                # An operator node is its own key.
+                key = node = (item,) + tuple(stack[-count:])
+                del stack[-count:]
+                self.originalOperations += 1
+            elif type(item) is str:
+                key = node = (NAME, item)
+            else:
+                node = (NUMBER, item)
+                key = nodeKey(node)
+            position = index.get(key)
+            if position is None:
+                position = index[key] = len(nodes)
+                nodes.append(node)
+            stack.append(position)
+        self.roots.append(stack[0])
+
+    def operations(self):
+        """
+        Get the number of operations that evaluating the batch computes.
+        Returns: The number of distinct operator nodes.
+        """
+        return sum(1 for node in self.nodes if node[0] in ops)
+
+    def dedupRatio(self):
+        """
+        Get how much sharing subexpressions saves.
+        Returns: The number of operators in all of the expressions divided by
+        the number of operations computed, or 1.0 if there are none.
+        """
+        operations = self.operations()
+        return self.originalOperations / operations if operations else 1.0
+
+def internBatch(expressions, backend = None):
+    """
+    Parses a batch of math expressions into one shared graph.
+    Parameters: expressions - An iterable of math expression strings.
+                backend - The NumericBackend that converts the numbers.
+                Defaults to ints and floats.
+    Returns: A BatchProgram.
+    """
+    program = BatchProgram()
+    for input in expressions:
+        try:
+            postfix = parseToPostfix(input, False, backend)
+        except CalculationError as error:
+            program.roots.append(error)
+        else:
+            program.add(postfix)
+    return program
+
+def evaluateBatch(program, backend = None, variables = None):
+    """
+    Evaluates every expression of a BatchProgram, computing each node once.
+    An operation that cannot be computed makes the expressions that use it
+    fail, with the error of its first operand that failed, in the same order
+    evaluatePostfix would find it.
+    Parameters: program - The BatchProgram.
+                backend - The NumericBackend to evaluate with. It must be
+                the one the numbers were converted with.
+                variables - A dictionary mapping names to values, if the
+                expressions use names.
+    Returns: A list with the result of each expression, in order, or a
+    CalculationError for expressions that could not be evaluated.
+    """
+    table = ops if backend is None else backend.ops
+    values = []
+    with backendContext(backend):
+        for node in program.nodes:
+            kind = node[0]
+            if kind == NUMBER:
+                values.append(node[1])
+            elif kind == NAME:
+                if variables is None or node[1] not in variables:
+                    values.append(CalculationError("Invalid Input: unknown variable " + node[1] + "."))
+                else:
+                    values.append(variables[node[1]])
+            else:
+                operands = [values[child] for child in node[1:]]
+                for operand in operands:
+                    if type(operand) is CalculationError:
+                        values.append(operand)
+                        break
+                else:
+                    try:
+                        values.append(table[kind](*operands))
+                    except ArithmeticError as error:
+                        values.append(mathError(error))
+    results = []
+    for root in program.roots:
+        result = root if type(root) is CalculationError else values[root]
+        if type(result) is CalculationError:
+            # Expressions that share a failed node still get errors of their
+            # own.
+            result = CalculationError(result.message, result.position)
+        results.append(result)
+    return results
+
+def runDedupBatch(path, backend = None, chunkSize = chunkLines):
+    """
+    Evaluates every line of a file, or of standard input, sharing the
+    subexpressions the lines have in common, and writes the results to
+    standard output in the same format as runBatch. Error messages are
+    printed to standard error, followed by the dedup ratio of the batch.
+    Parameters: path - The input file path, or "-" to read standard input.
+                backend - The NumericBackend to evaluate with.
+                chunkSize - The number of lines that share one graph.
+    Returns: The number of lines that could not be evaluated, or 1 if the
+    file cannot be opened.
+    """
+    lines = openLines(path)
+    if lines is None:
+        return 1
+    output = open(stdout.fileno(), "w", buffering = batchBufferSize, closefd = False)
+    errors = 0
+    originalOperations = 0
+    operations = 0
+    try:
+        expressions = (line.rstrip("\r\n") for line in lines)
+        while True:
+            chunk = list(islice(expressions, chunkSize))
+            if not chunk:
+                break
+            program = internBatch(chunk, backend)
+            originalOperations += program.originalOperations
+            operations += program.operations()
+            for result in evaluateBatch(program, backend):
+                if type(result) is not CalculationError:
+                    try:
+                        output.write(formatResult(result) + "\n")
+                        continue
+                    except CalculationError as error:
+                        result = error
+                print(result.message, file = stderr)
+                output.write(errorMarker + "\n")
+                errors += 1
+    finally:
+        output.flush()
+        if lines is not stdin:
+            lines.close()
+    print("%d operations, %d computed (dedup ratio %.2f)"
+          % (originalOperations, operations, originalOperations / operations if operations else 1.0), file = stderr)
+    return errors
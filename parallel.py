@@ -0,0 +1,158 @@
+#! /usr/bin/env python3.7
+
+# Evaluates large batches of independent math expressions on a pool of
+# worker processes.
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from sys import stderr
+from sys import stdin
+from sys import stdout
+
+from calculate import CalculationError
+from calculate import batchBufferSize
+from calculate import calculate
+from calculate import errorMarker
+from calculate import formatResult
+from calculate import openLines
+
+# Expressions are sent to workers in chunks of about this many characters, so
+# short expressions are grouped together and long ones are sent on their own.
+chunkCharacters = 1 << 16
+
+def evaluateChunk(chunk):
+    """
+    Evaluates a list of math expressions. Runs in the worker processes.
+    Parameters: chunk - A list of math expression strings.
+    Returns: A list with the result of each expression, or a CalculationError
+    for expressions that could not be evaluated.
+    """
+    results = []
+    for input in chunk:
+        try:
+            results.append(calculate(input))
+        except CalculationError as error:
+            results.append(error)
+    return results
+
+def evaluateChunkWithStats(chunk):
+    """
+    Evaluates a list of math expressions and times the stages of the
+    pipeline. Runs in the worker processes.
+    Parameters: chunk - A list of math expression strings.
+    Returns: A tuple of the results, as from evaluateChunk, and the
+    statistics, as exported by Instrumentation.export.
+    """
+    import instrument
+    instrumentation = instrument.enable()
+    try:
+        results = evaluateChunk(chunk)
+    finally:
+        instrument.disable()
+    return results, instrumentation.export()
+
+def chunkExpressions(expressions, chunkSize = chunkCharacters):
+    """
+    Groups math expressions into chunks of about the same total length.
+    Parameters: expressions - An iterable of math expression strings.
+                chunkSize - The number of characters after which a chunk is
+                closed.
+    Returns: A generator of lists of math expression strings.
+    """
+    chunk = []
+    size = 0
+    for input in expressions:
+        chunk.append(input)
+        size += len(input) + 1
+        if size >= chunkSize:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+def evaluateChunks(chunks, workers = None, instrumentation = None):
+    """
+    Evaluates chunks of math expressions on a pool of worker processes.
+    Only a few chunks per worker are in flight at a time, so memory use does
+    not depend on how many chunks there are.
+    Parameters: chunks - An iterable of lists of math expression strings.
+                workers - The number of worker processes. Defaults to the
+                number of CPUs.
+                instrumentation - An optional Instrumentation, to which the
+                workers' timings of the pipeline stages are added.
+    Returns: A generator of result lists, one per chunk, in input order. See
+    evaluateChunk.
+    """
+    workers = workers or cpu_count() or 1
+    function = evaluateChunk if instrumentation is None else evaluateChunkWithStats
+
+    def nextResults():
+        results = pending.popleft().result()
+        if instrumentation is None:
+            return results
+        results, exported = results
+        instrumentation.merge(exported)
+        return results
+
+    pending = deque()
+    with ProcessPoolExecutor(workers) as executor:
+        for chunk in chunks:
+            pending.append(executor.submit(function, chunk))
+            if len(pending) >= 2 * workers:
+                yield nextResults()
+        while pending:
+            yield nextResults()
+
+def evaluateParallel(expressions, workers = None, chunkSize = chunkCharacters):
+    """
+    Evaluates math expressions on a pool of worker processes.
+    Parameters: expressions - An iterable of math expression strings.
+                workers - The number of worker processes. Defaults to the
+                number of CPUs.
+                chunkSize - The approximate number of characters sent to a
+                worker at a time.
+    Returns: A list with the result of each expression, in input order, or a
+    CalculationError for expressions that could not be evaluated.
+    """
+    results = []
+    for chunkResults in evaluateChunks(chunkExpressions(expressions, chunkSize), workers):
+        results += chunkResults
+    return results
+
+def runParallelBatch(path, workers = None, instrumentation = None):
+    """
+    Evaluates every line of a file, or of standard input, on a pool of worker
+    processes, and writes the results to standard output in the same format
+    as runBatch. Error messages are printed to standard error.
+    Parameters: path - The input file path, or "-" to read standard input.
+                workers - The number of worker processes.
+                instrumentation - An optional Instrumentation, to which the
+                workers' timings of the pipeline stages are added.
+    Returns: The number of lines that could not be evaluated, or 1 if the
+    file cannot be opened.
+    """
+    lines = openLines(path)
+    if lines is None:
+        return 1
+    output = open(stdout.fileno(), "w", buffering = batchBufferSize, closefd = False)
+    errors = 0
+    try:
+        expressions = (line.rstrip("\r\n") for line in lines)
+        for chunkResults in evaluateChunks(chunkExpressions(expressions), workers, instrumentation):
+            for result in chunkResults:
+                if not isinstance(result, CalculationError):
+                    try:
+                        output.write(formatResult(result) + "\n")
+                        continue
+                    except CalculationError as error:
+                        result = error
+                print(result.message, file = stderr)
+                output.write(errorMarker + "\n")
+                errors += 1
+    finally:
+        output.flush()
+        if lines is not stdin:
+            lines.close()
+    return errors
@@ -0,0 +1,246 @@
+#! /usr/bin/env python3.7
+
+# A compact binary format for compiled (postfix) math expressions. A library
+# of named programs is written to a file once. Later processes memory-map
+# the file and evaluate programs straight from the mapped buffer, without
+# parsing or copying them, and processes that map the same file share its
+# pages.
+#
+# File layout (all integers little-endian):
+#     header:    magic (8 bytes), program count (u64), operator table
+#                fingerprint (u64)
+#     directory: one entry of 10 u64s per program: name offset and length,
+#                code offset and length, int pool offset and count, float
+#                pool offset and count, big int pool offset and length
+#     data:      the sections the directory points to, each aligned to 8
+#                bytes
+# A program's code is one opcode byte per postfix item, as in a
+# CompactProgram. Number opcodes take the next value from their pool, in
+# order, so the code needs no operands.
+# Ints that do not fit in 64 bits are stored in the big int pool as a u32
+# length followed by their decimal digits.
+# The opcodes of operators other than + - * / and unary minus depend on the
+# order they were registered in, so the header stores a fingerprint of the
+# operator table, and a file is only read with the same operators registered.
+
+import mmap
+import os
+import struct
+from zlib import crc32
+
+from calculate import CompactProgram
+from calculate import OP_BIGINT
+from calculate import OP_FLOAT
+from calculate import OP_INT
+from calculate import opArities
+from calculate import opFunctions
+from calculate import opcodes
+
+magic = b"CALCPFX2"
+headerFormat = struct.Struct("<8sQQ")
+entryFormat = struct.Struct("<10Q")
+bigIntLength = struct.Struct("<I")
+
+def operatorFingerprint():
+    """
+    Get a fingerprint of the operator table: the opcode, symbol, arity and
+    function of each registered operator and function.
+    Returns: The fingerprint, as an int.
+    """
+    entries = sorted((code, symbol, opArities[code], getattr(opFunctions[code], "__module__", None),
+                      getattr(opFunctions[code], "__qualname__", None)) for symbol, code in opcodes.items())
+    return crc32(repr(entries).encode())
+
+def encodeProgram(postfix):
+    """
+    Encodes a postfix expression as opcodes and constant pools.
+    Parameters: postfix - The postfix expression, from compileExpression or
+                parseToPostfix, or a CompactProgram. Numbers may be strings
+                or already converted.
+    Returns: (code, ints, floats, bigInts) as bytes objects.
+    Raises ValueError if the postfix expression is not valid.
+    """
+    if type(postfix) is not CompactProgram:
+        postfix = CompactProgram(postfix)
+    bigInts = bytearray()
+    for item in postfix.bigInts:
+        digits = str(item).encode()
+        bigInts += bigIntLength.pack(len(digits)) + digits
+    return (postfix.code.tobytes(), struct.pack("<%dq" % len(postfix.ints), *postfix.ints),
+            struct.pack("<%dd" % len(postfix.floats), *postfix.floats), bytes(bigInts))
+
+def writePrograms(path, programs):
+    """
+    Writes a library of programs to a file.
+    Parameters: path - The file to write.
+                programs - A dictionary mapping program names to postfix
+                expressions.
+    Raises ValueError if a postfix expression is not valid.
+    """
+    data = bytearray()
+    entries = []
+    dataStart = headerFormat.size + entryFormat.size * len(programs)
+
+    def addSection(section):
+        # Pad so that every section starts 8-byte aligned in the file.
+        data.extend(bytes(-(dataStart + len(data)) % 8))
+        offset = dataStart + len(data)
+        data.extend(section)
+        return offset
+
+    for name, postfix in programs.items():
+        code, ints, floats, bigInts = encodeProgram(postfix)
+        nameBytes = name.encode()
+        entries.append(entryFormat.pack(
+            addSection(nameBytes), len(nameBytes),
+            addSection(code), len(code),
+            addSection(ints), len(ints) // 8,
+            addSection(floats), len(floats) // 8,
+            addSection(bigInts), len(bigInts)))
+
+    with open(path, "wb") as file:
+        file.write(headerFormat.pack(magic, len(programs), operatorFingerprint()))
+        for entry in entries:
+            file.write(entry)
+        file.write(data)
+
+def evaluateCode(code, ints, floats, bigInts):
+    """
+    Evaluates an encoded program.
+    Parameters: code - The opcodes, as a bytes-like object.
+                ints - The int pool, as a sequence of ints.
+                floats - The float pool, as a sequence of floats.
+                bigInts - The big int pool, as a bytes-like object.
+    Returns: The result of the calculation.
+    Raises ArithmeticError, e.g. ZeroDivisionError if the program divides by
+    zero.
+    """
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    intPos = 0
+    floatPos = 0
+    bigIntPos = 0
+    for op in code:
+        if op == OP_INT:
+            push(ints[intPos])
+            intPos += 1
+        elif op == OP_FLOAT:
+            push(floats[floatPos])
+            floatPos += 1
+        elif op == OP_BIGINT:
+            length = bigIntLength.unpack_from(bigInts, bigIntPos)[0]
+            start = bigIntPos + bigIntLength.size
+            push(int(bytes(bigInts[start:start + length])))
+            bigIntPos = start + length
+        elif opArities[op] == 1:
+            push(opFunctions[op](pop()))
+        else:
+            r = pop()
+            push(opFunctions[op](pop(), r))
+    return stack[0]
+
+class ProgramLibrary:
+    """
+    A library of programs written by writePrograms, memory-mapped for
+    evaluation. Programs are evaluated from views of the mapped file, so
+    nothing is copied or parsed.
+    Use as a context manager, or call close when done.
+    """
+
+    def __init__(self, path):
+        """
+        Maps a library file.
+        Parameters: path - The file to map.
+        Raises ValueError if the file is not a program library, is truncated
+        or corrupt, or was written with different operators registered.
+        """
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size < headerFormat.size:
+                raise ValueError("not a program library: " + path)
+            self.map = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.buffer = memoryview(self.map)
+        try:
+            self.programs = self.readDirectory(path)
+        except Exception:
+            self.close()
+            raise
+
+    def readDirectory(self, path):
+        """
+        Reads the header and the directory of the mapped file.
+        Parameters: path - The file's path, for error messages.
+        Returns: A dictionary mapping each program's name to the rest of its
+        directory entry.
+        Raises ValueError if the file is not a program library, is truncated
+        or corrupt, or was written with different operators registered.
+        """
+        size = len(self.map)
+        try:
+            fileMagic, count, fingerprint = headerFormat.unpack_from(self.buffer, 0)
+            if fileMagic != magic:
+                raise ValueError("not a program library: " + path)
+            if fingerprint != operatorFingerprint():
+                raise ValueError("program library was written with different operators: " + path)
+            if count > (size - headerFormat.size) // entryFormat.size:
+                raise ValueError("program library is truncated: " + path)
+            programs = {}
+            for i in range(count):
+                entry = entryFormat.unpack_from(self.buffer, headerFormat.size + i * entryFormat.size)
+                # Each section's offset and length; the pools store counts of
+                # 8 byte values.
+                for offset, length in zip(entry[0::2], (entry[1], entry[3], entry[5] * 8, entry[7] * 8, entry[9])):
+                    if offset + length > size:
+                        raise ValueError("program library is truncated: " + path)
+                programs[bytes(self.section(entry[0], entry[1])).decode()] = entry[2:]
+        except (struct.error, UnicodeDecodeError):
+            raise ValueError("program library is corrupt: " + path)
+        return programs
+
+    def section(self, offset, length):
+        """
+        Get a view of part of the mapped file.
+        Parameters: offset, length - The position and size of the part, in bytes.
+        Returns: A memoryview of the part.
+        """
+        return self.buffer[offset:offset + length]
+
+    def names(self):
+        """
+        Get the names of the programs in the library.
+        Returns: A list of program names, in the order they were written.
+        """
+        return list(self.programs)
+
+    def evaluate(self, name):
+        """
+        Evaluates a program from the library.
+        Parameters: name - The program's name.
+        Returns: The result of the calculation.
+        Raises KeyError if there is no such program, and ArithmeticError, e.g.
+        ZeroDivisionError if it divides by zero.
+        """
+        codeOffset, codeLength, intOffset, intCount, floatOffset, floatCount, \
+            bigIntOffset, bigIntLength = self.programs[name]
+        code = self.section(codeOffset, codeLength)
+        ints = self.section(intOffset, intCount * 8).cast("q")
+        floats = self.section(floatOffset, floatCount * 8).cast("d")
+        bigInts = self.section(bigIntOffset, bigIntLength)
+        try:
+            return evaluateCode(code, ints, floats, bigInts)
+        finally:
+            for view in (code, ints, floats, bigInts):
+                view.release()
+
+    def close(self):
+        """
+        Unmaps the file.
+        """
+        self.buffer.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
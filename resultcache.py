@@ -0,0 +1,197 @@
+#! /usr/bin/env python3.7
+
+# An on-disk cache of results for calculate.py --cache, shared by every
+# process that uses the same directory, so short-lived processes that
+# evaluate the same expressions do not evaluate them again.
+#
+# Each entry is a file named after a hash of its key, in one of shardCount
+# shard directories. Entries are written to a temporary file and renamed into
+# place, so readers never see part of an entry, and processes writing the
+# same key at once leave one complete entry. Each shard keeps at most
+# maxEntries / shardCount entries; a write that goes over removes the least
+# recently used entries of its shard, by modification time, which each hit
+# refreshes.
+#
+# calculate.py imports this module before anything else, and only os, sys
+# and zlib are imported here, so a hit is printed without loading the
+# evaluator at all.
+
+import os
+from sys import argv
+from sys import stderr
+from time import time
+from zlib import adler32
+from zlib import crc32
+
+# Change this whenever results of the same expression may change, so older
+# entries are not used.
+cacheVersion = 1
+
+shardCount = 256
+defaultMaxEntries = 1 << 16
+
+# Temporary files older than this many seconds were left by a process that
+# stopped while writing, and are removed.
+staleSeconds = 60
+
+def cacheDirectory(option = True):
+    """
+    Get the directory of the cache.
+    Parameters: option - The value of the --cache option: a directory, or
+                True for the default, $XDG_CACHE_HOME/calculate or
+                ~/.cache/calculate.
+    Returns: The directory path.
+    """
+    if option is not True:
+        return option
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "calculate")
+
+def cacheKey(input, mode = "native", precision = None):
+    """
+    Get the key of an expression's result. Surrounding spaces and runs of
+    spaces do not change a result, so they are normalized away.
+    Parameters: input - The math expression string.
+                mode - The --mode option.
+                precision - The --precision option, or None.
+    Returns: The key string.
+    """
+    expression = " ".join(part for part in input.split(" ") if part)
+    return "\0".join([str(cacheVersion), str(mode), "" if precision is None else str(precision), expression])
+
+class ResultCache:
+    """
+    The results of math expressions, or their error messages, stored in a
+    directory. The cache is optional, so errors reading or writing it are
+    ignored: a failed read is a miss and a failed write stores nothing.
+    """
+
+    def __init__(self, directory, maxEntries = defaultMaxEntries):
+        """
+        Parameters: directory - The cache directory. It is created when the
+                    first entry is written.
+                    maxEntries - About how many entries to keep.
+        """
+        self.directory = directory
+        self.shardEntries = max(1, maxEntries // shardCount)
+
+    def entryPath(self, key):
+        """
+        Get the file of an entry.
+        Parameters: key - The key, from cacheKey.
+        Returns: The file path.
+        """
+        data = key.encode("utf-8", "surrogateescape")
+        name = "%08x%08x" % (crc32(data), adler32(data))
+        return os.path.join(self.directory, name[:2], name[2:])
+
+    def get(self, key):
+        """
+        Looks up a result.
+        Parameters: key - The key, from cacheKey.
+        Returns: A tuple of the output and whether it is an error message,
+        or None if the key is not cached.
+        """
+        path = self.entryPath(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        # Different keys can have the same hash, so the key is stored too.
+        keyData = key.encode("utf-8", "surrogateescape")
+        header, separator, body = data.partition(b"\n")
+        if header not in (b"result %d" % len(keyData), b"error %d" % len(keyData)) or body[:len(keyData)] != keyData:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return body[len(keyData):].decode("utf-8", "surrogateescape"), header.startswith(b"error")
+
+    def put(self, key, output, isError):
+        """
+        Stores a result, replacing any entry with the same key.
+        Parameters: key - The key, from cacheKey.
+                    output - The printed result, or the error message.
+                    isError - Whether output is an error message.
+        """
+        path = self.entryPath(key)
+        keyData = key.encode("utf-8", "surrogateescape")
+        # A header line of the kind of output and the length of the key,
+        # then the key and the output.
+        data = (b"%s %d\n" % (b"error" if isError else b"result", len(keyData)) + keyData
+                + output.encode("utf-8", "surrogateescape"))
+        temporary = "%s.%s.tmp" % (path, os.urandom(4).hex())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            with open(temporary, "wb") as file:
+                file.write(data)
+            os.replace(temporary, path)
+            self.evict(os.path.dirname(path))
+        except OSError:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+    def evict(self, shard):
+        """
+        Removes the least recently used entries of a shard until it is within
+        its limit, and temporary files left behind by stopped writers.
+        Parameters: shard - The shard directory.
+        """
+        entries = []
+        now = time()
+        for entry in os.scandir(shard):
+            try:
+                modified = entry.stat().st_mtime
+                if not entry.name.endswith(".tmp"):
+                    entries.append((modified, entry.path))
+                elif modified < now - staleSeconds:
+                    os.remove(entry.path)
+            except OSError:
+                # Another process removed it first.
+                pass
+        if len(entries) <= self.shardEntries:
+            return
+        entries.sort()
+        for modified, path in entries[:len(entries) - self.shardEntries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def printCached(args = None):
+    """
+    The fast path of calculate.py --cache: prints the cached result of the
+    command line's expression, if there is one, as calculate.py would print
+    it.
+    Parameters: args - The command line arguments, without the program name.
+                Defaults to those of this process.
+    Returns: True if the result was printed, otherwise False.
+    """
+    # Options are separated as calculate.parseOptions does.
+    options = {}
+    arguments = []
+    args = iter(argv[1:] if args is None else args)
+    for arg in args:
+        if arg == "--":
+            arguments += args
+        elif arg.startswith("--") and arg[2:3].isalpha():
+            name, separator, value = arg[2:].partition("=")
+            options[name] = value if separator else True
+        else:
+            arguments.append(arg)
+    if "cache" not in options or not set(options) <= {"cache", "mode", "precision"} or len(arguments) != 1:
+        return False
+    key = cacheKey(arguments[0], options.get("mode", "native"), options.get("precision"))
+    entry = ResultCache(cacheDirectory(options["cache"])).get(key)
+    if entry is None:
+        return False
+    output, isError = entry
+    if isError:
+        print(output, file = stderr)
+    else:
+        print(output)
+    return True
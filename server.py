@@ -0,0 +1,168 @@
+#! /usr/bin/env python3.7
+
+# A long-running server that evaluates math expressions sent over a Unix
+# domain socket or a local TCP port, so the interpreter only starts once.
+#
+# Protocol: the client sends one expression per line, and may send many lines
+# without waiting for replies. The server replies with one line per
+# expression, in the same order:
+#     OK <result>
+#     ERROR <position> <message>
+# where <position> is the position of the error in the expression, or "-" if
+# it is not known.
+#
+# Each expression is evaluated within limits, so that one request cannot keep
+# the server busy: expressions over them get a "Limit Error" reply.
+# Expressions are evaluated by an executor rather than on the event loop, so
+# a slow expression on one connection does not hold up the others.
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from sys import argv
+from time import monotonic
+
+from calculate import CalculationError
+from calculate import Limits
+from calculate import calculate
+from calculate import formatResult
+from calculate import maxPowerBits
+from calculate import maxPrintableBits
+from calculate import parseOptions
+
+defaultPort = 7227
+
+# The longest line the server accepts. Longer lines get an error reply and
+# the connection is closed.
+maxLineLength = 1 << 20
+
+# The limits on each expression, and the most seconds each may take. Numbers
+# are limited to the size of the largest exact power, or of the largest int
+# that can be printed, if that is smaller.
+defaultLimits = Limits(maxIntBits = min(maxPowerBits, maxPrintableBits() or maxPowerBits))
+defaultTimeout = 1.0
+
+def formatReply(line, limits = None, timeout = None):
+    """
+    Evaluates one request line and formats the reply.
+    Parameters: line - The request line, as bytes.
+                limits - The Limits of the expression, or None.
+                timeout - The most seconds the expression may take, or None.
+    Returns: The reply line, as bytes.
+    """
+    input = line.decode("utf-8", "replace").rstrip("\r\n")
+    if timeout is not None:
+        limits = (limits or Limits())._replace(deadline = monotonic() + timeout)
+    try:
+        return ("OK " + formatResult(calculate(input, None, limits)) + "\n").encode()
+    except CalculationError as error:
+        return formatError(error)
+
+def formatError(error):
+    """
+    Formats an error reply.
+    Parameters: error - The CalculationError.
+    Returns: The reply line, as bytes.
+    """
+    position = "-" if error.position is None else str(error.position)
+    return ("ERROR " + position + " " + error.message + "\n").encode()
+
+async def handleConnection(reader, writer, limits = defaultLimits, timeout = defaultTimeout, executor = None):
+    """
+    Answers the requests on one connection until the client closes it.
+    Replies are written as soon as each request is evaluated, so requests can
+    be pipelined. Waiting for the write buffer to drain stops the server from
+    reading more requests while a slow client is not reading its replies.
+    Parameters: reader, writer - The connection's asyncio streams.
+                limits, timeout - The limits of each expression, as for
+                formatReply.
+                executor - The concurrent.futures Executor that evaluates
+                the expressions, or None for the event loop's default
+                thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                writer.write(formatError(CalculationError("Invalid Input: line too long.")))
+                break
+            if not line:
+                break
+            writer.write(await loop.run_in_executor(executor, formatReply, line, limits, timeout))
+            await writer.drain()
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def startServer(port = None, host = "127.0.0.1", path = None, limits = defaultLimits,
+                      timeout = defaultTimeout, executor = None):
+    """
+    Starts listening for connections.
+    Parameters: port - The TCP port to listen on, if path is not given. Port 0
+                picks a free port.
+                host - The address to listen on. Defaults to localhost only.
+                path - The path of a Unix domain socket to listen on instead.
+                limits - The Limits of each expression, or None.
+                timeout - The most seconds each expression may take, or None.
+                executor - The concurrent.futures Executor that evaluates
+                expressions, e.g. a ProcessPoolExecutor. Defaults to the
+                event loop's default thread pool.
+    Returns: The asyncio Server.
+    """
+    handler = partial(handleConnection, limits = limits, timeout = timeout, executor = executor)
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path = path, limit = maxLineLength)
+    return await asyncio.start_server(handler, host, port, limit = maxLineLength)
+
+async def serve(port = None, host = "127.0.0.1", path = None, limits = defaultLimits, timeout = defaultTimeout,
+                executor = None):
+    """
+    Runs the server until it is interrupted.
+    Parameters: see startServer.
+    """
+    server = await startServer(port, host, path, limits, timeout, executor)
+    async with server:
+        await server.serve_forever()
+
+# The options that set limits, and the Limits field each sets.
+limitOptions = {"max-tokens": "maxTokens", "max-depth": "maxDepth", "max-int-bits": "maxIntBits",
+                "max-steps": "maxSteps"}
+
+def main():
+    """
+    Runs the server. Use --socket=PATH to listen on a Unix domain socket, or
+    --port=N (default 7227) and --host=ADDRESS to listen on TCP.
+    --max-tokens=N, --max-depth=N, --max-int-bits=N and --max-steps=N limit
+    each expression, and --timeout=SECONDS limits the time each may take.
+    --jobs=N evaluates expressions in N worker processes instead of threads.
+    """
+    options, arguments = parseOptions(argv[1:])
+    if (arguments or not set(options) <= {"socket", "port", "host", "timeout", "jobs"}.union(limitOptions)
+            or True in options.values()
+            or not all(options[name].isdigit() for name in limitOptions if name in options)
+            or not options.get("jobs", "1").isdigit() or int(options.get("jobs", "1")) == 0):
+        print("Invalid Input")
+        return
+    try:
+        limits = defaultLimits._replace(**{field: int(options[name]) for name, field in limitOptions.items()
+                                           if name in options})
+        timeout = float(options.get("timeout", defaultTimeout))
+    except ValueError:
+        print("Invalid Input")
+        return
+    executor = ProcessPoolExecutor(int(options["jobs"])) if "jobs" in options else None
+    try:
+        asyncio.run(serve(int(options.get("port", defaultPort)), options.get("host", "127.0.0.1"),
+                          options.get("socket"), limits, timeout, executor))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3.7
+
+# Tests for binaryoutput.py
+
+import io
+import math
+import struct
+
+import pytest
+
+import binaryoutput
+import calculate
+from binaryoutput import *
+
+def readColumn(path, typecode, rows):
+    with open(path, "rb") as file:
+        values = struct.unpack("<%d%s" % (rows, typecode), file.read())
+    with open(path + ".valid", "rb") as file:
+        bitmap = file.read()
+    assert len(bitmap) == (rows + 7) // 8
+    return list(values), [bitmap[i // 8] >> i % 8 & 1 for i in range(rows)]
+
+def test_packBits():
+    assert packBits(b"") == b""
+    assert packBits(b"\x01\x00\x00\x00\x00\x00\x00\x00") == b"\x01"
+    assert packBits(b"\x00\x01\x01") == b"\x06"
+    assert packBits(bytes([1] * 8 + [0] * 8 + [1])) == b"\xff\x00\x01"
+
+def test_ColumnWriter(tmp_path, monkeypatch):
+    monkeypatch.setattr(binaryoutput, "stderr", io.StringIO())
+    path = str(tmp_path / "out.bin")
+    writer = ColumnWriter(path, "int64")
+    for result in [1, False, 2.0, 2.5, -2 ** 63, 2 ** 63, 0]:
+        writer.append(result)
+    writer.close()
+    assert (writer.rows, writer.errors) == (7, 3)
+    assert readColumn(path, "q", 7) == ([1, 0, 2, 0, -2 ** 63, 0, 0], [1, 0, 1, 0, 1, 0, 1])
+    assert binaryoutput.stderr.getvalue().splitlines() == ["Output Error: result does not fit in int64"] * 2
+    with pytest.raises(ValueError):
+        ColumnWriter(path, "int32")
+
+def test_ColumnWriter_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(binaryoutput, "blockRows", 8)
+    path = str(tmp_path / "out.bin")
+    writer = ColumnWriter(path, "float64")
+    for i in range(21):
+        writer.append(False if i % 3 == 0 else i / 2)
+    writer.extend(struct.pack("<2d", 1.5, math.nan), b"\x01\x00")
+    writer.append(10 ** 400)
+    writer.close()
+    values, flags = readColumn(path, "d", 24)
+    assert flags == [0 if i % 3 == 0 else 1 for i in range(21)] + [1, 0, 0]
+    assert [value for value, flag in zip(values, flags) if flag] == [i / 2 for i in range(21) if i % 3] + [1.5]
+    assert all(math.isnan(value) for value, flag in zip(values, flags) if not flag)
+
+def test_ColumnWriter_npy(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    path = str(tmp_path / "out.npy")
+    writer = ColumnWriter(path, "float64")
+    for result in [1, 0.5, False]:
+        writer.append(result)
+    writer.close()
+    column = numpy.load(path, mmap_mode = "r")
+    assert column.dtype == numpy.float64 and column.shape == (3,)
+    assert column[:2].tolist() == [1.0, 0.5] and math.isnan(column[2])
+
+def test_runBinaryBatch(tmp_path, monkeypatch):
+    monkeypatch.setattr(calculate, "stderr", io.StringIO())
+    monkeypatch.setattr(binaryoutput, "stderr", io.StringIO())
+    input = tmp_path / "input.txt"
+    input.write_text("1 + 2\n7 / 2\n1 / 0\n2 ^ 70\n")
+    path = str(tmp_path / "out.bin")
+    assert runBinaryBatch(str(input), path, "int64") == 3
+    assert readColumn(path, "q", 4) == ([3, 0, 0, 0], [1, 0, 0, 0])
+    assert calculate.stderr.getvalue().splitlines() == ["Math Error: division by zero"]
+    assert runBinaryBatch(str(input), path) == 1
+    assert readColumn(path, "d", 4)[0][:2] == [3.0, 3.5]
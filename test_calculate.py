@@ -7,6 +7,10 @@
 
 # Tests for calculate.py
 
+import sys
+
+import pytest
+
 from calculate import *
 
 def test_parse():
@@ -150,13 +154,15 @@ def test_validateSyntax_second_op_not_minus():
 
 def test_validateSyntax_second_op_is_minus():
     expression = ['3', '+', '32', '/', '-', '4']
-    assert validateSyntax(expression) == expression
+    assert validateSyntax(expression) == ['3', '+', '32', '/', '~', '4']
     expression = ['3', '+', '32', '*', '-', '4']
-    assert validateSyntax(expression) == expression
+    assert validateSyntax(expression) == ['3', '+', '32', '*', '~', '4']
     expression = ['3', '+', '32', '+', '-', '4']
-    assert validateSyntax(expression) == expression
+    assert validateSyntax(expression) == ['3', '+', '32', '+', '~', '4']
     expression = ['3', '+', '32', '-', '-', '4']
-    assert validateSyntax(expression) == expression
+    assert validateSyntax(expression) == ['3', '+', '32', '-', '~', '4']
+    # The caller's list is not changed.
+    assert expression == ['3', '+', '32', '-', '-', '4']
 
 def test_validateSyntax_with_flat_parens():
     expression = ['2', '+', '(', '7', '-', '4', ')', '-', '2']
@@ -316,4 +322,653 @@ def test_precedence():
     op = "/"
     assert precedence(op) == 1
     op = "~"
-    assert precedence(op) == 2
\ No newline at end of file
+    assert precedence(op) == 2
+
+def test_evaluateExpression():
+    assert evaluateExpression("124 + 7 - 3 * 79 - 3") == -109
+    assert evaluateExpression("2 * (7 + 7)") == 28
+    assert evaluateExpression("1 - 1") == 0
+    assert evaluateExpression("1 - 1") is not False
+
+def test_evaluateExpression_invalid():
+    assert evaluateExpression("") is False
+    assert evaluateExpression("2 +") is False
+    assert evaluateExpression("(3)(4)") is False
+    assert evaluateExpression("19 + cinnamon") is False
+
+def test_evaluateExpression_division_by_zero():
+    assert evaluateExpression("1 / 0") is False
+    assert evaluateExpression("4 / (2 - 2)") is False
+
+def test_evaluateStream():
+    import io
+    lines = io.StringIO("2+2\n7 / 2\n\n3 * * 4\n1 - 1\n1/0\r\n.5 * 3")
+    output = io.StringIO()
+    assert evaluateStream(lines, output) == 3
+    assert output.getvalue() == "4\n3.5\nERROR\nERROR\n0\nERROR\n1.5\n"
+
+def test_batch_missing_file(tmp_path, monkeypatch, capsys):
+    from io import StringIO
+    from optimize import runDedupBatch
+    from parallel import runParallelBatch
+    from binaryoutput import runBinaryBatch
+    errors = StringIO()
+    monkeypatch.setattr("calculate.stderr", errors)
+    path = str(tmp_path / "missing.txt")
+    assert runBatch(path) == 1
+    assert runParallelBatch(path, 1) == 1
+    assert runDedupBatch(path) == 1
+    assert runBinaryBatch(path, str(tmp_path / "out.bin")) == 1
+    assert not (tmp_path / "out.bin").exists()
+    assert errors.getvalue().splitlines() == ["File Error: No such file or directory: " + path] * 4
+    monkeypatch.setattr("calculate.argv", ["calculate.py", "--batch", path])
+    main()
+    assert capsys.readouterr().out == ""
+
+def test_parseOptions():
+    assert parseOptions(["2+2"]) == ({}, ["2+2"])
+    assert parseOptions(["-5+3"]) == ({}, ["-5+3"])
+    assert parseOptions(["--batch", "input.txt"]) == ({"batch": True}, ["input.txt"])
+    assert parseOptions(["--jobs=4", "-"]) == ({"jobs": "4"}, ["-"])
+    assert parseOptions(["--3"]) == ({}, ["--3"])
+    assert parseOptions(["--batch", "--", "--x", "-"]) == ({"batch": True}, ["--x", "-"])
+
+def test_main_invalid_jobs(monkeypatch, capsys):
+    from io import StringIO
+    for jobs in ["abc", "0", "-1", ""]:
+        errors = StringIO()
+        monkeypatch.setattr("calculate.stderr", errors)
+        monkeypatch.setattr("calculate.argv", ["calculate.py", "--batch", "--jobs=" + jobs, "-"])
+        main()
+        assert errors.getvalue() == "Invalid Input\n"
+    assert capsys.readouterr().out == ""
+
+def test_evaluatePostfix_errors_to_stderr(monkeypatch, capsys):
+    from io import StringIO
+    errors = StringIO()
+    monkeypatch.setattr("calculate.stderr", errors)
+    assert evaluatePostfix(["1", "2"]) is False
+    assert capsys.readouterr().out == ""
+    assert errors.getvalue() == "Syntax Error\n"
+
+def test_ExpressionCache_hits_and_misses():
+    cache = ExpressionCache()
+    assert cache.compile("2 * (7 + 7)") == (2, 7, 7, '+', '*')
+    assert cache.compile("  2 * (7 + 7) ") == (2, 7, 7, '+', '*')
+    assert evaluateExpression("2 * (7 + 7)", cache) == 28
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["entries"] == 1
+
+def test_ExpressionCache_invalid_expressions(monkeypatch):
+    from io import StringIO
+    errors = StringIO()
+    monkeypatch.setattr("calculate.stderr", errors)
+    cache = ExpressionCache()
+    assert cache.compile("3 * * 4") == False
+    assert cache.compile("3 * * 4") == False
+    assert cache.stats()["hits"] == 1
+    assert errors.getvalue().splitlines() == ["Syntax Error"] * 2
+    assert evaluateExpression("3 * * 4", cache) is False
+    assert evaluateExpression("", cache) is False
+    assert evaluateExpression("1 / 0", cache) is False
+
+def test_ExpressionCache_max_entries():
+    cache = ExpressionCache(maxEntries = 2)
+    cache.compile("1 + 1")
+    cache.compile("2 + 2")
+    cache.compile("1 + 1")
+    cache.compile("3 + 3")
+    assert list(cache.entries) == ["1 + 1", "3 + 3"]
+    assert cache.stats()["evictions"] == 1
+
+def test_ExpressionCache_max_bytes():
+    cache = ExpressionCache(maxEntries = None, maxBytes = 1)
+    cache.compile("1 + 1")
+    cache.compile("2 + 2")
+    assert list(cache.entries) == ["2 + 2"]
+    assert cache.stats()["bytes"] == entrySize("2 + 2", (2, 2, '+'))
+    cache.clear()
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+def test_evaluatePostfix_leading_unary_minus():
+    assert evaluatePostfix(['5', '~']) == -5
+    assert evaluatePostfix(['5', '~', '3', '+']) == -2
+    assert evaluateExpression("-.5") == -0.5
+
+def test_compilePostfix():
+    postfix = ['32', '5', '-', '7', '2', '*', '+', '3', '-', '32', '4', '/', '+']
+    assert compilePostfix(postfix)() == evaluatePostfix(postfix) == 46.0
+    postfix = ['2', '7', '6', '4', '+', '-', '2', '-', '+', '5', '-']
+    assert compilePostfix(postfix)() == evaluatePostfix(postfix) == -8
+    assert compilePostfix(['3'])() == 3
+
+def test_compilePostfix_unary_minus():
+    assert compilePostfix(['5', '~'])() == -5
+    assert compilePostfix(['8', '11', '~', '-'])() == 19
+    assert str(compilePostfix(['0.0', '~'])()) == str(evaluatePostfix(['0.0', '~']))
+
+def test_compilePostfix_types():
+    assert type(compilePostfix(['4', '2', '/'])()) is float
+    assert type(compilePostfix(['4', '2', '*'])()) is int
+    assert type(compilePostfix(['4', '2.0', '*'])()) is float
+
+def test_compilePostfix_long_expression():
+    postfix = ['1']
+    for i in range(100000):
+        postfix += ['1', '+']
+    assert compilePostfix(postfix)() == 100001
+
+def test_compilePostfix_invalid_expression():
+    assert compilePostfix([]) == False
+    assert compilePostfix(['2', '+']) == False
+    assert compilePostfix(['8', '3', '~', '+', '-']) == False
+    assert compilePostfix(['4', '2']) == False
+
+def test_compilePostfix_division_by_zero():
+    function = compilePostfix(['1', '0', '/'])
+    with pytest.raises(ZeroDivisionError):
+        function()
+
+def test_parse_names():
+    input = "x * 2 + y"
+    assert parse(input, allowNames = True) == ['x', '*', '2', '+', 'y']
+    input = "(rate_1 - _offset2)/.5"
+    assert parse(input, allowNames = True) == ['(', 'rate_1', '-', '_offset2', ')', '/', '.5']
+    input = "19 + cinnamon"
+    assert parse(input) == False
+
+def test_convertToPostfix_names():
+    expression = validateSyntax(parse("-x * (y - 2)", allowNames = True))
+    assert convertToPostfix(expression) == ['x', '~', 'y', '2', '-', '*']
+
+def test_typed_values_through_pipeline():
+    expression = validateSyntax([2, '*', '-', '(', 7, '+', 0.5, ')'])
+    assert expression == [2, '*', '~', '(', 7, '+', 0.5, ')']
+    postfix = convertToPostfix(expression)
+    assert postfix == [2, 7, 0.5, '+', '~', '*']
+    assert evaluatePostfix(postfix) == -15.0
+    assert compilePostfix(postfix)() == -15.0
+
+def multiPassAccepts(input):
+    expression = parse(input)
+    if not expression:
+        return False
+    validatedExpression = validateSyntax(expression)
+    if not validatedExpression:
+        return False
+    return evaluatePostfix(convertToPostfix(validatedExpression)) is not False
+
+def singlePassAccepts(input):
+    try:
+        parseToPostfix(input)
+        return True
+    except CalculationError:
+        return False
+
+def test_parseToPostfix_matches_multi_pass_pipeline():
+    expressions = [
+        # From the validateSyntax tests above.
+        ['32', '-', '5', '+', '7', '*', '2', '-', '3', '+', '32', '/', '-', '*', '4'],
+        ['-', '-', '-', '5'], ['2', '+', '-', '+', '-', '4'],
+        ['3', '+', '32', '/', '/', '4'], ['3', '+', '32', '*', '/', '4'],
+        ['3', '+', '32', '+', '/', '4'], ['3', '+', '32', '-', '/', '4'],
+        ['3', '+', '32', '/', '*', '4'], ['3', '+', '32', '+', '*', '4'],
+        ['3', '+', '32', '*', '*', '4'], ['3', '+', '32', '-', '*', '4'],
+        ['3', '+', '32', '/', '+', '4'], ['3', '+', '32', '*', '+', '4'],
+        ['3', '+', '32', '+', '+', '4'], ['3', '+', '32', '-', '+', '4'],
+        ['3', '+', '32', '/', '-', '4'], ['3', '+', '32', '*', '-', '4'],
+        ['3', '+', '32', '+', '-', '4'], ['3', '+', '32', '-', '-', '4'],
+        ['2', '+', '(', '7', '-', '4', ')', '-', '2'],
+        ['2', '+', '(', '(', '7', '-', '4', ')', ')', '-', '5'],
+        ['2', '+', '(', '7', '-', '(', '6', '+', '4', ')', ')', '-', '5'],
+        ['2', '+', '(', '7', '-', '(', '6', '+', '4', ')', '-', '2', ')', '-', '5'],
+        ['4', '+', '7', '*', '8', '/', '2', '-', '9', '+'],
+        ['4', '+', '7', '*', '8', '/', '2', '-', '9', '*'],
+        ['(', '3', '-', ')'], ['(', '-', ')'], ['(', '-', '+', ')'],
+        ['-', '5', '+', '-', '8'], ['+', '5', '+', '-', '8'], ['*', '5', '+', '-', '8'],
+        ['/', '+', '5', '+', '-', '8'], ['-', '-', '5'], ['*', '-', '5'],
+        ['-', '+', '5'], ['-', '*', '5'], ['/', '/', '5'],
+        ['8', '-', '-', '11', '*', '2'], ['2', '+', '(', '-', '3', '*', '4', ')'],
+        ['-', '(', '3', ')', '*', '(', '4', ')'],
+        ['+'], ['-'], ['*'], ['/'],
+        ['(', '3', ')', '(', '4', ')'], ['(', '3', ')', '7', '(', '4', ')'],
+        ['(', '3', ')', '+', '7', '(', '4', ')'], ['(', '3', ')', '7', '+', '(', '4', ')'],
+        ['(', ')'], ['8', '-', '(', '-', '-', '11', ')', '*', '2'],
+        # From the checkBalancedParens tests above.
+        ['2', '+', '(', '2'], ['2', ')', '+', '2'],
+        ['2', '+', '(', '4', '-', '(', '7', ')'], ['2', '+', '(', '4', '-', '7', ')', ')'],
+        ['('], [')'],
+        # Other cases.
+        ['(', '+', '3', ')'], ['3', '~', '5'], ['(', '(', '(', '1', ')', ')', ')'],
+        ['-', '(', '-', '(', '-', '2', ')', ')'], ['2', '*', '-', '(', '3', ')'],
+        ['7', '2'], ['2', '(', '3', ')'], ['.5', '*', '-', '.5'],
+        ['~', '1'], ['2', '*', '~', '3'],
+    ]
+    for expression in expressions:
+        input = " ".join(expression)
+        assert singlePassAccepts(input) == multiPassAccepts(input), input
+
+def test_parseToPostfix():
+    assert parseToPostfix("32-5+7*2-3+32/4") == [32, 5, '-', 7, 2, '*', '+', 3, '-', 32, 4, '/', '+']
+    assert parseToPostfix("2 + (7 - (6 + 4) - 2) - 5") == [2, 7, 6, 4, '+', '-', 2, '-', '+', 5, '-']
+    assert parseToPostfix("-5 + -8") == [5, '~', 8, '~', '+']
+    assert parseToPostfix("8 - -11 * 2") == [8, 11, '~', 2, '*', '-']
+    assert parseToPostfix("2 * -.5") == [2, 0.5, '~', '*']
+    assert parseToPostfix("x * 2 + y", allowNames = True) == ['x', 2, '*', 'y', '+']
+
+def test_parseToPostfix_matches_convertToPostfix():
+    for input in ["-2 * 3 - 4 / -(5 + 6)", "2 * -3 * 4", "1 - 2 - 3 + 4 * 5 / 6 / 7"]:
+        expected = [item if item in ops else toNumber(item) for item in convertToPostfix(validateSyntax(parse(input)))]
+        assert parseToPostfix(input) == expected
+
+def test_parseToPostfix_errors():
+    with pytest.raises(CalculationError) as error:
+        parseToPostfix("2 + (3 * 4")
+    assert error.value.message == "Syntax Error"
+    with pytest.raises(CalculationError) as error:
+        parseToPostfix("2 + 3) * 4")
+    assert error.value.position == 5
+    with pytest.raises(CalculationError) as error:
+        parseToPostfix("2 + 7. * 4")
+    assert error.value.message == "Syntax Error: number has a trailing decimal point"
+    with pytest.raises(CalculationError) as error:
+        parseToPostfix("x + 1")
+    assert error.value.message == "Invalid Input: illegal character found."
+    with pytest.raises(CalculationError):
+        parseToPostfix("   ")
+
+def test_parseToPostfix_deep_nesting():
+    depth = 100000
+    assert parseToPostfix("(" * depth + "-1" + ")" * depth) == [1, '~']
+
+def test_calculate():
+    assert calculate("124 + 7 - 3 * 79 - 3") == -109
+    assert calculate("-.5") == -0.5
+    with pytest.raises(CalculationError) as error:
+        calculate("2 * (3")
+    assert error.value.message == "Syntax Error"
+    with pytest.raises(CalculationError) as error:
+        calculate("1 / (2 - 2)")
+    assert error.value.message == "Math Error: division by zero"
+
+def test_CalculationError_pickle():
+    import pickle
+    error = pickle.loads(pickle.dumps(CalculationError("Syntax Error", 4)))
+    assert error.message == "Syntax Error" and error.position == 4
+
+def test_scanInfix_chunks():
+    chunks = ["12 * (3", " + 4.5", ") - 7"]
+    assert scanInfix(chunks, []) == parseToPostfix("".join(chunks))
+    with pytest.raises(CalculationError) as error:
+        scanInfix(["12 * (3", " + 4.5", ") - - - 7"], [])
+    assert error.value.position == 19
+
+def test_StackEvaluator():
+    assert scanInfix(["-2 * (3 + 4.5) / 3"], StackEvaluator()).result() == -5.0
+    evaluator = StackEvaluator()
+    for item in [8, 11, '~', 2, '*', '-']:
+        evaluator.append(item)
+    assert evaluator.result() == 30
+    assert evaluator.stack == [30]
+
+def test_readChunks(tmp_path):
+    path = tmp_path / "expression.txt"
+    path.write_text("123 + 4.56 * (78 - 9)\n")
+    chunks = list(readChunks(str(path), chunkSize = 2))
+    assert "".join(chunks) == "123 + 4.56 * (78 - 9)"
+    assert " 4.56" in chunks and "123" in chunks
+    path.write_text("")
+    assert list(readChunks(str(path))) == []
+
+def test_evaluateFile(tmp_path):
+    path = tmp_path / "expression.txt"
+    path.write_text(" + ".join(["1.5"] * 10000) + "\n")
+    assert evaluateFile(str(path)) == 15000.0
+    path.write_text("(" * 100000 + "-2" + ")" * 100000 + " * 3")
+    assert evaluateFile(str(path)) == -6
+    path.write_text("1 / (2 - 2)")
+    with pytest.raises(CalculationError):
+        evaluateFile(str(path))
+    path.write_text("(1 + 2")
+    with pytest.raises(CalculationError):
+        evaluateFile(str(path))
+
+def test_exactDiv():
+    assert exactDiv(6, 3) == 2 and type(exactDiv(6, 3)) is int
+    assert exactDiv(7, 2) == Fraction(7, 2)
+    assert exactDiv(Fraction(1, 2), 2) == Fraction(1, 4)
+    with pytest.raises(ZeroDivisionError):
+        exactDiv(1, 0)
+
+def test_backends():
+    input = "0.1 + 0.2 - 1 / 3"
+    assert calculate(input) == 0.1 + 0.2 - 1 / 3
+    assert calculate(input, backends["native"]) == calculate(input)
+    assert calculate(input, backends["fraction"]) == Fraction(-1, 30)
+    assert calculate(input, backends["adaptive"]) == Fraction(-1, 30)
+    assert calculate(input, backends["decimal"]) == Decimal("-0.0333333333333333333333333333")
+    assert calculate("1 / 3", decimalBackend(5)) == Decimal("0.33333")
+
+def test_backends_adaptive_stays_int():
+    result = calculate("124 + 7 - 3 * 79 - 3 + 12 / 4", backends["adaptive"])
+    assert result == -106 and type(result) is int
+    result = calculate("-(2 * 3)", backends["adaptive"])
+    assert result == -6 and type(result) is int
+    assert type(calculate("2.5 * 2", backends["adaptive"])) is Fraction
+
+def test_backends_division_by_zero():
+    for backend in backends.values():
+        with pytest.raises(CalculationError):
+            calculate("1 / (2 - 2)", backend)
+        with pytest.raises(CalculationError):
+            calculate("0 / 0", backend)
+
+def test_backends_batch_and_file(tmp_path):
+    import io
+    backend = backends["fraction"]
+    output = io.StringIO()
+    evaluateStream(io.StringIO("1/3\n0.1*3\n"), output, ExpressionCache(backend = backend), backend)
+    assert output.getvalue() == "1/3\n3/10\n"
+    path = tmp_path / "expression.txt"
+    path.write_text("0.1 + 0.2")
+    assert evaluateFile(str(path), backend) == Fraction(3, 10)
+
+def test_getBackend():
+    assert getBackend("native") is None
+    assert getBackend("fraction") is backends["fraction"]
+    assert getBackend("decimal", "5").context.prec == 5
+    assert getBackend("fraction", "5") == False
+    assert getBackend("decimal", "x") == False
+    assert getBackend("binary") == False
+
+def test_CompactProgram():
+    postfix = compileExpression("-(3 + 4.5) * 2 / 3 - 123456789012345678901234567890")
+    program = CompactProgram(postfix)
+    assert len(program) == len(postfix)
+    assert program.postfix() == postfix
+    assert list(program.ints) == [3, 2, 3]
+    assert list(program.floats) == [4.5]
+    assert program.bigInts == [123456789012345678901234567890]
+    assert evaluatePostfix(program) == evaluatePostfix(postfix)
+
+def test_CompactProgram_strings():
+    postfix = convertToPostfix(validateSyntax(parse("0 - 2.5 * (1 + 1)")))
+    program = CompactProgram(postfix)
+    assert program.postfix() == [0, 2.5, 1, 1, '+', '*', '-']
+    assert repr(evaluatePostfix(program)) == repr(evaluatePostfix(postfix))
+
+def test_CompactProgram_invalid():
+    for postfix in [[], ['2', '+'], ['4', '2'], ['~']]:
+        with pytest.raises(ValueError):
+            CompactProgram(postfix)
+    with pytest.raises(ZeroDivisionError):
+        evaluatePostfix(CompactProgram(compileExpression("1 / (2 - 2)")))
+
+def test_CompactProgram_size():
+    postfix = compileExpression(" + ".join(["1234.5"] * 1000))
+    program = CompactProgram(postfix)
+    assert program.size() < 6 * len(postfix)
+
+def test_power():
+    assert calculate("2 ^ 3 ^ 2") == 512
+    assert calculate("-2 ^ 2") == -4
+    assert calculate("(-2) ^ 2") == 4
+    assert calculate("2 * -3 ^ 2") == -18
+    assert calculate("2 ^ -1") == 0.5
+    assert parseToPostfix("2 ^ 3 ^ 2") == [2, 3, 2, '^', '^']
+    assert convertToPostfix(validateSyntax(parse("2 ^ 3 ^ 2"))) == ['2', '3', '2', '^', '^']
+    with pytest.raises(CalculationError) as error:
+        calculate("10 ^ 10 ^ 10")
+    assert error.value.message == "Math Error: result too large"
+    with pytest.raises(CalculationError) as error:
+        calculate("(-8) ^ 0.5")
+    assert error.value.message == "Math Error: undefined result"
+
+def test_mod_and_floorDiv():
+    assert calculate("-7 % 3") == 2
+    assert calculate("7 // -2") == -4
+    assert calculate("7.5 // 2") == 3.0
+    assert calculate("1 + 7 % 4 * 2") == 7
+    assert parse("7//2") == ['7', '//', '2']
+    for input in ["5 % 0", "5 // (1 - 1)"]:
+        with pytest.raises(CalculationError) as error:
+            calculate(input)
+        assert error.value.message == "Math Error: division by zero"
+    assert calculate("-7 % 3", backends["decimal"]) == 2
+    assert calculate("7 // -2", backends["decimal"]) == -4
+
+def test_functions():
+    assert calculate("sqrt(16) + abs(-3)") == 7.0
+    assert calculate("max(1, 2) * min(3 - 1, 4)") == 4
+    assert calculate("-sqrt(4) ^ 2") == -4.0
+    assert parseToPostfix("max(1, 2 + 3)") == [1, 2, 3, '+', 'max']
+    assert evaluatePostfix(convertToPostfix(validateSyntax(parse("max(1, sqrt(4))")))) == 2.0
+    assert calculate("min(1 / 3, 0.3)", backends["adaptive"]) == Fraction(3, 10)
+    assert calculate("sqrt(2)", decimalBackend(5)) == Decimal("1.4142")
+    with pytest.raises(CalculationError) as error:
+        calculate("sqrt(-1)")
+    assert error.value.message == "Math Error: undefined result"
+
+def test_functions_invalid():
+    for input, position in [("min(1)", 5), ("max(1, 2, 3)", 8), ("sqrt(1, 2)", 6), ("sqrt 4", 4),
+                            ("sqrt()", 5), ("max(, 1)", 4), ("(1, 2)", 2), ("1, 2", 1), ("sqrt(2)(3)", 7)]:
+        with pytest.raises(CalculationError) as error:
+            calculate(input)
+        assert (error.value.message, error.value.position) == ("Syntax Error", position), input
+        assert validateSyntax(parse(input)) == False, input
+    with pytest.raises(CalculationError) as error:
+        parseToPostfix("x(2)", True)
+    assert error.value.position == 1
+    with pytest.raises(CalculationError):
+        parseToPostfix("sqrt + 1", True)
+
+def test_registerOperator():
+    registerOperator("<<", 0, lambda l, r: l << r)
+    registerFunction("double", lambda r: 2 * r)
+    registerFunction("hypot", lambda l, r: (l * l + r * r) ** 0.5, 2)
+    try:
+        assert calculate("double(3) << 2") == 24
+        assert calculate("1 + 1 << 2") == 8
+        assert calculate("hypot(3, 4)") == 5.0
+        program = CompactProgram(parseToPostfix("hypot(6, double(4)) * 2"))
+        assert program.evaluate() == 20.0
+        assert compilePostfix(parseToPostfix("double(3) << 2"))() == 24
+        for symbol in ["<<", "double", "x y", "(", "a+", "3d"]:
+            with pytest.raises(ValueError):
+                registerFunction(symbol, abs)
+    finally:
+        unregisterOperator("<<")
+        unregisterOperator("double")
+        unregisterOperator("hypot")
+    with pytest.raises(CalculationError) as error:
+        calculate("double(3)")
+    assert error.value.message == "Invalid Input: illegal character found."
+    with pytest.raises(CalculationError):
+        calculate("1 << 2")
+    assert CompactProgram(parseToPostfix("2 ^ 3 // 2")).evaluate() == 4
+
+def test_Calculator():
+    calculator = Calculator()
+    expression = calculator.compile("2 * (3 + 4) - 1")
+    assert expression.postfix == (2, 3, 4, '+', '*', 1, '-')
+    assert calculator.evaluate(expression) == 13
+    assert calculator.evaluate("7 / 2") == 3.5
+    assert calculator.run("1 + 1") == CalculationResult("1 + 1", 2, None)
+    result = calculator.run("2 * (3")
+    assert result.value is None
+    assert (result.error.message, result.error.position) == ("Syntax Error", 6)
+    results = calculator.map(["1 / 0", "1 / 0", "sqrt(4)"])
+    assert [result.error.message if result.error else result.value for result in results] == [
+        "Math Error: division by zero", "Math Error: division by zero", 2.0]
+    assert results[0].error is not results[1].error
+    assert Calculator("fraction").evaluate("1 / 3 + 1 / 6") == Fraction(1, 2)
+    assert str(Calculator("decimal", 5).evaluate("2 / 3")) == "0.66667"
+    with pytest.raises(ValueError):
+        Calculator("native", 5)
+
+def test_Calculator_names():
+    calculator = Calculator(allowNames = True)
+    expression = calculator.compile("x * (y - 2)")
+    assert expression.names == {"x", "y"}
+    assert calculator.evaluate(expression, {"x": 3, "y": 5}) == 9
+    assert calculator.run(expression, {"x": 3}).error.message == "Invalid Input: unknown variable y."
+    with pytest.raises(CalculationError):
+        Calculator().compile("x + 1")
+
+def test_Calculator_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from random import Random
+    random = Random(0)
+    inputs = ["%d %s %d %s (%d - %d)" % (random.randint(0, 9), random.choice("+-*/^%"), random.randint(0, 9),
+                                         random.choice("+-*/"), random.randint(0, 9), random.randint(0, 9))
+              for i in range(2000)] + ["1 +", "2 * (3", "sqrt(0 - 1)"]
+    calculators = [Calculator(), Calculator("adaptive"), Calculator("decimal", 5), Calculator("decimal", 40)]
+    # Half of the expressions are compiled once and shared by every thread.
+    work = []
+    for i, input in enumerate(inputs):
+        for calculator in calculators:
+            shared = i % 2 and calculator.run(input).error is None
+            work.append((calculator, calculator.compile(input) if shared else input))
+
+    def outcome(item):
+        result = item[0].run(item[1])
+        if result.error is not None:
+            return (result.error.message, result.error.position)
+        return repr(result.value)
+
+    expected = list(map(outcome, work))
+    with ThreadPoolExecutor(16) as executor:
+        for i in range(4):
+            assert list(executor.map(outcome, work, chunksize = 7)) == expected
+
+def test_Limits_parsing():
+    limits = Limits(maxLength = 20, maxTokens = 7, maxDepth = 2)
+    assert calculate("(1 + 2) * 3", None, limits) == 9
+    for input, message, position in [("1 + 2 + 3 + 4 + 5 + 6", "input too long", 20),
+                                     ("1+2+3+4+5", "too many tokens", 7), ("((1 + (2)))", "nesting too deep", 6),
+                                     ("max(1, abs((2)))", "nesting too deep", 11)]:
+        with pytest.raises(CalculationError) as error:
+            calculate(input, None, limits)
+        assert (error.value.message, error.value.position) == ("Limit Error: " + message, position), input
+    # Tokens are counted across the pieces of the expression.
+    assert scanInfix(["1 + 2", " + 3 + ", "4"], [], False, None, Limits(maxTokens = 7)) == [1, 2, '+', 3, '+', 4, '+']
+    with pytest.raises(CalculationError) as error:
+        scanInfix(["1 + 2", " + 3 + ", "4 + 5"], [], False, None, Limits(maxTokens = 7))
+    assert error.value.position == 14
+    with pytest.raises(CalculationError) as error:
+        parseToPostfix("1 + 2", False, None, Limits(deadline = monotonic() - 1))
+    assert error.value.message == "Limit Error: time limit exceeded"
+
+def test_Limits_evaluation():
+    limits = Limits(maxIntBits = 64, maxSteps = 3)
+    assert calculate("2 ^ 63 - 1", None, limits) == 2 ** 63 - 1
+    assert calculate("2 ^ 0.5 * 10.0 ^ 30", None, limits) == 2 ** 0.5 * 10.0 ** 30
+    for input in ["2 ^ 64", "99999999999 * 99999999999", "18446744073709551616", "3 ^ 1000000000"]:
+        with pytest.raises(CalculationError) as error:
+            calculate(input, None, limits)
+        assert error.value.message == "Limit Error: number too large", input
+    with pytest.raises(CalculationError) as error:
+        calculate("(1 / 3) ^ 100", getBackend("fraction"), limits)
+    assert error.value.message == "Limit Error: number too large"
+    with pytest.raises(CalculationError) as error:
+        calculate("1 + 1 + 1 + 1 + 1", None, limits)
+    assert error.value.message == "Limit Error: too many steps"
+    # Squaring doubles the size of a number each time, so the deadline is
+    # checked after each large result.
+    postfix = [3] + [2, "^"] * 40
+    with pytest.raises(CalculationError) as error:
+        evaluateWithBackend(postfix, None, Limits(deadline = monotonic() + 0.01))
+    assert error.value.message == "Limit Error: time limit exceeded"
+
+def test_Limits_checked_operators():
+    limits = Limits(maxIntBits = 64)
+    # Sums of ints cannot outgrow their operands by much, so only the result
+    # is checked.
+    assert calculate("2 ^ 63 + 2 ^ 63 - 2 ^ 63", None, limits) == 2 ** 63
+    with pytest.raises(CalculationError) as error:
+        calculate("2 ^ 63 + 2 ^ 63", None, limits)
+    assert error.value.message == "Limit Error: number too large"
+    with pytest.raises(CalculationError) as error:
+        calculate("1 / 3 + 2 ^ -70 - 2 ^ -70", getBackend("fraction"), limits)
+    assert error.value.message == "Limit Error: number too large"
+    registerOperator("<<", 0, lambda l, r: l << r)
+    try:
+        with pytest.raises(CalculationError) as error:
+            calculate("1 << 100 - 99", None, limits)
+        assert error.value.message == "Limit Error: number too large"
+    finally:
+        unregisterOperator("<<")
+    postfix = [1] + [1, "+"] * 5000
+    assert evaluateWithBackend(postfix, None, Limits(maxSteps = 5000)) == 5001
+    with pytest.raises(CalculationError) as error:
+        evaluateWithBackend(postfix, None, Limits(maxSteps = 4999))
+    assert error.value.message == "Limit Error: too many steps"
+    with pytest.raises(CalculationError) as error:
+        evaluateWithBackend(postfix, None, Limits(deadline = monotonic() - 1))
+    assert error.value.message == "Limit Error: time limit exceeded"
+
+def test_Limits_legacy_pipeline(monkeypatch):
+    from io import StringIO
+    errors = StringIO()
+    monkeypatch.setattr("calculate.stderr", errors)
+    limits = Limits(maxTokens = 5, maxDepth = 1, maxIntBits = 8)
+    assert parse("1 + 2 + 3 + 4", limits = limits) == False
+    assert convertToPostfix(parse("((1))"), limits) == False
+    assert evaluatePostfix(['16', '16', '*'], limits) == False
+    assert evaluatePostfix(['16', '15', '*'], limits) == 240
+    assert evaluatePostfix(['16', '*'], limits) == False
+    assert errors.getvalue().splitlines() == ["Limit Error: too many tokens", "Limit Error: nesting too deep",
+                                              "Limit Error: number too large", "Syntax Error"]
+
+def test_Limits_file_and_Calculator(tmp_path):
+    path = tmp_path / "expression.txt"
+    path.write_text("(" * 1000 + "2" + " * 2)" * 1000)
+    with pytest.raises(CalculationError) as error:
+        evaluateFile(str(path), None, Limits(maxDepth = 100))
+    assert (error.value.message, error.value.position) == ("Limit Error: nesting too deep", 100)
+    with pytest.raises(CalculationError) as error:
+        evaluateFile(str(path), None, Limits(maxIntBits = 100))
+    assert error.value.message == "Limit Error: number too large"
+    calculator = Calculator(limits = Limits(maxSteps = 2), timeout = 10)
+    assert calculator.evaluate("1 + 2 + 3") == 6
+    assert calculator.run("1 + 2 + 3 + 4").error.message == "Limit Error: too many steps"
+    assert Calculator(timeout = 0).run("1 + 1").error.message == "Limit Error: time limit exceeded"
+
+# Python 3.11 and later only convert ints of up to 4300 digits to strings.
+hasDigitLimit = hasattr(sys, "get_int_max_str_digits")
+
+@pytest.mark.skipif(not hasDigitLimit, reason = "no limit on int digits")
+def test_formatResult_too_many_digits():
+    assert formatResult(10 ** 100) == "1" + "0" * 100
+    with pytest.raises(CalculationError) as error:
+        formatResult(10 ** 5000)
+    assert error.value.message == "Math Error: result too large to print"
+    with pytest.raises(CalculationError) as error:
+        parseToPostfix("1" * 5000 + " + 1")
+    assert error.value.message == "Invalid Input: number too long."
+
+@pytest.mark.skipif(not hasDigitLimit, reason = "no limit on int digits")
+def test_Limits_maxIntBits_printable():
+    bits = maxPrintableBits()
+    assert formatResult((1 << bits) - 1) == str((1 << bits) - 1)
+    assert Limits(maxIntBits = bits).maxIntBits == bits
+    with pytest.raises(ValueError):
+        Limits(maxIntBits = bits + 1)
+    with pytest.raises(ValueError):
+        Limits(maxTokens = 10)._replace(maxIntBits = bits + 1)
+    assert Limits(maxIntBits = 64)._replace(maxIntBits = None).maxIntBits is None
+
+@pytest.mark.skipif(not hasDigitLimit, reason = "no limit on int digits")
+def test_main_result_too_many_digits(monkeypatch, capsys):
+    from io import StringIO
+    errors = StringIO()
+    monkeypatch.setattr("calculate.stderr", errors)
+    monkeypatch.setattr("calculate.argv", ["calculate.py", "10 ^ 5000"])
+    main()
+    assert capsys.readouterr().out == ""
+    assert errors.getvalue() == "Math Error: result too large to print\n"
+    output = StringIO()
+    assert evaluateStream(StringIO("10 ^ 5000\n2 ^ 10\n"), output, ExpressionCache()) == 1
+    assert output.getvalue() == "ERROR\n1024\n"
+    assert errors.getvalue().splitlines()[1:] == ["Math Error: result too large to print"]
@@ -0,0 +1,74 @@
+#! /usr/bin/env python3.7
+
+# Tests for columns.py
+
+import io
+
+import pytest
+
+import columns
+from calculate import errorMarker
+from columns import *
+
+numpy = pytest.importorskip("numpy")
+
+def run(input, text, chunkSize = 2):
+    postfix = compileFormula(input)
+    output = io.StringIO()
+    errors = evaluateChunks(postfix, csvChunks(io.StringIO(text), formulaNames(postfix), chunkSize), output)
+    return output.getvalue().splitlines(), errors
+
+def test_fieldValue():
+    assert fieldValue("12") == 12
+    assert fieldValue(" -2.5 ") == -2.5
+    assert fieldValue("") is None
+    assert fieldValue("1e3") is None
+    assert fieldValue("5.") is None
+
+def test_evaluateChunks(monkeypatch):
+    monkeypatch.setattr(columns, "stderr", io.StringIO())
+    text = "price,cost\n10,4\n3.5,1\n0,0\nx,1\n-2,-0.5\n4\n"
+    assert run("(price - cost) / price", text) == (["0.6", "0.7142857142857143", errorMarker, errorMarker,
+                                                    "0.75", errorMarker], 3)
+    assert run("price * cost - 1", text)[0][:3] == ["39", "2.5", "-1"]
+    assert run("price * 0", text)[0][4] == "0"
+    assert columns.stderr.getvalue().splitlines()[:2] == ["Math Error: division by zero",
+                                                          "Invalid Input: price is not a number."]
+
+def test_evaluateChunks_large_ints():
+    big = 2 ** 53 + 1
+    text = "a,b\n%d,1\n%d,3\n" % (big, 2 ** 40)
+    assert run("a * b - 1", text)[0] == [str(big - 1), str(2 ** 40 * 3 - 1)]
+    assert run("a * a * a", text)[0] == [str(big ** 3), str(2 ** 120)]
+
+def test_evaluateChunks_constant():
+    assert run("7 / 2", "a\n1\n2\n3\n") == (["3.5"] * 3, 0)
+
+def test_csvChunks_unknown_column():
+    with pytest.raises(CalculationError) as error:
+        list(csvChunks(io.StringIO("a,b\n1,2\n"), {"a", "c"}))
+    assert error.value.message == "Invalid Input: unknown variable c."
+
+def test_runColumns_npy(tmp_path):
+    numpy.save(str(tmp_path / "price.npy"), numpy.array([10, 3, 2 ** 53 + 1]))
+    numpy.save(str(tmp_path / "cost.npy"), numpy.array([4.0, 1.5, 1.0]))
+    output = tmp_path / "result.txt"
+    assert runColumns("price - cost", str(tmp_path), str(output), chunkSize = 2) == 0
+    assert output.read_text().splitlines() == ["6.0", "1.5", str(2 ** 53 + 1 - 1.0)]
+    assert runColumns("price * 2", str(tmp_path), str(output)) == 0
+    assert output.read_text().splitlines() == ["20", "6", str(2 ** 54 + 2)]
+
+def test_runColumns_binary(tmp_path, monkeypatch):
+    monkeypatch.setattr(columns, "stderr", io.StringIO())
+    input = tmp_path / "input.csv"
+    input.write_text("a,b\n10,4\n3,2\n1,0\n%d,1\n" % 2 ** 60)
+    output = str(tmp_path / "result.npy")
+    assert runColumns("a / b", str(input), output, chunkSize = 3, columnType = "int64") == 3
+    assert numpy.load(output).tolist()[2:] == [0, 2 ** 60]
+    with open(output + ".valid", "rb") as file:
+        assert file.read() == b"\x08"
+    assert runColumns("a * b", str(input), output, columnType = "float64") == 0
+    assert numpy.load(output).tolist() == [40.0, 6.0, 0.0, 2.0 ** 60]
+    assert columns.stderr.getvalue().splitlines() == ["Output Error: result does not fit in int64",
+                                                      "Output Error: result does not fit in int64",
+                                                      "Math Error: division by zero"]
@@ -0,0 +1,94 @@
+#! /usr/bin/env python3.7
+
+# Tests for formulas.py
+
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+import pytest
+
+from calculate import CalculationError
+from calculate import backends
+from formulas import *
+
+def test_FormulaGraph_value():
+    graph = FormulaGraph()
+    graph.define("total", "price * quantity - discount")
+    graph.define("price", "2.5")
+    graph.define("quantity", "4")
+    graph.setValue("discount", 1)
+    assert graph.value("total") == 9.0
+    assert graph.value("quantity") == 4
+
+def test_FormulaGraph_recomputes_dirty_formulas():
+    graph = FormulaGraph()
+    graph.define("a", "1")
+    graph.define("b", "a + 1")
+    graph.define("c", "b * 2")
+    graph.define("other", "5 * 5")
+    assert graph.recompute() == 4
+    assert graph.recompute() == 0
+    graph.define("a", "10")
+    assert graph.dirty == {"a", "b", "c"}
+    assert graph.recompute() == 3
+    assert graph.value("c") == 22
+    graph.define("b", "a - 1")
+    assert graph.recompute() == 2
+
+def test_FormulaGraph_waves():
+    graph = FormulaGraph()
+    graph.define("x", "1")
+    graph.define("left", "x + 1")
+    graph.define("right", "x + 2")
+    graph.define("both", "left * right")
+    assert [sorted(wave) for wave in graph.waves()] == [["x"], ["left", "right"], ["both"]]
+
+def test_FormulaGraph_cycles():
+    graph = FormulaGraph()
+    graph.define("a", "b + 1")
+    graph.define("b", "c + 1")
+    with pytest.raises(CalculationError, match = "circular reference c -> a -> b -> c"):
+        graph.define("c", "a")
+    with pytest.raises(CalculationError, match = "circular reference d -> d"):
+        graph.define("d", "d + 1")
+    assert "c" not in graph.formulas and "d" not in graph.formulas
+    graph.define("c", "2")
+    assert graph.value("a") == 4
+
+def test_FormulaGraph_errors():
+    graph = FormulaGraph()
+    graph.define("ratio", "x / y")
+    graph.define("scaled", "ratio * 2")
+    with pytest.raises(CalculationError, match = "unknown variable x"):
+        graph.value("scaled")
+    graph.define("x", "1")
+    graph.define("y", "0")
+    with pytest.raises(CalculationError, match = "division by zero"):
+        graph.value("scaled")
+    graph.define("y", "4")
+    assert graph.value("scaled") == 0.5
+    graph.remove("y")
+    with pytest.raises(CalculationError, match = "unknown variable y"):
+        graph.value("ratio")
+    with pytest.raises(KeyError):
+        graph.value("y")
+    with pytest.raises(CalculationError):
+        graph.define("bad", "1 +")
+    with pytest.raises(CalculationError, match = "invalid name"):
+        graph.define("2x", "1")
+
+def test_FormulaGraph_backend():
+    graph = FormulaGraph(backends["fraction"])
+    graph.define("third", "1 / 3")
+    graph.define("sum", "third + third + third")
+    assert graph.value("sum") == 1
+    assert type(graph.value("third")) is Fraction
+
+def test_FormulaGraph_executor():
+    graph = FormulaGraph()
+    graph.define("base", "3")
+    for i in range(1000):
+        graph.define("f%d" % i, "base * %d + 1" % i)
+    with ThreadPoolExecutor(2) as executor:
+        assert graph.recompute(executor) == 1001
+    assert graph.value("f999") == 2998
@@ -0,0 +1,132 @@
+#! /usr/bin/env python3.7
+
+# Tests for incremental.py
+
+from random import Random
+
+import pytest
+
+from calculate import CalculationError
+from calculate import backends
+from calculate import calculate
+from incremental import *
+
+def outcome(function, *args):
+    try:
+        return repr(function(*args))
+    except CalculationError as error:
+        return (error.message, error.position)
+
+def test_Session_result():
+    session = Session("2 * (3 + 4) - -1")
+    assert session.result() == 15
+    assert session.reparsed == len(session.text)
+
+def test_Session_unsupported():
+    for text in ["2 ^ 3 + 1", "max(2, 3) * 2"]:
+        with pytest.raises(Unsupported):
+            parseTree(text)
+        session = Session(text)
+        assert session.result() == calculate(text)
+        session.edit(len(text) - 1, 1, "5")
+        assert session.result() == calculate(session.text)
+
+def test_Session_edit_number():
+    session = Session("1 + 2 * (3 + 40) - 5")
+    session.result()
+    session.edit(14, 1, "1")
+    assert session.text == "1 + 2 * (3 + 41) - 5"
+    assert session.result() == 1 + 2 * 44 - 5
+    assert session.reparsed == 3
+    # 3 + 41, 2 * 44, 1 + 88 and 89 - 5.
+    assert session.operations == 4
+
+def test_Session_typing():
+    session = Session("")
+    results = []
+    for char in "12 * (3 + 4.5)":
+        session.edit(len(session.text), 0, char)
+        results.append(outcome(session.result))
+    expected = []
+    for end in range(1, 15):
+        expected.append(outcome(calculate, "12 * (3 + 4.5)"[:end]))
+    assert results == expected
+
+def test_Session_errors():
+    session = Session("(1 + 2) * 3")
+    session.edit(3, 1, "*/")
+    with pytest.raises(CalculationError) as error:
+        session.result()
+    assert (error.value.message, error.value.position) == ("Syntax Error", 4)
+    session.edit(4, 1, "")
+    assert session.result() == 6
+    session.edit(8, 1, "/")
+    session.edit(10, 1, "0")
+    with pytest.raises(CalculationError, match = "division by zero"):
+        session.result()
+    session.edit(10, 1, "4")
+    assert session.result() == 0.5
+    with pytest.raises(ValueError):
+        session.edit(5, 20, "")
+
+def test_Session_replace():
+    session = Session("1 + 2 + 3")
+    session.replace("1 + 20 + 3")
+    assert session.result() == 24
+    assert session.reparsed < 5
+    session.replace("1 + 20 + 3")
+    assert session.reparsed == 0
+
+def test_Session_backend():
+    session = Session("1 / 3 + 1", backends["fraction"])
+    session.edit(4, 1, "6")
+    assert session.result() == calculate("1 / 6 + 1", backends["fraction"])
+
+def test_Session_tilde():
+    for text in ["~1", "2 * ~3"]:
+        assert outcome(Session(text).result) == outcome(calculate, text) == ("Syntax Error", text.index("~"))
+
+def test_Session_matches_calculate():
+    random = Random(0)
+    characters = "0123456789.+-*/() ~x"
+    for trial in range(200):
+        text = "1 + 2 * (3 - 4.5) / (6 + 7) - 8"
+        session = Session(text)
+        for step in range(20):
+            offset = random.randint(0, len(text))
+            length = min(random.choice([0, 1, 2]), len(text) - offset)
+            replacement = "".join(random.choice(characters) for i in range(random.randint(0, 2)))
+            text = text[:offset] + replacement + text[offset + length:]
+            session.edit(offset, length, replacement)
+            assert outcome(session.result) == outcome(calculate, text), text
+
+def test_Session_large_expression():
+    text = " + ".join("(%d * 2)" % i for i in range(1, 20001))
+    session = Session(text)
+    assert session.result() == calculate(text)
+    offset = text.index("(19000 ")
+    session.edit(offset + 1, 5, "1")
+    assert session.result() == calculate(session.text)
+    assert session.reparsed < 10
+    assert session.operations < 1100
+
+def test_changedSpan():
+    assert changedSpan("1 + 2", "1 + 23") == (5, 0, "3")
+    assert changedSpan("1 + 2", "1 * 2") == (2, 1, "*")
+    assert changedSpan("11", "1") == (1, 1, "")
+    assert changedSpan("", "") == (0, 0, "")
+
+def test_Session_operators_and_functions():
+    session = Session("7 % 3 + 9 // 2")
+    assert session.result() == 5
+    session.edit(0, 0, "2 ^ ")
+    assert session.text == "2 ^ 7 % 3 + 9 // 2"
+    assert session.result() == calculate(session.text)
+    session.replace("max(1, sqrt(16)) - 2")
+    assert session.result() == 2.0
+    session.replace("max(1, sqrt(-16)) - 2")
+    with pytest.raises(CalculationError) as error:
+        session.result()
+    assert error.value.message == "Math Error: undefined result"
+    session.replace("1 + 2 * 3")
+    assert session.result() == 7
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3.7
+
+# Tests for instrument.py
+
+import io
+import json
+
+import pytest
+
+import calculate
+import instrument
+from instrument import *
+
+@pytest.fixture
+def instrumentation():
+    yield instrument.enable()
+    instrument.disable()
+
+def test_enable_times_stages(instrumentation):
+    assert calculate.evaluateExpression("1 + 2 * (3 - 4)") == -1
+    assert instrumentation.histograms["parseToPostfix"].count == 1
+    assert instrumentation.histograms["evaluateWithBackend"].count == 1
+    assert instrumentation.histograms["evaluatePostfix"].count == 1
+    assert "parse" not in instrumentation.histograms
+    assert instrumentation.counters == {"tokens": 7, "operators": 3, "maxStackDepth": 4}
+
+def test_enable_legacy_stages(instrumentation):
+    tokens = calculate.parse("(1 + 2) * 3")
+    assert calculate.validateSyntax(tokens)
+    assert calculate.checkBalancedParens(tokens)
+    postfix = calculate.convertToPostfix(tokens)
+    assert calculate.evaluatePostfix(postfix) == 9
+    for stage in ["parse", "validateSyntax", "convertToPostfix", "evaluatePostfix"]:
+        assert instrumentation.histograms[stage].count == 1, stage
+    # validateSyntax checks the parentheses itself, too.
+    assert instrumentation.histograms["checkBalancedParens"].count == 2
+    assert instrumentation.counters == {"tokens": 7, "operators": 2, "maxStackDepth": 2}
+
+def test_disable_restores_functions():
+    parse = calculate.parse
+    instrumentation = instrument.enable()
+    assert calculate.parse is not parse
+    assert instrument.disable() is instrumentation
+    assert calculate.parse is parse
+    assert instrument.disable() is None
+
+def test_hooks_see_failures(instrumentation):
+    calls = []
+    instrumentation.addHook(lambda stage, seconds, args, result: calls.append((stage, args, result)))
+    with pytest.raises(ZeroDivisionError):
+        calculate.evaluatePostfix([1, 0, "/"])
+    assert calls == [("evaluatePostfix", ([1, 0, "/"],), None)]
+    assert instrumentation.histograms["evaluatePostfix"].count == 1
+
+def test_stackDepth():
+    assert stackDepth([]) == 0
+    assert stackDepth([1, "~"]) == 1
+    assert stackDepth([1, 2, "+", 3, "*"]) == 2
+    assert stackDepth([1, 2, 3, 4, "-", "*", "+"]) == 4
+    assert stackDepth(calculate.CompactProgram([1, 2, 3, 4, "-", "*", "+", "~"])) == 4
+
+def test_Histogram():
+    histogram = Histogram()
+    assert histogram.percentile(0.5) == 0
+    for seconds in [0.5e-6, 3e-6, 3e-6, 1e-3]:
+        histogram.add(seconds)
+    assert histogram.count == 4
+    assert histogram.buckets[0] == 1 and histogram.buckets[2] == 2 and histogram.buckets[10] == 1
+    assert histogram.percentile(0.5) == 4e-6
+    assert histogram.percentile(1) == 1e-3
+    histogram.add(1e6)
+    assert histogram.buckets[-1] == 1
+
+def test_export_and_merge():
+    first = Instrumentation()
+    first.record("parse", 2e-6, ("1+2",), ["1", "+", "2"])
+    second = Instrumentation()
+    second.merge(json.loads(json.dumps(first.export())))
+    second.merge(first.export())
+    assert second.histograms["parse"].count == 2
+    assert second.histograms["parse"].max == 2e-6
+    assert second.counters["tokens"] == 6
+    assert "parse" in second.report() and "tokens: 6" in second.report()
+
+def test_main_stats(monkeypatch, capsys):
+    errors = io.StringIO()
+    monkeypatch.setattr(calculate, "argv", ["calculate.py", "--stats=json", "2 * 3"])
+    monkeypatch.setattr(calculate, "stderr", errors)
+    calculate.main()
+    assert capsys.readouterr().out == "6\n"
+    stats = json.loads(errors.getvalue())
+    assert stats["stages"]["evaluatePostfix"]["count"] == 1
+    assert stats["counters"]["operators"] == 1
+    assert instrument.active is None
+
+@pytest.mark.parametrize("options", [[], ["--mode=fraction"], ["--mode=decimal", "--precision=5"],
+                                     ["--mode=adaptive"], ["--file"]])
+def test_main_stats_every_stage_has_samples(monkeypatch, capsys, tmp_path, options):
+    path = tmp_path / "expression.txt"
+    path.write_text("1 / 4 - 2 * (3 + 4)")
+    arguments = [str(path)] if "--file" in options else ["1 / 4 - 2 * (3 + 4)"]
+    errors = io.StringIO()
+    monkeypatch.setattr(calculate, "argv", ["calculate.py", "--stats=json"] + options + arguments)
+    monkeypatch.setattr(calculate, "stderr", errors)
+    calculate.main()
+    assert capsys.readouterr().out.strip() in ("-13.75", "-55/4")
+    stats = json.loads(errors.getvalue())
+    if "--file" in options:
+        assert list(stats["stages"]) == ["evaluateFile"]
+    else:
+        assert {"parseToPostfix", "evaluateWithBackend"} <= set(stats["stages"])
+        assert stats["counters"]["maxStackDepth"] == 4
+    for stage, histogram in stats["stages"].items():
+        assert histogram["count"] > 0, stage
+
+@pytest.mark.parametrize("options", [["--dedup"], ["--jobs=2"], ["--binary=float64"]])
+def test_main_stats_batch(monkeypatch, tmp_path, options):
+    import optimize
+    import parallel
+    path = tmp_path / "batch.txt"
+    path.write_text("1 + 2\n(1 + 2) * 3\n7 / 2\n")
+    if "--binary=float64" in options:
+        options = options + ["--output=" + str(tmp_path / "out.bin")]
+    errors = io.StringIO()
+    monkeypatch.setattr(calculate, "argv", ["calculate.py", "--stats=json", "--batch"] + options + [str(path)])
+    monkeypatch.setattr(calculate, "stderr", errors)
+    parseToPostfix = optimize.parseToPostfix
+    with open(tmp_path / "output.txt", "w") as output:
+        for module in (calculate, optimize, parallel):
+            monkeypatch.setattr(module, "stdout", output)
+        calculate.main()
+    assert optimize.parseToPostfix is parseToPostfix
+    if "--binary=float64" not in options:
+        assert (tmp_path / "output.txt").read_text() == "3\n9\n3.5\n"
+    stats = json.loads(errors.getvalue())
+    assert stats["stages"]["parseToPostfix"]["count"] == 3
+    if "--dedup" not in options:
+        assert stats["stages"]["evaluateWithBackend"]["count"] == 3
+    assert stats["counters"]["tokens"] == 11
@@ -0,0 +1,112 @@
+#! /usr/bin/env python3.7
+
+# Tests for optimize.py
+
+from io import StringIO
+
+import pytest
+
+from calculate import CalculationError
+from calculate import calculate
+from calculate import compileExpression
+from calculate import errorMarker
+from calculate import evaluatePostfix
+from calculate import getBackend
+from optimize import *
+from vectorize import compileFormula
+
+def test_optimizePostfix_constant_folding():
+    program = optimizePostfix(compileExpression("2 * (3 + 4) - 1"))
+    assert program.nodes == [(NUMBER, 13)]
+    assert program.foldedOperations == 3
+    assert program.removedOperations() == 3
+    assert evaluateOptimized(program) == 13
+
+def test_optimizePostfix_keeps_types():
+    for input in ["7 / 7", "2 * 3", "2.0 * 3", "-0.0", "1 - 1.5", "-(-(4 / 2))", "-(-(-0.0))"]:
+        postfix = compileExpression(input)
+        result = evaluateOptimized(optimizePostfix(postfix))
+        expected = evaluatePostfix(postfix)
+        assert result == expected and type(result) is type(expected), input
+        assert repr(result) == repr(expected), input
+
+def test_optimizePostfix_partial_folding():
+    program = optimizePostfix(compileFormula("x * (2 + 3) + 4 / 2"))
+    assert program.nodes == [(NAME, 'x'), (NUMBER, 5), ('*', 0, 1), (NUMBER, 2.0), ('+', 2, 3)]
+    assert evaluateOptimized(program, {"x": 3}) == 17.0
+
+def test_optimizePostfix_common_subexpressions():
+    program = optimizePostfix(compileFormula("(a * b) + (a * b) / 2"))
+    assert program.originalOperations == 4
+    assert program.operations() == 3
+    assert program.removedOperations() == 1
+    assert evaluateOptimized(program, {"a": 3, "b": 4}) == 18.0
+
+def test_optimizePostfix_numbers_of_different_types_are_not_shared():
+    program = optimizePostfix(compileFormula("x * 1 + x * 1.0"))
+    assert program.operations() == 3
+    assert type(evaluateOptimized(program, {"x": 2})) is float
+
+def test_optimizePostfix_unary_minus_chains():
+    program = optimizePostfix(compileFormula("-(-(-x))"))
+    assert program.nodes == [(NAME, 'x'), ('~', 0)]
+    assert evaluateOptimized(program, {"x": 5}) == -5
+    program = optimizePostfix(compileFormula("-(-(-(-x)))"))
+    assert program.nodes == [(NAME, 'x'), ('~', 0), ('~', 1)]
+    assert program.removedOperations() == 2
+    program = optimizePostfix(compileFormula("-(-x)"))
+    assert program.removedOperations() == 0
+    for input in ["-x", "-(-x)", "-(-(-x))", "-(-(-(-x)))"]:
+        postfix = compileFormula(input)
+        result = evaluateOptimized(optimizePostfix(postfix), {"x": -0.0})
+        expected = evaluatePostfix(["-0.0" if item == "x" else item for item in postfix])
+        assert repr(result) == repr(expected), input
+
+def test_optimizePostfix_division_by_zero_not_folded():
+    program = optimizePostfix(compileExpression("1 + 1 / (2 - 2)"))
+    with pytest.raises(ZeroDivisionError):
+        evaluateOptimized(program)
+
+def test_optimizePostfix_invalid():
+    assert optimizePostfix(['2', '+']) == False
+    assert optimizePostfix(['4', '2']) == False
+    assert evaluateOptimized(optimizePostfix(compileFormula("x + y")), {"x": 1}) == False
+
+def test_internBatch_shares_subexpressions():
+    expressions = ["(2 + 3) * 4", "(2 + 3) * 4 - 1", "7 - (2 + 3)", "2 + 3.0"]
+    program = internBatch(expressions)
+    assert program.originalOperations == 8
+    assert program.operations() == 5
+    assert program.dedupRatio() == 1.6
+    results = evaluateBatch(program)
+    assert results == [calculate(input) for input in expressions]
+    assert [type(result) for result in results] == [int, int, int, float]
+
+def test_evaluateBatch_errors_are_separate():
+    expressions = ["1 / 0 + 2", "3 * (1 / 0)", "1 +", "1 / 0 + sqrt(0 - 1)", "sqrt(0 - 1) + 1 / 0", "4 / 2"]
+    results = evaluateBatch(internBatch(expressions))
+    for input, result in zip(expressions[:5], results):
+        with pytest.raises(CalculationError) as expected:
+            calculate(input)
+        assert type(result) is CalculationError, input
+        assert (result.message, result.position) == (expected.value.message, expected.value.position), input
+    assert results[0] is not results[1]
+    assert results[5] == 2.0
+
+def test_evaluateBatch_backend():
+    backend = getBackend("fraction")
+    expressions = ["1 / 3 + 1 / 3", "(1 / 3 + 1 / 3) * 3"]
+    results = evaluateBatch(internBatch(expressions, backend), backend)
+    assert results == [calculate(input, backend) for input in expressions]
+
+def test_runDedupBatch(tmp_path, monkeypatch):
+    errors = StringIO()
+    monkeypatch.setattr("optimize.stderr", errors)
+    path = tmp_path / "batch.txt"
+    path.write_text("(1 + 2) * 3\n(1 + 2) * 3 + 1\n1 / 0\n")
+    with open(tmp_path / "output.txt", "w") as output:
+        monkeypatch.setattr("optimize.stdout", output)
+        assert runDedupBatch(str(path), chunkSize = 2) == 1
+    assert (tmp_path / "output.txt").read_text() == "9\n10\n" + errorMarker + "\n"
+    assert errors.getvalue().splitlines() == ["Math Error: division by zero",
+                                              "6 operations, 4 computed (dedup ratio 1.50)"]
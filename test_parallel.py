@@ -0,0 +1,27 @@
+#! /usr/bin/env python3.7
+
+# Tests for parallel.py
+
+from calculate import CalculationError
+from parallel import *
+
+def test_evaluateChunk():
+    results = evaluateChunk(["2+2", "3 * * 4", "1/0", "1 - 1"])
+    assert results[0] == 4
+    assert isinstance(results[1], CalculationError)
+    assert results[1].message == "Syntax Error"
+    assert results[2].message == "Math Error: division by zero"
+    assert results[3] == 0
+
+def test_chunkExpressions():
+    chunks = list(chunkExpressions(["1+1", "2+2", "3+3", "4" * 20, "5"], chunkSize = 8))
+    assert chunks == [["1+1", "2+2"], ["3+3", "4" * 20], ["5"]]
+    assert list(chunkExpressions([])) == []
+
+def test_evaluateParallel():
+    expressions = ["%d * (%d - 1)" % (i, i) for i in range(2000)] + ["2 +", "7 / 2"]
+    results = evaluateParallel(expressions, workers = 2, chunkSize = 100)
+    assert results[:2000] == [i * (i - 1) for i in range(2000)]
+    assert isinstance(results[2000], CalculationError)
+    assert results[2000].position == 3
+    assert results[2001] == 3.5
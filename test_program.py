@@ -0,0 +1,99 @@
+#! /usr/bin/env python3.7
+
+# Tests for program.py
+
+import struct
+
+import pytest
+
+from calculate import OP_FLOAT
+from calculate import OP_INT
+from calculate import OP_MULT
+from calculate import OP_NEG
+from calculate import compileExpression
+from calculate import evaluatePostfix
+from calculate import registerOperator
+from calculate import unregisterOperator
+from program import *
+
+def test_encodeProgram():
+    code, ints, floats, bigInts = encodeProgram([2, 0.5, '~', '*'])
+    assert code == bytes([OP_INT, OP_FLOAT, OP_NEG, OP_MULT])
+    assert ints == struct.pack("<q", 2)
+    assert floats == struct.pack("<d", 0.5)
+    assert bigInts == b""
+
+def test_encodeProgram_strings():
+    assert encodeProgram(['2', '7', '+']) == encodeProgram([2, 7, '+'])
+
+def test_encodeProgram_invalid():
+    with pytest.raises(ValueError):
+        encodeProgram(['2', '+'])
+    with pytest.raises(ValueError):
+        encodeProgram(['4', '2'])
+    with pytest.raises(ValueError):
+        encodeProgram([])
+
+def test_evaluateCode():
+    code, ints, floats, bigInts = encodeProgram(compileExpression("-(3 + 4.5) * 2 / 3"))
+    ints = struct.unpack("<%dq" % (len(ints) // 8), ints)
+    floats = struct.unpack("<%dd" % (len(floats) // 8), floats)
+    assert evaluateCode(code, ints, floats, bigInts) == -5.0
+
+def test_ProgramLibrary(tmp_path):
+    path = str(tmp_path / "library.cpfx")
+    expressions = {
+        "total": "124 + 7 - 3 * 79 - 3",
+        "ratio": "(7 - 2.5) / .5",
+        "negative": "-8 * -(2 - 11)",
+        "big": "123456789012345678901234567890 * 10 + 1",
+    }
+    writePrograms(path, {name: compileExpression(input) for name, input in expressions.items()})
+    with ProgramLibrary(path) as library:
+        assert library.names() == list(expressions)
+        for name, input in expressions.items():
+            result = library.evaluate(name)
+            assert result == evaluatePostfix(compileExpression(input))
+            assert type(result) is type(evaluatePostfix(compileExpression(input)))
+
+def test_ProgramLibrary_division_by_zero(tmp_path):
+    path = str(tmp_path / "library.cpfx")
+    writePrograms(path, {"zero": compileExpression("1 / (2 - 2)")})
+    with ProgramLibrary(path) as library:
+        with pytest.raises(ZeroDivisionError):
+            library.evaluate("zero")
+
+def test_ProgramLibrary_not_a_library(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        ProgramLibrary(str(path))
+
+def test_ProgramLibrary_truncated(tmp_path):
+    path = str(tmp_path / "library.bin")
+    writePrograms(path, {"sum": compileExpression("1 + 2"), "big": compileExpression("2 ^ 100")})
+    with open(path, "rb") as file:
+        data = file.read()
+    for size in [0, 10, headerFormat.size + 10, headerFormat.size + 2 * entryFormat.size, len(data) - 1]:
+        with open(path, "wb") as file:
+            file.write(data[:size])
+        with pytest.raises(ValueError):
+            ProgramLibrary(path)
+
+def test_ProgramLibrary_different_operators(tmp_path):
+    path = str(tmp_path / "library.cpfx")
+    registerOperator("<>", 0, max)
+    try:
+        writePrograms(path, {"larger": compileExpression("2 <> 3")})
+        with ProgramLibrary(path) as library:
+            assert library.evaluate("larger") == 3
+    finally:
+        unregisterOperator("<>")
+    registerOperator("<>", 0, min)
+    try:
+        with pytest.raises(ValueError):
+            ProgramLibrary(path)
+    finally:
+        unregisterOperator("<>")
+    with pytest.raises(ValueError):
+        ProgramLibrary(path)
@@ -0,0 +1,83 @@
+#! /usr/bin/env python3.7
+
+# Tests for resultcache.py
+
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import calculate
+from resultcache import *
+
+def test_cacheKey():
+    assert cacheKey("  1 +  2 ") == cacheKey("1 + 2")
+    assert cacheKey("1 + 2") != cacheKey("1+2")
+    assert cacheKey("1 / 3") != cacheKey("1 / 3", "fraction")
+    assert cacheKey("1 / 3", "decimal") != cacheKey("1 / 3", "decimal", "5")
+
+def test_ResultCache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert cache.get(cacheKey("1 + 2")) is None
+    cache.put(cacheKey("1 + 2"), "3", False)
+    cache.put(cacheKey("1 / 0"), "Math Error: division by zero", True)
+    assert cache.get(cacheKey(" 1 + 2")) == ("3", False)
+    assert cache.get(cacheKey("1 / 0")) == ("Math Error: division by zero", True)
+    cache.put(cacheKey("1 + 2"), "three", False)
+    assert ResultCache(str(tmp_path / "cache")).get(cacheKey("1 + 2")) == ("three", False)
+
+def test_ResultCache_checks_key(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put(cacheKey("1 + 2"), "3", False)
+    # Another key whose entry happens to be in the same file.
+    os.makedirs(os.path.dirname(cache.entryPath(cacheKey("2 + 1"))), exist_ok = True)
+    os.replace(cache.entryPath(cacheKey("1 + 2")), cache.entryPath(cacheKey("2 + 1")))
+    assert cache.get(cacheKey("2 + 1")) is None
+    with open(cache.entryPath(cacheKey("2 + 1")), "wb") as file:
+        file.write(b"garbage")
+    assert cache.get(cacheKey("2 + 1")) is None
+
+def test_ResultCache_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), maxEntries = 2 * shardCount)
+    for i in range(5000):
+        cache.put(cacheKey(str(i)), str(i), False)
+    files = [name for shard in os.listdir(str(tmp_path)) for name in os.listdir(str(tmp_path / shard))]
+    assert len(files) <= 2 * shardCount
+    assert cache.get(cacheKey("4999")) == ("4999", False)
+    assert not [name for name in files if name.endswith(".tmp")]
+
+def fillCache(directory, start):
+    cache = ResultCache(directory, maxEntries = 4 * shardCount)
+    for i in range(start, start + 500):
+        cache.put(cacheKey(str(i % 250)), str(i % 250), False)
+        assert cache.get(cacheKey(str(i % 250))) in (None, (str(i % 250), False))
+
+def test_ResultCache_processes(tmp_path):
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(fillCache, [str(tmp_path)] * 4, [0, 100, 200, 300]))
+    cache = ResultCache(str(tmp_path))
+    for i in range(250):
+        assert cache.get(cacheKey(str(i))) in (None, (str(i), False))
+
+def test_main_cache(monkeypatch, capsys, tmp_path):
+    errors = io.StringIO()
+    monkeypatch.setattr(calculate, "stderr", errors)
+    monkeypatch.setattr(calculate, "argv", ["calculate.py", "--cache=" + str(tmp_path), "2 *  3"])
+    calculate.main()
+    assert capsys.readouterr().out == "6\n"
+    assert ResultCache(str(tmp_path)).get(cacheKey("2 * 3")) == ("6", False)
+    monkeypatch.setattr(calculate, "argv", ["calculate.py", "--cache=" + str(tmp_path), "--mode=fraction", "1 / 0"])
+    calculate.main()
+    assert errors.getvalue() == "Math Error: division by zero\n"
+    assert ResultCache(str(tmp_path)).get(cacheKey("1 / 0", "fraction")) == ("Math Error: division by zero", True)
+    # Hits are printed without evaluating.
+    ResultCache(str(tmp_path)).put(cacheKey("2 * 3"), "cached", False)
+    calculate.main()
+    monkeypatch.setattr(calculate, "argv", ["calculate.py", "--cache=" + str(tmp_path), "2 * 3"])
+    calculate.main()
+    assert capsys.readouterr().out == "cached\n"
+    assert printCached(["--cache=" + str(tmp_path), "2 * 3"]) == True
+    assert capsys.readouterr().out == "cached\n"
+    assert printCached(["--cache=" + str(tmp_path), "3 * 2"]) == False
+    assert printCached(["--cache=" + str(tmp_path), "--batch", "2 * 3"]) == False
+    assert printCached(["2 * 3"]) == False
+    assert printCached(["--cache=" + str(tmp_path), "--", "--3"]) == False
@@ -0,0 +1,121 @@
+#! /usr/bin/env python3.7
+
+# Tests for server.py and client.py
+
+import asyncio
+import sys
+import threading
+
+import pytest
+
+from calculate import CalculationError
+from calculate import Limits
+from client import *
+from server import *
+
+def test_formatReply():
+    assert formatReply(b"2 + 2\n") == b"OK 4\n"
+    assert formatReply(b"7 / 2\r\n") == b"OK 3.5\n"
+    assert formatReply(b"2 * (3\n") == b"ERROR 6 Syntax Error\n"
+    assert formatReply(b"1 / 0\n") == b"ERROR - Math Error: division by zero\n"
+
+def test_formatReply_limits():
+    assert formatReply(b"2 ^ 2000000 - 1\n", defaultLimits) == b"ERROR - Limit Error: number too large\n"
+    limits = Limits(maxTokens = 3, maxDepth = 1)
+    assert formatReply(b"1 + 2\n", limits, 10) == b"OK 3\n"
+    assert formatReply(b"1 + 2 + 3\n", limits) == b"ERROR 6 Limit Error: too many tokens\n"
+    assert formatReply(b"((1))\n", limits) == b"ERROR 1 Limit Error: nesting too deep\n"
+    assert formatReply(b"1 + 2\n", None, 0) == b"ERROR 0 Limit Error: time limit exceeded\n"
+
+@pytest.mark.skipif(not hasattr(sys, "get_int_max_str_digits"), reason = "no limit on int digits")
+def test_formatReply_too_many_digits():
+    assert formatReply(b"10 ^ 5000\n") == b"ERROR - Math Error: result too large to print\n"
+    assert formatReply(b"10 ^ 4000\n") == b"OK 1" + b"0" * 4000 + b"\n"
+    assert formatReply(b"10 ^ 5000\n", defaultLimits) == b"ERROR - Limit Error: number too large\n"
+    assert formatReply(b"10 ^ 4000\n", defaultLimits).startswith(b"OK 1")
+
+def test_parseReply():
+    assert parseReply(b"OK 4\n") == 4
+    assert parseReply(b"OK -3.5\n") == -3.5
+    error = parseReply(b"ERROR 6 Syntax Error\n")
+    assert isinstance(error, CalculationError)
+    assert error.message == "Syntax Error" and error.position == 6
+    assert parseReply(b"ERROR - Math Error: division by zero\n").position is None
+
+def test_server_pipelining():
+    async def run():
+        server = await startServer(port = 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"".join(b"%d * 2\n" % i for i in range(1000)) + b"3 +\n")
+        writer.write_eof()
+        replies = [await reader.readline() for i in range(1001)]
+        assert await reader.readline() == b""
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return replies
+    replies = asyncio.run(run())
+    assert replies[:1000] == [b"OK %d\n" % (i * 2) for i in range(1000)]
+    assert replies[1000] == b"ERROR 3 Syntax Error\n"
+
+def test_server_concurrent_connections():
+    async def run():
+        server = await startServer(port = 0)
+        port = server.sockets[0].getsockname()[1]
+        async def request(i):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"%d + 1\n" % i)
+            reply = await reader.readline()
+            writer.close()
+            return reply
+        replies = await asyncio.gather(*[request(i) for i in range(50)])
+        server.close()
+        await server.wait_closed()
+        return replies
+    assert asyncio.run(run()) == [b"OK %d\n" % (i + 1) for i in range(50)]
+
+def test_server_slow_expression_does_not_block_others():
+    slow = b" + ".join([b"1.5 * 2"] * 100000) + b"\n"
+    async def run():
+        server = await startServer(port = 0, timeout = None)
+        port = server.sockets[0].getsockname()[1]
+        slowReader, slowWriter = await asyncio.open_connection("127.0.0.1", port)
+        slowWriter.write(slow)
+        slowReply = asyncio.ensure_future(slowReader.readline())
+        await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"1 + 1\n")
+        reply = await reader.readline()
+        finishedFirst = slowReply.done()
+        assert await slowReply == b"OK 300000.0\n"
+        for stream in (slowWriter, writer):
+            stream.close()
+        server.close()
+        await server.wait_closed()
+        return reply, finishedFirst
+    assert asyncio.run(run()) == (b"OK 2\n", False)
+
+def test_client_over_unix_socket(tmp_path):
+    path = str(tmp_path / "calculator.sock")
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(startServer(path = path))
+    thread = threading.Thread(target = loop.run_forever)
+    thread.start()
+    try:
+        client = Client(path = path)
+        assert client.evaluate("124 + 7 - 3 * 79 - 3") == -109
+        expressions = ["%d / 4" % i for i in range(3000)] + ["19 + cinnamon"]
+        results = client.evaluateMany(expressions)
+        assert results[:3000] == [i / 4 for i in range(3000)]
+        assert results[3000].message == "Invalid Input: illegal character found."
+        # The requests and the replies are both larger than the socket
+        # buffers, so the replies must be read while the requests are sent.
+        assert client.evaluateMany(["9 ^ 4000" + " " * 4000] * 1024) == [9 ** 4000] * 1024
+        client.close()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python3.7
+
+# Tests for vectorize.py
+
+import pytest
+
+from calculate import CalculationError
+from calculate import calculate
+from calculate import evaluatePostfix
+from vectorize import *
+
+numpy = pytest.importorskip("numpy")
+
+def test_compileFormula():
+    assert compileFormula("x * 2 + y") == ['x', '2', '*', 'y', '+']
+    assert compileFormula("-(rate_1 - 3)") == ['rate_1', '3', '-', '~']
+    assert compileFormula("x y") == False
+    assert compileFormula("x +") == False
+
+def test_formulaNames():
+    assert formulaNames(compileFormula("x * 2 + y / x")) == {"x", "y"}
+    assert formulaNames(compileFormula("2 + 2")) == set()
+
+def test_evaluateVectorized():
+    x = numpy.array([1, 2, 3])
+    y = numpy.array([0.5, 1.5, 2.5])
+    result = evaluateVectorized(compileFormula("x * 2 + y"), {"x": x, "y": y})
+    assert result.tolist() == [2.5, 5.5, 8.5]
+
+def test_evaluateVectorized_matches_scalar_evaluation():
+    values = [1, 2, 3, 7]
+    postfix = compileFormula("-x * (x - 2) / 4")
+    result = evaluateVectorized(postfix, {"x": numpy.array(values)})
+    for value, vectorized in zip(values, result.tolist()):
+        scalarPostfix = [str(value) if item == "x" else item for item in postfix]
+        assert vectorized == evaluatePostfix(scalarPostfix)
+
+def test_evaluateVectorized_unary_minus():
+    result = evaluateVectorized(compileFormula("-x"), {"x": numpy.array([0.0, 2.0])})
+    assert str(result[0]) == "0.0"
+    assert result[1] == -2.0
+
+def test_evaluateVectorized_functions():
+    x = numpy.array([4.0, 9.0, 16.0])
+    postfix = compileFormula("max(sqrt(x), 3) ^ 2 % 7 + abs(-x) // 5")
+    assert formulaNames(postfix) == {"x"}
+    result = evaluateVectorized(postfix, {"x": x})
+    for value, vectorized in zip(x.tolist(), result.tolist()):
+        scalarPostfix = [str(value) if item == "x" else item for item in postfix]
+        assert vectorized == evaluatePostfix(scalarPostfix)
+    with pytest.raises(ArithmeticError):
+        evaluateVectorized(compileFormula("sqrt(x - 5)"), {"x": x})
+
+def test_evaluateVectorized_negative_powers():
+    x = numpy.array([1, 2, 4])
+    for input, variables in [("x ^ -1", {"x": x}), ("2 ^ (x - 3)", {"x": x}), ("x ^ y", {"x": x, "y": -x})]:
+        postfix = compileFormula(input)
+        result = evaluateVectorized(postfix, variables)
+        for index, vectorized in enumerate(result.tolist()):
+            scalarPostfix = [str(variables[item][index]) if item in variables else item for item in postfix]
+            assert vectorized == evaluatePostfix(scalarPostfix)
+    assert evaluateVectorized(compileFormula("x ^ 2"), {"x": x}).tolist() == [1, 4, 16]
+    with pytest.raises(ZeroDivisionError):
+        evaluateVectorized(compileFormula("x ^ -1"), {"x": x - 1})
+
+def test_evaluateVectorized_fractional_powers():
+    x = numpy.array([4.0, -8.0])
+    postfix = compileFormula("x ^ 0.5")
+    with pytest.raises(ArithmeticError) as vectorError:
+        evaluateVectorized(postfix, {"x": x})
+    with pytest.raises(ArithmeticError) as scalarError:
+        evaluatePostfix(["-8.0", "0.5", "^"])
+    assert str(vectorError.value) == str(scalarError.value)
+    assert evaluateVectorized(postfix, {"x": x[:1]}).tolist() == [2.0]
+    assert evaluateVectorized(compileFormula("x ^ 3"), {"x": x}).tolist() == [64.0, -512.0]
+
+def test_evaluateVectorized_division_by_zero():
+    postfix = compileFormula("1 / (x - 2)")
+    with pytest.raises(ZeroDivisionError):
+        evaluateVectorized(postfix, {"x": numpy.array([1, 2, 3])})
+
+def test_evaluateVectorized_scalars():
+    assert evaluateVectorized(compileFormula("3 * (x - 2)"), {"x": 4}) == 6
+    assert evaluateVectorized(compileFormula("7 / 2"), {}) == 3.5
+
+def test_evaluateVectorized_unknown_variable():
+    assert evaluateVectorized(compileFormula("x + z"), {"x": numpy.array([1])}) == False
+
+def test_postfixShape():
+    shape, literals = postfixShape(["2", "1.5", "*", "~"])
+    assert shape == (int, float, "*", "~")
+    assert literals == [2, 1.5]
+
+def test_shapeKey():
+    assert shapeKey("12 + 3.25 * 4")[0] == shapeKey("7 + 1.5 * 100")[0]
+    assert shapeKey("12 + 3.25 * 4")[0] != shapeKey("12 + 3 * 4")[0]
+    assert shapeKey("12 + 3.25 * 4")[1] == ["12", "3.25", "4"]
+
+def test_evaluateGrouped_matches_calculate():
+    expressions = [str(i) + " * (" + str(i % 7) + ".5 - 3) / " + str(i % 5) for i in range(100)]
+    expressions += ["2 + 3", "2 +", "(1 - 2", "5. + 1", str(1 << 60) + " * 16 - 1"]
+    for i in range(40):
+        expressions.append(str(1 << 30) + " * " + str(i << 28))
+    results = evaluateGrouped(expressions)
+    assert len(results) == len(expressions)
+    for input, result in zip(expressions, results):
+        try:
+            expected = calculate(input)
+        except CalculationError as e:
+            assert type(result) is CalculationError
+            assert str(result) == str(e)
+        else:
+            assert result == expected
+            assert type(result) is type(expected)
@@ -0,0 +1,260 @@
+#! /usr/bin/env python3.7
+
+# Evaluates math expressions with named variables over whole NumPy arrays,
+# one array operation per operator instead of one calculation per value.
+# Batches of expressions that only differ in their numbers are evaluated the
+# same way, with each number position of the shared shape as an array.
+
+import re
+from sys import stderr
+
+from calculate import CalculationError
+from calculate import arities
+from calculate import convertToPostfix
+from calculate import isNameStart
+from calculate import numberPattern
+from calculate import ops
+from calculate import parse
+from calculate import parseToPostfix
+from calculate import toNumber
+from calculate import validateSyntax
+from parallel import evaluateChunk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The NumPy functions evaluateVectorized uses in place of the functions in ops
+# that only take single numbers.
+if numpy is not None:
+    vectorOps = {
+        "^": numpy.power,
+        "sqrt": numpy.sqrt,
+        "abs": numpy.abs,
+        "min": numpy.minimum,
+        "max": numpy.maximum,
+    }
+
+# The operators evaluateGroup evaluates as arrays. Expressions with any other
+# operator or function are evaluated one at a time.
+groupOps = {"+", "-", "*", "/", "~"}
+
+def compileFormula(input):
+    """
+    Parses and validates a math expression that may contain variable names,
+    and converts it to postfix.
+    Parameters: input - The math expression string, e.g. "x * 2 + y".
+    Returns: The postfix expression, or False if the expression is invalid.
+    """
+    expression = parse(input, allowNames = True)
+    if not expression:
+        return False
+    validatedExpression = validateSyntax(expression)
+    if not validatedExpression:
+        return False
+    return convertToPostfix(validatedExpression)
+
+def formulaNames(postfix):
+    """
+    Get the variable names used by a postfix expression.
+    Parameters: postfix - The postfix expression.
+    Returns: A set of variable names.
+    """
+    return {item for item in postfix if isNameStart(item[0]) and item not in ops}
+
+def evaluateVectorized(postfix, variables):
+    """
+    Evaluates a postfix expression with its variables bound to NumPy arrays.
+    Each operator is applied to whole arrays at once, using the same ops table
+    as evaluatePostfix, so unary minus is still 0 - r, except for the
+    functions in vectorOps. As with scalars, dividing by zero raises
+    ZeroDivisionError, here if any divisor element is zero, and the square
+    root of any negative element raises ArithmeticError, as does a negative
+    base raised to a fractional power. Ints raised to negative powers are
+    floats, as they are for scalars. Integer arrays use
+    NumPy's fixed-size integers, which can overflow where Python ints would
+    not.
+    Parameters: postfix - The postfix expression, e.g. from compileFormula.
+                variables - A dictionary mapping variable names to arrays or
+                numbers. Arrays must have compatible (broadcastable) shapes.
+    Returns: The result array, or a number if no arrays were used, or False if
+    the expression is invalid or uses a variable that is not bound.
+    """
+    if numpy is None:
+        raise ImportError("evaluateVectorized requires NumPy")
+
+    if len(postfix) == 0:
+        print("Syntax Error", file = stderr)
+        return False
+
+    evalStack = []
+    for item in postfix:
+        if item not in ops:
+            if isNameStart(item[0]):
+                if item not in variables:
+                    print("Invalid Input: unknown variable " + item + ".", file = stderr)
+                    return False
+                evalStack.append(numpy.asarray(variables[item]))
+            else:
+                evalStack.append(toNumber(item))
+        elif len(evalStack) >= arities[item]:
+            function = vectorOps.get(item, ops[item])
+            r = evalStack.pop()
+            if item in ("/", "%", "//") and numpy.any(numpy.equal(r, 0)):
+                raise ZeroDivisionError("division by zero")
+            if item == "sqrt" and numpy.any(numpy.less(r, 0)):
+                raise ArithmeticError("square root of a negative number")
+            if item == "^":
+                l = evalStack.pop()
+                # NumPy gives nan where Python would give a complex number.
+                if numpy.any(numpy.less(l, 0) & numpy.not_equal(numpy.mod(r, 1), 0)):
+                    raise ArithmeticError("result is not a real number")
+                if numpy.any(numpy.less(r, 0)):
+                    # NumPy cannot raise ints to negative powers, and Python
+                    # gives a float for them, so the base is made a float.
+                    l = numpy.asarray(l)
+                    if numpy.any(numpy.equal(l, 0) & numpy.less(r, 0)):
+                        raise ZeroDivisionError("division by zero")
+                    if l.dtype.kind in "biu":
+                        l = l.astype(numpy.float64)
+                evalStack.append(function(l, r))
+            elif arities[item] == 1:
+                evalStack.append(function(r))
+            else:
+                evalStack.append(function(evalStack.pop(), r))
+        else:
+            print("Syntax Error", file = stderr)
+            return False
+
+    if len(evalStack) != 1:
+        print("Syntax Error", file = stderr)
+        return False
+    return evalStack[0]
+
+# Groups with fewer expressions than this are evaluated one at a time, which
+# is faster than setting up the arrays.
+minGroupSize = 16
+
+# ints stay exact in float64, and so are evaluated the same way as Python
+# ints, up to this magnitude.
+maxExactInt = 1 << 53
+
+digitPattern = re.compile(r"[0-9]+")
+
+def postfixShape(postfix):
+    """
+    Splits a postfix expression into its shape and its numbers.
+    Parameters: postfix - The postfix expression, e.g. from convertToPostfix.
+    Returns: A tuple of the shape, which is the postfix expression as a tuple
+    with each number replaced by its type, int or float, and a list of the
+    numbers in order.
+    """
+    shape = []
+    literals = []
+    for item in postfix:
+        if item in ops:
+            shape.append(item)
+        else:
+            item = toNumber(item)
+            shape.append(type(item))
+            literals.append(item)
+    return tuple(shape), literals
+
+def shapeKey(input):
+    """
+    Get a key that is the same for math expressions that only differ in their
+    numbers, without parsing them. Each run of digits is replaced by "#", so
+    decimal points, and so whether each number is an int or a float, are
+    kept. In postfix, numbers stay in the order they are written, so
+    expressions with the same key have the same postfixShape and their
+    numbers line up.
+    Parameters: input - The math expression string.
+    Returns: A tuple of the key and the numbers, as strings.
+    """
+    return digitPattern.sub("#", input), numberPattern.findall(input)
+
+def evaluateGroup(shape, rows):
+    """
+    Evaluates expressions of the same shape as NumPy array operations over
+    columns of their numbers.
+    Parameters: shape - The shape, from postfixShape. Its operators must be
+                in groupOps.
+                rows - The numbers of each expression, as strings.
+    Returns: A tuple of the list of results and a list of flags for the
+    expressions that must be evaluated on their own instead: those that
+    divide by zero, and those whose ints are too large to be exact.
+    Raises OverflowError if an int does not even fit in 64 bits.
+    """
+    count = len(rows)
+    columns = iter(list(zip(*rows)))
+    stack = []
+    bad = numpy.zeros(count, dtype = bool)
+    with numpy.errstate(all = "ignore"):
+        for item in shape:
+            if item is int:
+                column = numpy.fromiter(map(int, next(columns)), numpy.int64, count)
+                bad |= numpy.abs(column) > maxExactInt
+                stack.append(column)
+            elif item is float:
+                stack.append(numpy.fromiter(map(float, next(columns)), numpy.float64, count))
+            elif item == "~":
+                stack.append(ops[item](stack.pop()))
+            else:
+                r = stack.pop()
+                l = stack.pop()
+                if item == "/":
+                    bad |= r == 0
+                elif l.dtype.kind == "i" and r.dtype.kind == "i":
+                    inexact = numpy.abs(ops[item](l.astype(numpy.float64), r.astype(numpy.float64)))
+                    bad |= inexact > maxExactInt
+                stack.append(ops[item](l, r))
+    return stack[0].tolist(), bad.tolist()
+
+def evaluateGrouped(expressions):
+    """
+    Evaluates a batch of math expressions, grouping those that only differ in
+    their numbers and evaluating each group with NumPy array operations.
+    Expressions in small groups, invalid expressions and those that cannot be
+    evaluated exactly as arrays are evaluated one at a time.
+    Parameters: expressions - A list of math expression strings.
+    Returns: A list with the result of each expression, in input order, or a
+    CalculationError for expressions that could not be evaluated. Results are
+    the same as calculate's.
+    """
+    if numpy is None:
+        raise ImportError("evaluateGrouped requires NumPy")
+
+    results = [None] * len(expressions)
+    single = []
+    groups = {}
+    for index, input in enumerate(expressions):
+        key, literals = shapeKey(input)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = ([], [])
+        group[0].append(index)
+        group[1].append(literals)
+
+    for indexes, rows in groups.values():
+        if len(indexes) < minGroupSize:
+            single += indexes
+            continue
+        try:
+            shape = postfixShape(parseToPostfix(expressions[indexes[0]]))[0]
+            if not groupOps.issuperset(item for item in shape if type(item) is str):
+                single += indexes
+                continue
+            values, bad = evaluateGroup(shape, rows)
+        except (CalculationError, OverflowError):
+            single += indexes
+            continue
+        for index, value, isBad in zip(indexes, values, bad):
+            if isBad:
+                single.append(index)
+            else:
+                results[index] = value
+
+    for index, result in zip(single, evaluateChunk([expressions[index] for index in single])):
+        results[index] = result
+    return results